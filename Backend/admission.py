@@ -0,0 +1,230 @@
+"""Admission control for upstream model calls.
+
+Every `create_chat_completion` call in main.py takes a slot here first.
+At most ADMISSION_MAX_CONCURRENCY calls run at once per worker process,
+and at most ADMISSION_PER_USER_CONCURRENCY of them for one caller. A user
+with several tabs open therefore queues behind their own calls and does
+not hold back everyone else.
+
+Callers that cannot start at once wait in a priority queue. Authenticated
+users who still have `tokens_left` go first; anonymous traffic (and users
+who have run out of tokens) goes after them. Within a priority the queue
+is FIFO. A waiter whose user is at its cap does not block the waiters
+behind it. Background work (summary precomputation) queues behind both.
+
+Waiting is bounded. A call fails with `Rejected` after
+ADMISSION_QUEUE_TIMEOUT_SECONDS in the queue, or immediately when
+ADMISSION_MAX_QUEUE callers are already waiting, so request threads are not
+tied up behind a saturated upstream. main.py turns `Rejected` into a 503
+with Retry-After.
+
+Streamed completions keep their slot until the stream is consumed or closed.
+"""
+import itertools
+import os
+import threading
+import time
+import typing as t
+
+import metrics
+
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY") or "32")
+ADMISSION_PER_USER_CONCURRENCY = int(os.getenv("ADMISSION_PER_USER_CONCURRENCY") or "4")
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE") or "256")
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS") or "5")
+
+PRIORITY_AUTHENTICATED = 0
+PRIORITY_ANONYMOUS = 1
+PRIORITY_BACKGROUND = 2
+_PRIORITY_NAMES = {PRIORITY_AUTHENTICATED: "authenticated", PRIORITY_ANONYMOUS: "anonymous",
+                   PRIORITY_BACKGROUND: "background"}
+
+ADMISSION_IN_FLIGHT = metrics.Gauge("admission_in_flight", "Upstream model calls currently holding an admission slot", ())
+ADMISSION_QUEUE_DEPTH = metrics.Gauge("admission_queue_depth", "Callers waiting for an admission slot", ("priority",))
+ADMISSION_WAIT = metrics.Histogram(
+    "admission_wait_seconds", "Time spent waiting for an admission slot", ("priority", "outcome"),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+ADMISSION_REJECTED = metrics.Counter("admission_rejected_total", "Upstream calls refused by admission control", ("priority", "reason"))
+
+
+class Rejected(Exception):
+    """No admission slot could be obtained (queue full or wait timed out)."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"upstream busy ({reason})")
+        self.reason = reason
+
+
+class Caller(t.NamedTuple):
+    key: str
+    priority: int = PRIORITY_ANONYMOUS
+
+
+class _Waiter:
+    __slots__ = ("caller", "seq", "granted")
+
+    def __init__(self, caller: Caller, seq: int):
+        self.caller = caller
+        self.seq = seq
+        self.granted = False
+
+
+class Slot:
+    """A granted admission; `release()` is idempotent."""
+
+    __slots__ = ("_controller", "_key", "_released")
+
+    def __init__(self, controller: "AdmissionController", key: str):
+        self._controller = controller
+        self._key = key
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(self._key)
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency: int, per_user: int, max_queue: int, timeout: float):
+        self.max_concurrency = max_concurrency
+        self.per_user = per_user
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._per_key: t.Dict[str, int] = {}
+        self._waiting: t.List[_Waiter] = []  # kept sorted by (priority, seq)
+        self._seq = itertools.count()
+
+    def _can_run(self, key: str) -> bool:
+        return self._active < self.max_concurrency and self._per_key.get(key, 0) < self.per_user
+
+    def _grant(self, key: str) -> None:
+        self._active += 1
+        self._per_key[key] = self._per_key.get(key, 0) + 1
+        ADMISSION_IN_FLIGHT.set(self._active)
+
+    def _dispatch(self) -> None:
+        """Grant slots to the best waiters that can run. Caller holds _cond."""
+        granted = False
+        i = 0
+        while i < len(self._waiting) and self._active < self.max_concurrency:
+            w = self._waiting[i]
+            if self._per_key.get(w.caller.key, 0) < self.per_user:
+                del self._waiting[i]
+                w.granted = True
+                self._grant(w.caller.key)
+                self._queue_depth_changed(w.caller.priority)
+                granted = True
+            else:
+                i += 1
+        if granted:
+            self._cond.notify_all()
+
+    def _queue_depth_changed(self, priority: int) -> None:
+        depth = sum(1 for w in self._waiting if w.caller.priority == priority)
+        ADMISSION_QUEUE_DEPTH.set(depth, priority=_PRIORITY_NAMES.get(priority, str(priority)))
+
+    def acquire(self, caller: Caller, timeout: t.Optional[float] = None) -> Slot:
+        prio = _PRIORITY_NAMES.get(caller.priority, str(caller.priority))
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        with self._cond:
+            # nobody ahead of us in the queue: take a free slot straight away
+            if not self._waiting and self._can_run(caller.key):
+                self._grant(caller.key)
+                ADMISSION_WAIT.observe(0.0, priority=prio, outcome="admitted")
+                return Slot(self, caller.key)
+            if len(self._waiting) >= self.max_queue:
+                ADMISSION_REJECTED.inc(priority=prio, reason="queue_full")
+                raise Rejected("queue_full")
+            w = _Waiter(caller, next(self._seq))
+            pos = len(self._waiting)
+            while pos and (self._waiting[pos - 1].caller.priority, self._waiting[pos - 1].seq) > (caller.priority, w.seq):
+                pos -= 1
+            self._waiting.insert(pos, w)
+            self._queue_depth_changed(caller.priority)
+            self._dispatch()
+            deadline = time.monotonic() + timeout
+            while not w.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(w)
+                    self._queue_depth_changed(caller.priority)
+                    ADMISSION_WAIT.observe(time.perf_counter() - start, priority=prio, outcome="timeout")
+                    ADMISSION_REJECTED.inc(priority=prio, reason="timeout")
+                    raise Rejected("timeout")
+                self._cond.wait(remaining)
+        ADMISSION_WAIT.observe(time.perf_counter() - start, priority=prio, outcome="admitted")
+        return Slot(self, caller.key)
+
+    def _release(self, key: str) -> None:
+        with self._cond:
+            self._active -= 1
+            n = self._per_key.get(key, 0) - 1
+            if n > 0:
+                self._per_key[key] = n
+            else:
+                self._per_key.pop(key, None)
+            ADMISSION_IN_FLIGHT.set(self._active)
+            self._dispatch()
+
+    def in_flight(self) -> int:
+        with self._cond:
+            return self._active
+
+    def queued(self) -> int:
+        with self._cond:
+            return len(self._waiting)
+
+
+class HeldStream:
+    """Iterate a streamed completion, releasing its slot when it ends or is closed.
+
+    Callers close it in a `finally` so an abandoned stream frees its slot at
+    once; `__del__` is only a backstop.
+    """
+
+    def __init__(self, stream: t.Iterable, slot: Slot):
+        self._it = iter(stream)
+        self._stream = stream
+        self._slot = slot
+
+    @property
+    def usage(self):
+        return getattr(self._stream, "usage", None)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._it)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        try:
+            close = getattr(self._stream, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._slot.release()
+
+    def __del__(self):
+        self._slot.release()
+
+
+controller = AdmissionController(
+    ADMISSION_MAX_CONCURRENCY,
+    ADMISSION_PER_USER_CONCURRENCY,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TIMEOUT_SECONDS,
+)
+
+
+def acquire(caller: t.Optional[Caller]) -> Slot:
+    return controller.acquire(caller or Caller("unknown"))
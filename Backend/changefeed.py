@@ -0,0 +1,213 @@
+"""Per-user change feed: GET /changes/{user_id}?since=<seq>.
+
+storage.py appends a record to the user's change log for every thread or
+summary write and delete (see `storage.record_change`). Clients keep the
+last `seq` they saw and ask only for what came after it, instead of
+re-fetching whole thread lists:
+
+  - long-poll: the request returns as soon as there are records after
+    `since`, or with an empty list after `timeout` seconds
+    (CHANGES_LONGPOLL_SECONDS by default, at most CHANGES_LONGPOLL_MAX_SECONDS);
+  - SSE (`?stream=true` or `Accept: text/event-stream`): one `change`
+    event per record with `id: <seq>`, so EventSource resumes from
+    Last-Event-ID after a reconnect; a comment line every
+    CHANGES_HEARTBEAT_SECONDS keeps proxies from closing it.
+
+A request without `since` returns the current `seq` at once. A `since`
+older than the retained records (or newer than the log, e.g. after the
+user's data was removed) yields `reset: true`: refetch the lists, then
+continue from the returned `seq`.
+
+Waiting clients cost no file reads. A write in this process wakes them
+directly through `storage.on_change`. Writes from other worker processes
+are picked up by one watcher thread per process, which stat()s the change
+logs of users with waiters every CHANGES_WATCH_INTERVAL_SECONDS and sleeps
+while nobody is waiting. changes_wakeup_latency_seconds measures the time
+from the write to its delivery, by wake-up source.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import typing as t
+
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+import storage
+
+CHANGES_LONGPOLL_SECONDS = float(os.getenv("CHANGES_LONGPOLL_SECONDS") or "25")
+CHANGES_LONGPOLL_MAX_SECONDS = float(os.getenv("CHANGES_LONGPOLL_MAX_SECONDS") or "60")
+CHANGES_HEARTBEAT_SECONDS = float(os.getenv("CHANGES_HEARTBEAT_SECONDS") or "15")
+CHANGES_WATCH_INTERVAL_SECONDS = float(os.getenv("CHANGES_WATCH_INTERVAL_SECONDS") or "0.5")
+
+CHANGES_WAITERS = metrics.Gauge("changes_waiters", "Long-poll and SSE clients waiting on the change feed", ())
+CHANGES_DELIVERED = metrics.Counter("changes_delivered_total", "Change records delivered to clients", ("mode",))
+CHANGES_WAKEUP_LATENCY = metrics.Histogram(
+    "changes_wakeup_latency_seconds", "Time from a storage write to its delivery to a waiting client", ("source",),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+
+class _Waiter:
+    __slots__ = ("user_id", "loop", "event", "source")
+
+    def __init__(self, user_id: str, loop: asyncio.AbstractEventLoop):
+        self.user_id = user_id
+        self.loop = loop
+        self.event = asyncio.Event()
+        self.source = "local"
+
+    def _set(self, source: str) -> None:
+        self.source = source
+        self.event.set()
+
+    def wake(self, source: str) -> None:
+        # called from writer and watcher threads
+        try:
+            self.loop.call_soon_threadsafe(self._set, source)
+        except RuntimeError:
+            pass  # loop already closed
+
+
+class _Hub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters: t.Dict[str, t.Set[_Waiter]] = {}
+        self._sigs: t.Dict[str, t.Optional[t.Tuple[int, int]]] = {}
+        self._someone_waiting = threading.Event()
+        self._watcher: t.Optional[threading.Thread] = None
+
+    def subscribe(self, user_id: str) -> _Waiter:
+        w = _Waiter(user_id, asyncio.get_running_loop())
+        with self._lock:
+            if user_id not in self._waiters:
+                self._waiters[user_id] = set()
+                self._sigs[user_id] = _log_sig(user_id)
+            self._waiters[user_id].add(w)
+            CHANGES_WAITERS.set(sum(len(ws) for ws in self._waiters.values()))
+            self._someone_waiting.set()
+            if self._watcher is None and CHANGES_WATCH_INTERVAL_SECONDS > 0:
+                self._watcher = threading.Thread(target=self._watch_loop, name="changes-watch", daemon=True)
+                self._watcher.start()
+        return w
+
+    def unsubscribe(self, w: _Waiter) -> None:
+        with self._lock:
+            ws = self._waiters.get(w.user_id)
+            if ws is not None:
+                ws.discard(w)
+                if not ws:
+                    del self._waiters[w.user_id]
+                    self._sigs.pop(w.user_id, None)
+            if not self._waiters:
+                self._someone_waiting.clear()
+            CHANGES_WAITERS.set(sum(len(ws) for ws in self._waiters.values()))
+
+    def notify(self, user_id: str, source: str) -> None:
+        with self._lock:
+            waiters = list(self._waiters.get(user_id, ()))
+            if waiters and source == "local":
+                self._sigs[user_id] = _log_sig(user_id)
+        for w in waiters:
+            w.wake(source)
+
+    def _watch_loop(self) -> None:
+        while True:
+            self._someone_waiting.wait()
+            time.sleep(CHANGES_WATCH_INTERVAL_SECONDS)
+            with self._lock:
+                users = list(self._waiters)
+            for user_id in users:
+                sig = _log_sig(user_id)
+                with self._lock:
+                    if user_id not in self._sigs or self._sigs[user_id] == sig:
+                        continue
+                    self._sigs[user_id] = sig
+                self.notify(user_id, "watch")
+
+
+def _log_sig(user_id: str) -> t.Optional[t.Tuple[int, int]]:
+    try:
+        st = storage.change_log(user_id).log.stat()
+        return (st.st_ino, st.st_size)
+    except FileNotFoundError:
+        return None
+
+
+hub = _Hub()
+storage.on_change(lambda user_id, rec: hub.notify(user_id, "local"))
+
+
+def read(user_id: str, since: t.Optional[int]) -> dict:
+    """{"changes": [...], "seq": newest seq, "reset": bool} for records after `since`."""
+    records, floor = storage.read_changes(storage.change_log(user_id))
+    seq = records[-1]["seq"] if records else floor
+    if since is None:
+        return {"changes": [], "seq": seq, "reset": False}
+    if since < floor or since > seq:
+        return {"changes": [], "seq": seq, "reset": True}
+    changes = [
+        {"seq": r["seq"], "thread_id": r.get("t"), "event": r.get("e"), "ts": r.get("ts")}
+        for r in records if r["seq"] > since
+    ]
+    return {"changes": changes, "seq": seq, "reset": False}
+
+
+def _observe_wakeup(w: _Waiter, changes: t.List[dict]) -> None:
+    newest = max((c["ts"] or 0.0 for c in changes), default=0.0)
+    if newest:
+        CHANGES_WAKEUP_LATENCY.observe(max(0.0, time.time() - newest), source=w.source)
+
+
+async def wait_for_changes(user_id: str, since: t.Optional[int], timeout: float) -> dict:
+    """Long-poll: return records after `since` as soon as there are any, or an empty list after `timeout`."""
+    w = hub.subscribe(user_id)
+    try:
+        out = await run_in_threadpool(read, user_id, since)
+        if out["changes"] or out["reset"] or since is None or timeout <= 0:
+            return out
+        try:
+            await asyncio.wait_for(w.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return out
+        out = await run_in_threadpool(read, user_id, since)
+        _observe_wakeup(w, out["changes"])
+        CHANGES_DELIVERED.inc(len(out["changes"]), mode="longpoll")
+        return out
+    finally:
+        hub.unsubscribe(w)
+
+
+def _sse(event: str, data: dict, event_id: t.Optional[int] = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream(user_id: str, since: t.Optional[int]) -> t.AsyncIterator[str]:
+    """SSE: a `change` event per record after `since` (a `reset` event when it is too old), then live updates."""
+    w = hub.subscribe(user_id)
+    try:
+        woken = False
+        while True:
+            w.event.clear()
+            out = await run_in_threadpool(read, user_id, since)
+            if since is None or out["reset"]:
+                yield _sse("reset" if out["reset"] else "seq", {"seq": out["seq"]}, out["seq"])
+                since = out["seq"]
+            if out["changes"]:
+                if woken:
+                    _observe_wakeup(w, out["changes"])
+                CHANGES_DELIVERED.inc(len(out["changes"]), mode="sse")
+                for c in out["changes"]:
+                    yield _sse("change", c, c["seq"])
+                since = out["changes"][-1]["seq"]
+            try:
+                await asyncio.wait_for(w.event.wait(), CHANGES_HEARTBEAT_SECONDS)
+                woken = True
+            except asyncio.TimeoutError:
+                woken = False
+                yield ": keepalive\n\n"
+    finally:
+        hub.unsubscribe(w)
@@ -0,0 +1,488 @@
+"""Gateway that decides whether a /chat message is forwarded to the assistant.
+
+The optional ML topic classifier (`topic_classifier.pkl`) is tried first and
+the keyword heuristics are the fallback. Decisions are memoized in a bounded
+TTL/LRU cache keyed on the normalized message text, the classifier version
+and the threshold, so repeated messages ("hi", "how to make me feel better")
+skip TF-IDF vectorization entirely. Swapping the model clears the cache.
+
+New classifier versions are picked up without a restart: every worker polls
+MODEL_DIR/CURRENT (see `start_model_watcher`), and `POST /admin/model/reload`
+activates a version. A candidate is loaded and checked against SMOKE_SET in
+a background thread while the old model keeps serving, then the (pipeline,
+version) pair is replaced in one assignment.
+
+Config: GATEWAY_CACHE_SIZE (entries, 0 disables; default 10000),
+GATEWAY_CACHE_TTL_SECONDS (default 3600), MODEL_DIR (default Backend/models),
+MODEL_WATCH_INTERVAL_SECONDS (default 15, 0 disables) and
+MODEL_SMOKE_MIN_ACCURACY (default 0.8).
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+import typing as t
+from pathlib import Path
+
+import metrics
+from cache import TTLCache
+
+GATEWAY_CACHE_SIZE = int(os.getenv("GATEWAY_CACHE_SIZE") or "10000")
+GATEWAY_CACHE_TTL_SECONDS = float(os.getenv("GATEWAY_CACHE_TTL_SECONDS") or "3600")
+
+GATEWAY_CACHE_REQUESTS = metrics.Counter(
+    "gateway_cache_requests_total", "Gateway decision cache lookups by result (hit/miss)", ("result",)
+)
+GATEWAY_CACHE_ENTRIES = metrics.Gauge("gateway_cache_entries", "Entries in this process's gateway decision cache", ())
+
+
+def is_personal_topic(text: str) -> bool:
+    """Heuristic check whether the user's text appears to be about personal management,
+    mental state, career, relationships, or anxiety. This is intentionally lightweight
+    — consider replacing with a classifier or safety check for production."""
+    if not text:
+        return False
+    txt = str(text).lower()
+    # keywords indicating personal topics
+    keywords = [
+        "career",
+        "job",
+        "work",
+        "promotion",
+        "manager",
+        "anxiety",
+        "anxious",
+        "depress",
+        "depressed",
+        "mental",
+        "feeling",
+        "feel",
+        "stress",
+        "therapy",
+        "relationship",
+        "partner",
+        "breakup",
+        "decision",
+        "choices",
+        "stuck",
+        "overwhelm",
+        "overwhelmed",
+        "procrastin",
+        "goal",
+        "habit",
+        "routine",
+        "wellbeing",
+        "well-being",
+    ]
+    for k in keywords:
+        if k in txt:
+            return True
+    # also consider first-person phrases about feelings
+    if any(phr in txt for phr in ("i feel", "i'm feeling", "i am feeling", "i am worried", "i'm worried", "i'm stressed", "i feel anxious")):
+        return True
+    return False
+
+
+def _is_greeting_or_smalltalk(text: str) -> bool:
+    if not text:
+        return False
+    txt = text.strip().lower()
+    # common short greetings or smalltalk that should be allowed
+    greetings = [
+        r"^hi\b",
+        r"^hello\b",
+        r"^hey\b",
+        r"^hiya\b",
+        r"^howdy\b",
+        r"^good (morning|afternoon|evening)\b",
+        r"what's up\b",
+        r"^yo\b",
+    ]
+    for g in greetings:
+        try:
+            if re.search(g, txt):
+                # allow very short greetings even when not personal
+                return True
+        except Exception:
+            continue
+
+    small_phrases = [
+        "how are you",
+        "how are things",
+        "what's up",
+        "what is up",
+        "how's it going",
+        "thanks",
+        "thank you",
+        "thanks!",
+    ]
+    for p in small_phrases:
+        if p in txt:
+            return True
+    return False
+
+
+def _is_code_like(text: str) -> bool:
+    if not text:
+        return False
+    txt = text.strip()
+    # detect code fences or presence of multiple codey tokens
+    if txt.startswith("```") or txt.endswith("```"):
+        return True
+    code_indicators = ["def ", "function ", "console.log", "<html", "<div", "var ", "let ", "const ", "import ", "class ", "#include"]
+    hits = 0
+    for ci in code_indicators:
+        if ci in txt:
+            hits += 1
+            if hits >= 2:
+                return True
+    # also detect lots of symbols typical in code
+    sym_count = sum(1 for ch in txt if ch in '{}[]<>;=()')
+    if sym_count >= 3:
+        return True
+    return False
+
+
+def _is_factoid_question(text: str) -> bool:
+    if not text:
+        return False
+    txt = text.strip().lower()
+    # common interrogatives starting a factoid question
+    if re.match(r"^(where|when|who|what|which|how)\b", txt):
+        # short greetings like "how are you" are handled in smalltalk helper
+        # treat explicit 'how to' as non-factoid (tutorial/code) - leave for code detector
+        if txt.startswith("how to") or txt.startswith("how do"):
+            return False
+        return True
+    # explicit question mark often indicates a factoid question
+    if "?" in txt:
+        # exclude obvious smalltalk phrasing
+        if _is_greeting_or_smalltalk(txt):
+            return False
+        return True
+    # keyword-based heuristics
+    keys = ["where is", "located", "address", "coordinates", "what is the capital", "population", "distance to", "timezone", "how many", "how much", "what is", "who is"]
+    if any(k in txt for k in keys):
+        # try to avoid matching personal questions that use 'what is' (e.g., "what is making me anxious") by checking for first-person
+        if "i " in txt or txt.startswith("i"):
+            return False
+        return True
+    return False
+
+
+def is_allowed_for_assistant(text: str) -> bool:
+    """Allow passage to the assistant when the text is clearly a personal-topic query
+    or when it's simple conversational smalltalk/greeting. Block (return False)
+    for messages that appear to be code or clearly non-personal (redirects to other tools).
+    This is a lightweight in-text classifier built from simple heuristics.
+    """
+    if not text:
+        return False
+    # if it looks like code, do not allow here
+    if _is_code_like(text):
+        return False
+    # block simple factoid/general-knowledge questions (e.g., "where is eiffel tower")
+    if _is_factoid_question(text):
+        return False
+
+    # greetings and short smalltalk should be allowed
+    if _is_greeting_or_smalltalk(text):
+        return True
+    # otherwise allow if it appears to be about personal topics
+    return is_personal_topic(text)
+
+
+# --- ML model loading (optional) ---
+# Versioned artifacts live in MODEL_DIR as topic_classifier-<version>.pkl with
+# MODEL_DIR/CURRENT naming the active one (written by
+# tools/train_topic_classifier.py). Without CURRENT the legacy single file
+# next to this module is used and its version is a hash of its contents.
+_MODEL_PATH = Path(__file__).resolve().parent / "topic_classifier.pkl"
+MODEL_DIR = Path(os.getenv("MODEL_DIR") or (Path(__file__).resolve().parent / "models"))
+MODEL_WATCH_INTERVAL_SECONDS = float(os.getenv("MODEL_WATCH_INTERVAL_SECONDS") or "15")
+MODEL_SMOKE_MIN_ACCURACY = float(os.getenv("MODEL_SMOKE_MIN_ACCURACY") or "0.8")
+ARTIFACT_PREFIX = "topic_classifier-"
+
+MODEL_RELOADS = metrics.Counter("gateway_model_reloads_total", "Topic classifier reload attempts by outcome", ("outcome",))
+
+# (text, expected allow decision) a candidate model must mostly agree with before it is swapped in
+SMOKE_SET = [
+    ("Hi", True),
+    ("Thank you", True),
+    ("I feel anxious about my job", True),
+    ("My partner and I keep fighting", True),
+    ("I'm stuck and can't decide whether to quit", True),
+    ("Where is the Eiffel Tower?", False),
+    ("What is the capital of France?", False),
+    ("How do I reverse a linked list in Python?", False),
+]
+
+
+class Model(t.NamedTuple):
+    pipe: t.Any
+    version: str
+
+
+# swapped as a whole so a request never sees one version's pipeline with another's label
+_model = Model(None, "none")
+_listeners: t.List[t.Callable[[t.Any], None]] = []
+_reload_lock = threading.Lock()
+_watched_sig = None
+last_reload: dict = {}
+
+
+def _file_version(path: Path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()[:12]
+
+
+def artifact_path(version: str) -> Path:
+    return MODEL_DIR / f"{ARTIFACT_PREFIX}{version}.pkl"
+
+
+def _resolve_artifact() -> t.Tuple[Path, t.Optional[str]]:
+    """Return (path, version) of the active artifact; version None means hash the file."""
+    try:
+        version = (MODEL_DIR / "CURRENT").read_text(encoding="utf8").strip()
+    except OSError:
+        version = ""
+    if version:
+        return artifact_path(version), version
+    return _MODEL_PATH, None
+
+
+def _artifact_sig(path: Path):
+    try:
+        st = path.stat()
+        return (str(path), st.st_ino, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+def list_versions() -> t.List[str]:
+    try:
+        return sorted(p.name[len(ARTIFACT_PREFIX):-4] for p in MODEL_DIR.glob(f"{ARTIFACT_PREFIX}*.pkl"))
+    except OSError:
+        return []
+
+
+def _read_model(path: Path, version: t.Optional[str] = None) -> Model:
+    # import joblib lazily so the server can run without this optional dependency
+    import joblib
+    pipe = joblib.load(path)
+    return Model(pipe, version or _file_version(path))
+
+
+def validate_model(model: Model) -> t.Tuple[bool, float]:
+    """Run the smoke set through a candidate. Also warms it up before it takes traffic."""
+    if model.pipe is None or not hasattr(model.pipe, "predict_proba"):
+        return False, 0.0
+    try:
+        correct = 0
+        for text, expected in SMOKE_SET:
+            allow, _, _, source = ml_is_allowed_for_assistant(text, threshold=0.5, model=model)
+            if source != 'ml':
+                return False, 0.0
+            correct += bool(allow) == expected
+    except Exception:
+        return False, 0.0
+    accuracy = correct / len(SMOKE_SET)
+    return accuracy >= MODEL_SMOKE_MIN_ACCURACY, accuracy
+
+
+def _install(model: Model) -> None:
+    global _model
+    _model = model
+    _cache.clear()
+    GATEWAY_CACHE_ENTRIES.set(0)
+    for fn in list(_listeners):
+        try:
+            fn(model.pipe)
+        except Exception:
+            pass
+
+
+def on_model_change(fn: t.Callable[[t.Any], None]) -> None:
+    """Call `fn(pipeline)` after every swap (e.g. to refresh derived vectorizers)."""
+    _listeners.append(fn)
+
+
+def load_model(path: t.Optional[Path] = None) -> bool:
+    """Load the active classifier synchronously (startup) and drop cached decisions.
+    Returns True if a model is loaded."""
+    global _watched_sig
+    version = None
+    if path is None:
+        path, version = _resolve_artifact()
+    path = Path(path)
+    _watched_sig = _artifact_sig(path)
+    try:
+        model = _read_model(path, version)
+        print("Loaded topic classifier from", path)
+    except Exception:
+        model = Model(None, "none")
+    _install(model)
+    return model.pipe is not None
+
+
+def reload_model(version: t.Optional[str] = None) -> dict:
+    """Load, validate and swap in a new classifier; the old one keeps serving until the swap.
+
+    With `version`, that artifact is validated and then made CURRENT so other
+    workers' watchers follow. Without it the artifact CURRENT names is reloaded.
+    Returns a report that is also kept in `last_reload`.
+    """
+    global _watched_sig, last_reload
+    with _reload_lock:
+        if version:
+            path = artifact_path(version)
+        else:
+            path, version = _resolve_artifact()
+        sig = _artifact_sig(path)
+        report = {"ts": time.time(), "path": str(path), "previous_version": _model.version}
+        try:
+            candidate = _read_model(path, version)
+        except Exception as e:
+            MODEL_RELOADS.inc(outcome="error")
+            _watched_sig = sig
+            report.update(outcome="error", error=str(e))
+            last_reload = report
+            return report
+        ok, accuracy = validate_model(candidate)
+        report.update(version=candidate.version, smoke_accuracy=round(accuracy, 3))
+        _watched_sig = sig
+        if not ok:
+            MODEL_RELOADS.inc(outcome="invalid")
+            report["outcome"] = "invalid"
+            last_reload = report
+            return report
+        if path.parent == MODEL_DIR and version:
+            _write_current(version)
+            _watched_sig = _artifact_sig(path)
+        _install(candidate)
+        MODEL_RELOADS.inc(outcome="ok")
+        report["outcome"] = "ok"
+        last_reload = report
+        print("Swapped topic classifier to version", candidate.version)
+        return report
+
+
+def _write_current(version: str) -> None:
+    MODEL_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = MODEL_DIR / f".CURRENT.{os.getpid()}.tmp"
+    tmp.write_text(version + "\n", encoding="utf8")
+    os.replace(tmp, MODEL_DIR / "CURRENT")
+
+
+def reload_in_background(version: t.Optional[str] = None) -> threading.Thread:
+    th = threading.Thread(target=reload_model, args=(version,), name="model-reload", daemon=True)
+    th.start()
+    return th
+
+
+def check_for_new_model() -> t.Optional[dict]:
+    """Reload if the active artifact changed on disk since it was last looked at."""
+    path, _ = _resolve_artifact()
+    sig = _artifact_sig(path)
+    if sig is None or sig == _watched_sig:
+        return None
+    return reload_model()
+
+
+def _watch_loop(interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            check_for_new_model()
+        except Exception:
+            pass
+
+
+def start_model_watcher() -> t.Optional[threading.Thread]:
+    """Poll for new artifacts in every worker process (MODEL_WATCH_INTERVAL_SECONDS, 0 disables)."""
+    if MODEL_WATCH_INTERVAL_SECONDS <= 0:
+        return None
+    th = threading.Thread(target=_watch_loop, args=(MODEL_WATCH_INTERVAL_SECONDS,), name="model-watcher", daemon=True)
+    th.start()
+    return th
+
+
+def current_pipeline():
+    return _model.pipe
+
+
+def model_version() -> str:
+    return _model.version
+
+
+def ml_is_allowed_for_assistant(text: str, threshold: float = 0.7, model: t.Optional[Model] = None):
+    """Return tuple (allow: bool|None, label: str, prob: float, source: str).
+    If model not loaded, return (None, '', 0.0, 'none')."""
+    pipe = (model or _model).pipe
+    if not pipe:
+        return None, "", 0.0, 'none'
+    try:
+        probs = pipe.predict_proba([text])[0]
+        labels = list(pipe.classes_)
+        prob_map = dict(zip(labels, probs))
+        # consider allowed if personal or smalltalk probability is high
+        personal_prob = prob_map.get("personal", 0.0) + prob_map.get("smalltalk", 0.0)
+        allow = personal_prob >= threshold
+        # choose top label
+        top_idx = int(probs.argmax()) if hasattr(probs, 'argmax') else probs.index(max(probs))
+        top_label = labels[top_idx]
+        return allow, top_label, float(personal_prob), 'ml'
+    except Exception:
+        return None, "", 0.0, 'error'
+
+
+# --- memoized decision ---
+_cache = TTLCache(maxsize=GATEWAY_CACHE_SIZE, ttl=GATEWAY_CACHE_TTL_SECONDS)
+
+
+class Decision(t.NamedTuple):
+    allowed: bool
+    label: str
+    prob: float
+    source: str
+    cached: bool
+    model_version: str
+
+
+def normalize(text: str) -> str:
+    """Cache key form of a message: case-folded with whitespace collapsed."""
+    return " ".join(str(text or "").split()).casefold()
+
+
+def _decide_uncached(text: str, threshold: float, model: Model) -> t.Tuple[bool, str, float, str]:
+    allow_ml, ml_label, ml_prob, ml_source = ml_is_allowed_for_assistant(text, threshold=threshold, model=model)
+    if allow_ml is None:
+        # model not available or errored — use heuristics
+        allowed = is_allowed_for_assistant(text)
+        return allowed, 'heuristic', 1.0 if allowed else 0.0, 'heuristic'
+    return bool(allow_ml), str(ml_label), float(ml_prob), ml_source
+
+
+def decide(text: str, threshold: float = 0.5) -> Decision:
+    """Classify a message, reusing the cached decision for the same text, model and threshold."""
+    model = _model
+    key = (normalize(text), model.version, float(threshold))
+    hit = _cache.get(key)
+    if hit is not None:
+        GATEWAY_CACHE_REQUESTS.inc(result="hit")
+        return Decision(*hit, True, model.version)
+    GATEWAY_CACHE_REQUESTS.inc(result="miss")
+    decision = _decide_uncached(text, threshold, model)
+    # a transient classifier error should not pin the heuristic answer
+    errored = model.pipe is not None and decision[3] == 'heuristic'
+    if not errored and model is _model:
+        _cache.set(key, decision)
+        GATEWAY_CACHE_ENTRIES.set(len(_cache))
+    return Decision(*decision, False, model.version)
+
+
+load_model()
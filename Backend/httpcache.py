@@ -0,0 +1,63 @@
+"""Conditional GET helpers (ETag / Last-Modified / 304).
+
+Routes look up a cheap version of the stored data (see the `*_version`
+functions in storage.py) before loading anything; if the client's cached
+copy is current the route returns 304 without touching the file contents.
+Tags are weak because GZipMiddleware may change the encoding of the body.
+
+Responses carry `Cache-Control: private, no-cache`, so browsers keep the
+body but revalidate on every fetch, which the frontend's plain `fetch()`
+calls already do.
+"""
+import typing as t
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Request, Response
+
+CACHE_CONTROL = "private, no-cache"
+
+
+def etag_for(kind: str, tag: str) -> str:
+    return f'W/"{kind}-{tag}"'
+
+
+def validator_headers(etag: str, mtime: float) -> t.Dict[str, str]:
+    return {
+        "ETag": etag,
+        "Last-Modified": formatdate(mtime, usegmt=True),
+        "Cache-Control": CACHE_CONTROL,
+    }
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # weak comparison (RFC 9110 §8.8.3.2): ignore the W/ prefix on both sides
+    want = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == want:
+            return True
+    return False
+
+
+def not_modified(request: Request, etag: str, mtime: float) -> t.Optional[Response]:
+    """Return a 304 response if the request's validators match, else None."""
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        fresh = _etag_matches(inm, etag)
+    else:
+        ims = request.headers.get("if-modified-since")
+        if ims is None:
+            return None
+        try:
+            fresh = int(mtime) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return None
+    if not fresh:
+        return None
+    return Response(status_code=304, headers=validator_headers(etag, mtime))
+
+
+def set_validators(response: Response, etag: str, mtime: float) -> None:
+    response.headers.update(validator_headers(etag, mtime))
@@ -1,7 +1,9 @@
 # ...existing code...
-from fastapi import FastAPI, Request, Response
+from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import StreamingResponse, JSONResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 from pydantic import BaseModel
 import os
 from pathlib import Path
@@ -12,8 +14,22 @@ import typing as t
 from datetime import datetime
 import jwt
 import re
+import hmac
+import asyncio
+import contextvars
+import functools
+import queue
+import threading
 from datetime import timedelta
 from passlib.context import CryptContext
+import time
+import metrics
+import tracing
+import serialization
+from serialization import FastJSONResponse
+import httpcache
+import admission
+import promptcache
 
 # Load environment variables from Backend/.env for local/dev only.
 # In production we should NOT override the environment provided by the platform
@@ -35,7 +51,7 @@ if _runtime_env != "production":
 # Initialize OpenAI client
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
 # === CORS Setup ===
 app.add_middleware(
@@ -66,6 +82,46 @@ if _frontend_origins:
     except Exception:
         pass
 
+
+# === Compression ===
+# Compress JSON bodies above GZIP_MIN_BYTES (SSE streams are never compressed).
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES") or "1024")
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_BYTES, compresslevel=6)
+
+# === Metrics middleware ===
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # label by route template (e.g. /messages/{user_id}/{thread_id}) to keep cardinality bounded
+        route = getattr(request.scope.get("route"), "path", None) or "unmatched"
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - start, method=request.method, route=route)
+        metrics.HTTP_REQUESTS.inc(method=request.method, route=route, status=status)
+        metrics.maybe_flush()
+
+
+# === Tracing middleware ===
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    root, token = tracing.start_trace(f"{request.method} {request.url.path}")
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        header = tracing.server_timing_header(root)
+        if header:
+            response.headers["Server-Timing"] = header
+        return response
+    finally:
+        tracing.finish_trace(root, token)
+        route = getattr(request.scope.get("route"), "path", None) or request.url.path
+        tracing.maybe_record(root, route, request.method, status)
+
 # ----- Data Models -----
 
 class ChatRequest(BaseModel):
@@ -94,67 +150,79 @@ class NewMessage(BaseModel):
     content: str
     ts: t.Optional[str] = None
 
+class MessageBatch(BaseModel):
+    messages: t.List[NewMessage]
+
+class ModelReloadRequest(BaseModel):
+    version: t.Optional[str] = None
+
 # ----- Storage helpers -----
-DATA_DIR = Path(__file__).resolve().parent / "data"
-DATA_DIR.mkdir(exist_ok=True)
+from storage import (
+    DATA_DIR,
+    USERS_FILE,
+    load_users,
+    save_users,
+    load_saved_summary,
+    save_summary,
+    load_messages,
+    save_messages,
+    list_thread_files,
+)
+import storage
+import search
+import related
+import retention
+import summaryjobs
+import smalltalk
+import replycache
+import changefeed
+import gateway
+from gateway import (
+    is_personal_topic,
+    is_allowed_for_assistant,
+    ml_is_allowed_for_assistant,
+)
 
-USERS_FILE = DATA_DIR / "users.json"
+# thread vectors for "related threads" reuse the classifier's fitted vectorizer
+related.set_vectorizer(related.vectorizer_from_pipeline(gateway.current_pipeline()))
+gateway.on_model_change(lambda pipe: related.set_vectorizer(related.vectorizer_from_pipeline(pipe)))
 
-def load_users() -> dict:
-    if not USERS_FILE.exists():
-        return {}
-    try:
-        with USERS_FILE.open("r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
 
-def save_users(users: dict):
-    with USERS_FILE.open("w", encoding="utf-8") as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
+@app.on_event("startup")
+def _recover_write_ahead_log():
+    # re-apply writes acknowledged by a process that crashed before its checkpoint
+    storage.start_wal()
 
-def _thread_path(user_id: str, thread_id: str) -> Path:
-    safe_user = "".join(ch for ch in user_id if ch.isalnum() or ch in "-_")
-    safe_thread = "".join(ch for ch in thread_id if ch.isalnum() or ch in "-_")
-    return DATA_DIR / f"{safe_user}__{safe_thread}.json"
 
+@app.on_event("startup")
+def _migrate_storage_layout():
+    # move any flat-layout files into per-user shard directories without blocking startup
+    if str(os.getenv("STORAGE_MIGRATE_ON_STARTUP", "true")).lower() in ("1", "true", "yes"):
+        storage.start_background_migration()
 
-def _summary_path(user_id: str, thread_id: str) -> Path:
-    safe_user = "".join(ch for ch in user_id if ch.isalnum() or ch in "-_")
-    safe_thread = "".join(ch for ch in thread_id if ch.isalnum() or ch in "-_")
-    return DATA_DIR / f"{safe_user}__{safe_thread}__summary.json"
 
+@app.on_event("startup")
+def _start_cold_tier_compaction():
+    # compress threads/summaries idle for COLD_TIER_AFTER_DAYS (0 disables)
+    storage.start_compaction_worker()
 
-def load_saved_summary(user_id: str, thread_id: str) -> t.Optional[dict]:
-    p = _summary_path(user_id, thread_id)
-    if not p.exists():
-        return None
-    try:
-        with p.open("r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return None
 
+@app.on_event("startup")
+def _start_anonymous_data_sweeper():
+    # expire idle anon_* threads via the activity index (ANON_GC_INTERVAL_SECONDS=0 disables)
+    retention.start_sweeper()
 
-def save_summary(user_id: str, thread_id: str, summary: dict):
-    p = _summary_path(user_id, thread_id)
-    with p.open("w", encoding="utf-8") as f:
-        json.dump(summary, f, ensure_ascii=False, indent=2)
 
-def load_messages(user_id: str, thread_id: str) -> t.List[dict]:
-    p = _thread_path(user_id, thread_id)
-    if not p.exists():
-        return []
-    try:
-        with p.open("r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return []
+@app.on_event("startup")
+def _start_summary_precompute():
+    # refresh saved summaries in the background (SUMMARY_PRECOMPUTE_CONCURRENCY=0 disables)
+    summaryjobs.start(_precompute_summary)
 
-def save_messages(user_id: str, thread_id: str, messages: t.List[dict]):
-    p = _thread_path(user_id, thread_id)
-    with p.open("w", encoding="utf-8") as f:
-        json.dump(messages, f, ensure_ascii=False, indent=2)
+
+@app.on_event("startup")
+def _start_model_watcher():
+    # pick up a new topic classifier version without restarting workers
+    gateway.start_model_watcher()
 
 # --- JWT helpers (dev-only simple tokens)
 JWT_SECRET = os.getenv("JWT_SECRET") or "dev_jwt_secret"
@@ -206,6 +274,11 @@ def estimate_tokens_for_summary(conversation: list) -> int:
         return 200
 
 def _get_auth_subject_from_request(request: Request) -> t.Optional[str]:
+    with tracing.span("auth.subject"):
+        return _auth_subject(request)
+
+
+def _auth_subject(request: Request) -> t.Optional[str]:
     try:
         # prefer cookie auth_token (httpOnly cookie)
         try:
@@ -226,8 +299,6 @@ def _get_auth_subject_from_request(request: Request) -> t.Optional[str]:
 
 
 # --- Basic in-memory rate limiter (per-subject or per-ip)
-import time
-
 RATE_LIMIT_STORE: dict = {}
 
 def _rate_limit_key_for_request(request: Request) -> str:
@@ -248,7 +319,9 @@ def _rate_limit_key_for_request(request: Request) -> str:
 
 def check_rate_limit(request: Request, limit: int = 60, window_seconds: int = 60) -> t.Tuple[bool, int]:
     """Returns (allowed:bool, remaining:int)"""
-    key = _rate_limit_key_for_request(request)
+    return _take_rate_limit(_rate_limit_key_for_request(request), limit, window_seconds)
+
+def _take_rate_limit(key: str, limit: int, window_seconds: int) -> t.Tuple[bool, int]:
     now = int(time.time())
     entry = RATE_LIMIT_STORE.get(key)
     if not entry or now - entry.get("ts", 0) >= window_seconds:
@@ -264,6 +337,7 @@ def check_rate_limit(request: Request, limit: int = 60, window_seconds: int = 60
 
 MAX_MESSAGE_LENGTH = 4000
 MAX_CONVERSATION_MESSAGES = 500
+MAX_BATCH_MESSAGES = int(os.getenv("MAX_BATCH_MESSAGES") or "50")
 
 def validate_message_text(text: str) -> t.Optional[JSONResponse]:
     if text is None:
@@ -276,193 +350,6 @@ def validate_message_text(text: str) -> t.Optional[JSONResponse]:
     return None
 
 
-def is_personal_topic(text: str) -> bool:
-    """Heuristic check whether the user's text appears to be about personal management,
-    mental state, career, relationships, or anxiety. This is intentionally lightweight
-    — consider replacing with a classifier or safety check for production."""
-    if not text:
-        return False
-    txt = str(text).lower()
-    # keywords indicating personal topics
-    keywords = [
-        "career",
-        "job",
-        "work",
-        "promotion",
-        "manager",
-        "anxiety",
-        "anxious",
-        "depress",
-        "depressed",
-        "mental",
-        "feeling",
-        "feel",
-        "stress",
-        "therapy",
-        "relationship",
-        "partner",
-        "breakup",
-        "decision",
-        "choices",
-        "stuck",
-        "overwhelm",
-        "overwhelmed",
-        "procrastin",
-        "goal",
-        "habit",
-        "routine",
-        "wellbeing",
-        "well-being",
-    ]
-    for k in keywords:
-        if k in txt:
-            return True
-    # also consider first-person phrases about feelings
-    if any(phr in txt for phr in ("i feel", "i'm feeling", "i am feeling", "i am worried", "i'm worried", "i'm stressed", "i feel anxious")):
-        return True
-    return False
-
-
-def _is_greeting_or_smalltalk(text: str) -> bool:
-    if not text:
-        return False
-    txt = text.strip().lower()
-    # common short greetings or smalltalk that should be allowed
-    greetings = [
-        r"^hi\b",
-        r"^hello\b",
-        r"^hey\b",
-        r"^hiya\b",
-        r"^howdy\b",
-        r"^good (morning|afternoon|evening)\b",
-        r"what's up\b",
-        r"^yo\b",
-    ]
-    for g in greetings:
-        try:
-            if re.search(g, txt):
-                # allow very short greetings even when not personal
-                return True
-        except Exception:
-            continue
-
-    small_phrases = [
-        "how are you",
-        "how are things",
-        "what's up",
-        "what is up",
-        "how's it going",
-        "thanks",
-        "thank you",
-        "thanks!",
-    ]
-    for p in small_phrases:
-        if p in txt:
-            return True
-    return False
-
-
-def _is_code_like(text: str) -> bool:
-    if not text:
-        return False
-    txt = text.strip()
-    # detect code fences or presence of multiple codey tokens
-    if txt.startswith("```") or txt.endswith("```"):
-        return True
-    code_indicators = ["def ", "function ", "console.log", "<html", "<div", "var ", "let ", "const ", "import ", "class ", "#include"]
-    hits = 0
-    for ci in code_indicators:
-        if ci in txt:
-            hits += 1
-            if hits >= 2:
-                return True
-    # also detect lots of symbols typical in code
-    sym_count = sum(1 for ch in txt if ch in '{}[]<>;=()')
-    if sym_count >= 3:
-        return True
-    return False
-
-
-def _is_factoid_question(text: str) -> bool:
-    if not text:
-        return False
-    txt = text.strip().lower()
-    # common interrogatives starting a factoid question
-    if re.match(r"^(where|when|who|what|which|how)\b", txt):
-        # short greetings like "how are you" are handled in smalltalk helper
-        # treat explicit 'how to' as non-factoid (tutorial/code) - leave for code detector
-        if txt.startswith("how to") or txt.startswith("how do"):
-            return False
-        return True
-    # explicit question mark often indicates a factoid question
-    if "?" in txt:
-        # exclude obvious smalltalk phrasing
-        if _is_greeting_or_smalltalk(txt):
-            return False
-        return True
-    # keyword-based heuristics
-    keys = ["where is", "located", "address", "coordinates", "what is the capital", "population", "distance to", "timezone", "how many", "how much", "what is", "who is"]
-    if any(k in txt for k in keys):
-        # try to avoid matching personal questions that use 'what is' (e.g., "what is making me anxious") by checking for first-person
-        if "i " in txt or txt.startswith("i"):
-            return False
-        return True
-    return False
-
-
-def is_allowed_for_assistant(text: str) -> bool:
-    """Allow passage to the assistant when the text is clearly a personal-topic query
-    or when it's simple conversational smalltalk/greeting. Block (return False)
-    for messages that appear to be code or clearly non-personal (redirects to other tools).
-    This is a lightweight in-text classifier built from simple heuristics.
-    """
-    if not text:
-        return False
-    # if it looks like code, do not allow here
-    if _is_code_like(text):
-        return False
-    # block simple factoid/general-knowledge questions (e.g., "where is eiffel tower")
-    if _is_factoid_question(text):
-        return False
-
-    # greetings and short smalltalk should be allowed
-    if _is_greeting_or_smalltalk(text):
-        return True
-    # otherwise allow if it appears to be about personal topics
-    return is_personal_topic(text)
-
-
-# --- ML model loading (optional) ---
-_MODEL_PATH = Path(__file__).resolve().parent / "topic_classifier.pkl"
-_topic_pipe = None
-try:
-    # import joblib lazily so the server can run without this optional dependency
-    import joblib as _joblib
-    _topic_pipe = _joblib.load(_MODEL_PATH)
-    print("Loaded topic classifier from", _MODEL_PATH)
-except Exception:
-    _topic_pipe = None
-
-
-def ml_is_allowed_for_assistant(text: str, threshold: float = 0.7):
-    """Return tuple (allow: bool|None, label: str, prob: float, source: str).
-    If model not loaded, return (None, '', 0.0, 'none')."""
-    if not _topic_pipe:
-        return None, "", 0.0, 'none'
-    try:
-        probs = _topic_pipe.predict_proba([text])[0]
-        labels = list(_topic_pipe.classes_)
-        prob_map = dict(zip(labels, probs))
-        # consider allowed if personal or smalltalk probability is high
-        personal_prob = prob_map.get("personal", 0.0) + prob_map.get("smalltalk", 0.0)
-        allow = personal_prob >= threshold
-        # choose top label
-        top_idx = int(probs.argmax()) if hasattr(probs, 'argmax') else probs.index(max(probs))
-        top_label = labels[top_idx]
-        return allow, top_label, float(personal_prob), 'ml'
-    except Exception:
-        return None, "", 0.0, 'error'
-
 def validate_conversation(conv: list) -> t.Optional[JSONResponse]:
     if not isinstance(conv, list) or len(conv) == 0:
         return JSONResponse(status_code=400, content={"detail": "conversation must be a non-empty list"})
@@ -494,6 +381,102 @@ def extract_delta_text(chunk) -> str:
         except Exception:
             return ""
 
+def create_chat_completion(endpoint: str, caller: t.Optional[admission.Caller] = None,
+                           slot: t.Optional[admission.Slot] = None, **kwargs):
+    """Single entry point for upstream chat.completions calls; records call latency.
+
+    The call first takes an admission slot for `caller` (see admission.py) and
+    raises `admission.Rejected` if none frees up in time; pass an already
+    acquired `slot` to skip the wait. Streams hold the slot until they are
+    exhausted or closed, and expose the reported token usage as `.usage` once
+    consumed.
+    """
+    if slot is None:
+        with tracing.span("admission.wait", endpoint=endpoint):
+            slot = admission.acquire(caller)
+    if kwargs.get("stream"):
+        # ask for the trailing usage chunk so cached prompt tokens are reported
+        kwargs.setdefault("stream_options", {"include_usage": True})
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        with tracing.span("openai", endpoint=endpoint):
+            resp = client.chat.completions.create(**kwargs)
+    except BaseException:
+        outcome = "error"
+        slot.release()
+        raise
+    finally:
+        metrics.OPENAI_LATENCY.observe(
+            time.perf_counter() - start,
+            endpoint=endpoint,
+            stream=bool(kwargs.get("stream")),
+            outcome=outcome,
+        )
+    if kwargs.get("stream"):
+        return admission.HeldStream(promptcache.UsageStream(resp, endpoint), slot)
+    slot.release()
+    promptcache.record_usage(endpoint, getattr(resp, "usage", None))
+    return resp
+
+
+def _admission_caller(request: Request, user_id: t.Optional[str] = None) -> admission.Caller:
+    """Admission identity and priority: authenticated users with tokens left go first."""
+    subject = _get_auth_subject_from_request(request)
+    if subject:
+        u = load_users().get(subject) or {}
+        try:
+            left = int(u.get("tokens_left", 0) or 0)
+        except Exception:
+            left = 0
+        if left > 0:
+            return admission.Caller(f"user:{subject}", admission.PRIORITY_AUTHENTICATED)
+        return admission.Caller(f"user:{subject}", admission.PRIORITY_ANONYMOUS)
+    if user_id:
+        return admission.Caller(f"user:{user_id}", admission.PRIORITY_ANONYMOUS)
+    return admission.Caller(_rate_limit_key_for_request(request), admission.PRIORITY_ANONYMOUS)
+
+
+def _tokens_left(user_id: str) -> int:
+    try:
+        return int((load_users().get(user_id) or {}).get("tokens_left", 0) or 0)
+    except Exception:
+        return 0
+
+
+def _refund_tokens(user_id: str, amount: int, endpoint: str, counter=metrics.TOKENS_REFUNDED) -> None:
+    """Give back tokens reserved for a call that never reached the model."""
+    try:
+        users = load_users()
+        u = users.get(user_id)
+        if u:
+            try:
+                cur = int(u.get("tokens_left", 0) or 0)
+            except Exception:
+                cur = 0
+            u["tokens_left"] = cur + amount
+            users[user_id] = u
+            save_users(users)
+            counter.inc(amount, endpoint=endpoint)
+    except Exception:
+        pass
+
+
+def _refund_cached_tokens(user_id: str, usages: t.Iterable, reserved: int, endpoint: str) -> int:
+    """Refund the cached-token discount for calls charged at full price; returns the refund."""
+    discount = min(reserved, sum(promptcache.cached_discount(u) for u in usages))
+    if discount > 0:
+        _refund_tokens(user_id, discount, endpoint, metrics.TOKENS_CACHE_DISCOUNT)
+    return max(0, discount)
+
+
+def _busy_response(e: "admission.Rejected") -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(e)},
+        headers={"Retry-After": str(max(1, int(admission.ADMISSION_QUEUE_TIMEOUT_SECONDS)))},
+    )
+
 # ----- Prompt templates (override via ENV if needed) -----
 CURRENT_PROMPT = os.getenv("CURRENT_PROMPT") or (
     "Summarize the user's CURRENT STATE in a personal, second-person tone. "
@@ -509,6 +492,68 @@ SUGGESTED_PROMPT = os.getenv("SUGGESTED_PROMPT") or (
     "Write in a direct, second-person voice (imperative or short phrase)."
 )
 
+# ----- Summary post-processing (shared by the /summary routes) -----
+
+def limit_sentences(text: str, max_sentences: int = 3, max_words: int = 60) -> str:
+    if not text:
+        return ""
+    cleaned = str(text).replace("\n", " ").strip()
+    if not cleaned:
+        return ""
+    sentences = re.split(r'(?<=[.!?])\s+', cleaned)
+    taken = " ".join(sentences[:max_sentences])
+    words = taken.split()
+    if len(words) > max_words:
+        return " ".join(words[:max_words]) + "…"
+    return taken
+
+
+def extract_list_items(text: str):
+    if not text:
+        return []
+    normalized = str(text).replace('\r\n', '\n').strip()
+    if not normalized:
+        return []
+    lines = [l.strip() for l in normalized.split('\n') if l.strip()]
+    bullets = [l for l in lines if l.startswith('-') or l.startswith('•') or l[0].isdigit()]
+    if bullets:
+        return [re.sub(r'^[-•*\d\.\)\s]+', '', l).strip() for l in bullets]
+    # fallback to sentence split
+    sents = re.split(r'(?<=[.!?])\s+', normalized)
+    if len(sents) > 1:
+        return sents
+    # fallback split by semicolon
+    parts = [p.strip() for p in normalized.split(';') if p.strip()]
+    return parts if parts else [normalized]
+
+
+def process_current(text: str) -> str:
+    return limit_sentences(text, max_sentences=3, max_words=60)
+
+
+def process_uncovered(text: str):
+    items = extract_list_items(text)
+    return items[:3]
+
+
+def process_suggested(text: str):
+    items = extract_list_items(text)
+    # shorten titles to first clause and cap length
+    out = []
+    for it in items[:4]:
+        title = it.split(':')[0].split(' - ')[0].strip()
+        words = title.split()[:12]
+        out.append(' '.join(words))
+    return out
+
+
+# (section key, prompt, post-processor), in display order
+SUMMARY_SECTIONS = (
+    ("current_state", CURRENT_PROMPT, process_current),
+    ("what_we_uncovered", UNCOVERED_PROMPT, process_uncovered),
+    ("suggested_next_steps", SUGGESTED_PROMPT, process_suggested),
+)
+
 # ----- Routes -----
 
 @app.get("/")
@@ -516,6 +561,63 @@ def health_check():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus text exposition, aggregated across all worker processes."""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") or ""
+
+
+def _check_admin(request: Request) -> t.Optional[JSONResponse]:
+    # admin routes are disabled unless ADMIN_TOKEN is configured
+    if not ADMIN_TOKEN:
+        return JSONResponse(status_code=404, content={"detail": "Not Found"})
+    supplied = request.headers.get("x-admin-token") or ""
+    if not hmac.compare_digest(supplied.encode("utf8"), ADMIN_TOKEN.encode("utf8")):
+        return JSONResponse(status_code=403, content={"detail": "forbidden"})
+    return None
+
+
+@app.get("/admin/model")
+def admin_model_status(request: Request):
+    err = _check_admin(request)
+    if err:
+        return err
+    return {
+        "version": gateway.model_version(),
+        "loaded": gateway.current_pipeline() is not None,
+        "available_versions": gateway.list_versions(),
+        "last_reload": gateway.last_reload or None,
+    }
+
+
+@app.post("/admin/model/reload", status_code=202)
+def admin_model_reload(request: Request, body: t.Optional[ModelReloadRequest] = None):
+    """Load (and with `version`, activate) a classifier in the background.
+    Other workers follow through their watcher once CURRENT changes."""
+    err = _check_admin(request)
+    if err:
+        return err
+    version = body.version if body else None
+    if version and (not re.fullmatch(r"[A-Za-z0-9._-]+", version) or not gateway.artifact_path(version).exists()):
+        return JSONResponse(status_code=404, content={"detail": "unknown model version"})
+    gateway.reload_in_background(version)
+    return {"status": "reloading", "current_version": gateway.model_version(), "requested_version": version}
+
+
+def _bearer_subject(request: Request) -> t.Optional[str]:
+    try:
+        auth_hdr = request.headers.get("authorization") or request.headers.get("Authorization")
+        if auth_hdr and auth_hdr.lower().startswith("bearer "):
+            token = auth_hdr.split(None, 1)[1]
+            return verify_token(token)
+    except Exception:
+        return None
+    return None
+
+
 @app.post("/message")
 async def append_message(msg: NewMessage, request: Request):
     # Log the incoming payload for debugging when validation fails
@@ -536,14 +638,7 @@ async def append_message(msg: NewMessage, request: Request):
     # token subject matches the supplied user_id. Allow anonymous 'anon_*' ids
     # without a token (client-side anon logic remains). If token valid,
     # enforce and decrement server-side credits/messages_left on user messages.
-    auth = None
-    try:
-        auth_hdr = request.headers.get("authorization") or request.headers.get("Authorization")
-        if auth_hdr and auth_hdr.lower().startswith("bearer "):
-            token = auth_hdr.split(None, 1)[1]
-            auth = verify_token(token)
-    except Exception:
-        auth = None
+    auth = _bearer_subject(request)
     try:
         # If a token was provided, ensure it matches the user being written to
         if auth and auth != msg.user_id:
@@ -560,12 +655,89 @@ async def append_message(msg: NewMessage, request: Request):
         }
         messages.append(entry)
         save_messages(msg.user_id, msg.thread_id, messages)
+        summaryjobs.note_messages(msg.user_id, msg.thread_id, len(messages))
+        try:
+            search.index_message(msg.user_id, msg.thread_id, len(messages) - 1, entry["role"], entry["content"], entry["ts"])
+        except Exception as e:
+            # the index can always be rebuilt from the stores; never fail the write
+            print(f"[append_message] search indexing failed: {e}")
+        try:
+            related.index_message(msg.user_id, msg.thread_id, entry["content"])
+        except Exception as e:
+            print(f"[append_message] related-threads indexing failed: {e}")
         return {"ok": True, "count": len(messages)}
     except Exception as e:
         print(f"[append_message] error saving messages: {e}; payload: {raw}")
         return JSONResponse(status_code=500, content={"detail": str(e)})
 
 
+@app.post("/messages/batch")
+def append_messages_batch(batch: MessageBatch, request: Request):
+    """Append several messages, for one or more user/thread pairs, in one request.
+
+    Messages for the same thread are applied in request order with a single
+    load and a single save. Authorization and validation follow POST /message
+    and are checked per message. Returns one result per input message, in
+    order: {"index", "ok": true, "count"} or {"index", "ok": false, "status", "detail"}.
+    """
+    if not batch.messages:
+        return JSONResponse(status_code=400, content={"detail": "messages cannot be empty"})
+    if len(batch.messages) > MAX_BATCH_MESSAGES:
+        return JSONResponse(status_code=400, content={"detail": f"too many messages (>{MAX_BATCH_MESSAGES})"})
+    metrics.MESSAGE_BATCH_SIZE.observe(len(batch.messages))
+    auth = _bearer_subject(request)
+    results: t.List[t.Optional[dict]] = [None] * len(batch.messages)
+    groups: t.Dict[t.Tuple[str, str], t.List[t.Tuple[int, NewMessage]]] = {}
+    for i, msg in enumerate(batch.messages):
+        if not msg.user_id or not msg.thread_id:
+            results[i] = {"index": i, "ok": False, "status": 400, "detail": "user_id and thread_id are required"}
+            continue
+        v = validate_message_text(msg.content)
+        if v:
+            results[i] = {"index": i, "ok": False, "status": v.status_code, "detail": json.loads(v.body)["detail"]}
+            continue
+        if auth and auth != msg.user_id:
+            results[i] = {"index": i, "ok": False, "status": 403, "detail": "token does not match user"}
+            continue
+        groups.setdefault((msg.user_id, msg.thread_id), []).append((i, msg))
+
+    now = datetime.utcnow().isoformat()
+    for (user_id, thread_id), items in groups.items():
+        entries = [{"role": m.role, "content": m.content, "ts": m.ts or now} for _, m in items]
+        try:
+            start = _append_thread_messages(user_id, thread_id, entries)
+        except Exception as e:
+            print(f"[append_messages_batch] error saving {user_id}/{thread_id}: {e}")
+            for i, _ in items:
+                results[i] = {"index": i, "ok": False, "status": 500, "detail": str(e)}
+            continue
+        for k, (i, _) in enumerate(items):
+            results[i] = {"index": i, "ok": True, "count": start + k + 1}
+    return {"ok": all(r["ok"] for r in results), "results": results}
+
+
+def _append_thread_messages(user_id: str, thread_id: str, entries: t.List[dict]) -> int:
+    """Append entries to a thread with one load and one save; returns the index of the first.
+
+    Search and related-thread indexing failures are logged, never raised.
+    """
+    with tracing.span("messages.batch_thread"):
+        messages = load_messages(user_id, thread_id)
+        start = len(messages)
+        messages.extend(entries)
+        save_messages(user_id, thread_id, messages)
+    summaryjobs.note_messages(user_id, thread_id, len(messages))
+    try:
+        search.index_messages(user_id, thread_id, list(enumerate(entries, start)))
+    except Exception as e:
+        print(f"[append_messages] search indexing failed: {e}")
+    try:
+        related.index_messages(user_id, thread_id, [e["content"] for e in entries])
+    except Exception as e:
+        print(f"[append_messages] related-threads indexing failed: {e}")
+    return start
+
+
 @app.post("/users/create")
 def create_user(payload: dict, response: Response):
     name = payload.get("name")
@@ -773,7 +945,7 @@ def add_user_credits(user_id: str, payload: dict, request: Request):
         return JSONResponse(status_code=500, content={"detail": str(e)})
 
 @app.get("/messages/{user_id}/{thread_id}")
-def get_messages(user_id: str, thread_id: str, request: Request):
+def get_messages(user_id: str, thread_id: str, request: Request, response: Response):
     # Require auth for non-anonymous users
     sub = _get_auth_subject_from_request(request)
     if not user_id.startswith("anon_"):
@@ -781,6 +953,13 @@ def get_messages(user_id: str, thread_id: str, request: Request):
             return JSONResponse(status_code=401, content={"detail": "authorization required"})
         if sub != user_id:
             return JSONResponse(status_code=403, content={"detail": "forbidden"})
+    version = storage.thread_version(user_id, thread_id)
+    if version:
+        etag = httpcache.etag_for("m", version[0])
+        cached = httpcache.not_modified(request, etag, version[1])
+        if cached:
+            return cached
+        httpcache.set_validators(response, etag, version[1])
     msgs = load_messages(user_id, thread_id)
     return {"messages": msgs, "count": len(msgs)}
 
@@ -797,14 +976,22 @@ def delete_messages(user_id: str, thread_id: str, request: Request):
         if sub != user_id:
             return JSONResponse(status_code=403, content={"detail": "forbidden"})
     try:
-        save_messages(user_id, thread_id, [])
+        storage.delete_thread(user_id, thread_id)
+        try:
+            search.drop_thread(user_id, thread_id)
+        except Exception as e:
+            print(f"[delete_messages] search index update failed: {e}")
+        try:
+            related.drop_thread(user_id, thread_id)
+        except Exception as e:
+            print(f"[delete_messages] related-threads update failed: {e}")
         return {"ok": True, "count": 0}
     except Exception as e:
         return JSONResponse(status_code=500, content={"detail": str(e)})
 
 
 @app.get("/threads/{user_id}")
-def get_threads(user_id: str, request: Request):
+def get_threads(user_id: str, request: Request, response: Response):
     """Return a lightweight list of threads for the given user_id.
     Each thread contains thread_id, title (first user message snippet), created_at and last_active_at.
     Requires authorization for non-anonymous users.
@@ -816,23 +1003,22 @@ def get_threads(user_id: str, request: Request):
         if sub != user_id:
             return JSONResponse(status_code=403, content={"detail": "forbidden"})
 
-    safe_user = "".join(ch for ch in user_id if ch.isalnum() or ch in "-_")
+    # answer revalidations from directory metadata alone
+    version = storage.threads_version(user_id)
+    if version:
+        etag = httpcache.etag_for("t", version[0])
+        cached = httpcache.not_modified(request, etag, version[1])
+        if cached:
+            return cached
+        httpcache.set_validators(response, etag, version[1])
+
     threads: list = []
     try:
-        for p in DATA_DIR.iterdir():
-            name = p.name
-            # match files like <user>__<thread>.json but skip summary files
-            if not name.startswith(f"{safe_user}__"):
-                continue
-            if name.endswith("__summary.json"):
-                continue
-            # extract thread id (strip prefix and extension)
-            rest = name.split("__", 1)[1]
-            thread_id = rest.rsplit(".", 1)[0]
+        # only this user's directory is listed (summary files are skipped)
+        for thread_id, p in list_thread_files(user_id):
             # load messages to infer title / timestamps
             try:
-                with p.open("r", encoding="utf-8") as f:
-                    msgs = json.load(f)
+                msgs = storage.read_thread_file(p)
             except Exception:
                 msgs = []
             title = "Conversation"
@@ -869,57 +1055,162 @@ def get_threads(user_id: str, request: Request):
     except Exception as e:
         return JSONResponse(status_code=500, content={"detail": str(e)})
 
+
+@app.get("/changes/{user_id}")
+async def get_changes(user_id: str, request: Request, since: t.Optional[int] = None, timeout: t.Optional[float] = None, stream: bool = False):
+    """Change records ({seq, thread_id, event, ts}) after `since`, by long-poll or SSE (see changefeed.py).
+    Without `since` the current seq is returned at once. Requires authorization for non-anonymous users.
+    """
+    sub = _get_auth_subject_from_request(request)
+    if not user_id.startswith("anon_"):
+        if not sub:
+            return JSONResponse(status_code=401, content={"detail": "authorization required"})
+        if sub != user_id:
+            return JSONResponse(status_code=403, content={"detail": "forbidden"})
+
+    if stream or "text/event-stream" in request.headers.get("accept", ""):
+        last_event_id = request.headers.get("last-event-id")
+        if last_event_id and last_event_id.isdigit():
+            since = int(last_event_id)
+        return StreamingResponse(
+            changefeed.stream(user_id, since),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    wait = changefeed.CHANGES_LONGPOLL_SECONDS if timeout is None else timeout
+    wait = max(0.0, min(wait, changefeed.CHANGES_LONGPOLL_MAX_SECONDS))
+    return await changefeed.wait_for_changes(user_id, since, wait)
+
+
+@app.get("/threads/{user_id}/{thread_id}/related")
+def get_related_threads(user_id: str, thread_id: str, request: Request, limit: int = 5):
+    """Return the user's threads most similar to `thread_id` (cosine over TF-IDF thread vectors).
+    Requires authorization for non-anonymous users.
+    """
+    sub = _get_auth_subject_from_request(request)
+    if not user_id.startswith("anon_"):
+        if not sub:
+            return JSONResponse(status_code=401, content={"detail": "authorization required"})
+        if sub != user_id:
+            return JSONResponse(status_code=403, content={"detail": "forbidden"})
+    if not related.available():
+        return JSONResponse(status_code=503, content={"detail": "related threads unavailable (no topic model loaded)"})
+    limit = max(1, min(int(limit or 5), 50))
+    try:
+        return {"thread_id": thread_id, "related": related.related_threads(user_id, thread_id, limit=limit)}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"detail": str(e)})
+
+
+@app.get("/search/{user_id}")
+def search_threads(user_id: str, request: Request, q: str = "", limit: int = 20):
+    """Full-text search across a user's threads (BM25 over an inverted index).
+    Returns the best-matching messages with thread_id, message_index and a snippet.
+    Requires authorization for non-anonymous users.
+    """
+    sub = _get_auth_subject_from_request(request)
+    if not user_id.startswith("anon_"):
+        if not sub:
+            return JSONResponse(status_code=401, content={"detail": "authorization required"})
+        if sub != user_id:
+            return JSONResponse(status_code=403, content={"detail": "forbidden"})
+    query = (q or "").strip()
+    if not query:
+        return JSONResponse(status_code=400, content={"detail": "q is required"})
+    if len(query) > MAX_MESSAGE_LENGTH:
+        return JSONResponse(status_code=400, content={"detail": "query too long"})
+    limit = max(1, min(int(limit or 20), 100))
+    start = time.perf_counter()
+    try:
+        results = search.search(user_id, query, limit=limit)
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"detail": str(e)})
+    return {"query": query, "results": results, "took_ms": round((time.perf_counter() - start) * 1000.0, 3)}
+
+
+CHAT_SYSTEM_PROMPT = os.getenv("SYSTEM_PROMPT") or (
+    "You are an empathetic coaching assistant. Speak directly to the user in a warm, second-person tone (use 'You...' phrasing). Be concise, supportive, and practical."
+)
+GATEWAY_REFUSAL = "This assistant is restricted to personal topics (career, mental state, relationships, decision-making). For coding, general information, or other topics please use the appropriate tool or a general-purpose assistant."
+
+
+def _log_gateway_decision(subject: t.Optional[str], text: str, decision) -> None:
+    try:
+        log_path = Path(__file__).resolve().parent / "gateway_log.jsonl"
+        entry = {
+            "ts": datetime.utcnow().isoformat(),
+            "subject": subject or None,
+            "text": (text[:1000] + '...') if len(text) > 1000 else text,
+            "allowed": bool(decision.allowed),
+            "label": decision.label,
+            "prob": float(decision.prob),
+            "source": decision.source,
+            "cached": decision.cached,
+            "model_version": decision.model_version,
+        }
+        with log_path.open('a', encoding='utf8') as lf:
+            lf.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except Exception:
+        pass
+
+
 @app.post("/chat", response_model=ChatResponse)
 def chat(req: ChatRequest, request: Request):
     # rate-limit per user/ip
     allowed, remaining = check_rate_limit(request, limit=30, window_seconds=60)
     if not allowed:
+        metrics.RATE_LIMIT_REJECTIONS.inc(endpoint="/chat")
         return JSONResponse(status_code=429, content={"detail": "rate limit exceeded"})
     # keep original behavior: single-message chat proxied to OpenAI
     err = validate_message_text(req.message)
     if err:
         return err
 
+    stream_query = request.query_params.get("stream", "false").lower() == "true"
+    accept_header = request.headers.get("accept", "")
+    wants_sse = "text/event-stream" in accept_header
+
+    # greetings and small talk are answered locally, free of charge
+    local = smalltalk.reply(req.message)
+    if local is not None:
+        metrics.CHAT_REQUESTS.inc(endpoint="/chat", path="local")
+        if stream_query or wants_sse:
+            events = [f"data: {json.dumps({'delta': local})}\n\n", "data: [DONE]\n\n"]
+            return StreamingResponse(iter(events), media_type="text/event-stream")
+        return {"reply": local}
+
     # Restrict usage: only forward to OpenAI when the user's message is allowed.
     # Try ML model first (if loaded), otherwise fall back to heuristics.
     subject = _get_auth_subject_from_request(request)
-    allow_ml, ml_label, ml_prob, ml_source = ml_is_allowed_for_assistant(req.message, threshold=0.5)
-    if allow_ml is None:
-        # model not available or errored — use heuristics
-        allowed = is_allowed_for_assistant(req.message)
-        decision_source = 'heuristic'
-        label = 'heuristic'
-        prob = 1.0 if allowed else 0.0
-    else:
-        allowed = bool(allow_ml)
-        decision_source = ml_source
-        label = ml_label
-        prob = ml_prob
+    with tracing.span("classifier"):
+        decision = gateway.decide(req.message, threshold=0.5)
+    allowed, label, prob, decision_source = decision.allowed, decision.label, decision.prob, decision.source
+    metrics.GATEWAY_DECISIONS.inc(source=decision_source, allowed=bool(allowed))
 
     # Log gateway decision for later analysis
-    try:
-        log_path = Path(__file__).resolve().parent / "gateway_log.jsonl"
-        entry = {
-            "ts": datetime.utcnow().isoformat(),
-            "subject": subject or None,
-            "text": (req.message[:1000] + '...') if len(req.message) > 1000 else req.message,
-            "allowed": bool(allowed),
-            "label": label,
-            "prob": float(prob),
-            "source": decision_source,
-        }
-        with log_path.open('a', encoding='utf8') as lf:
-            lf.write(json.dumps(entry, ensure_ascii=False) + "\n")
-    except Exception:
-        pass
+    _log_gateway_decision(subject, req.message, decision)
 
     if not allowed:
         # Do not call OpenAI; return a short informative reply
-        return {"reply": "This assistant is restricted to personal topics (career, mental state, relationships, decision-making). For coding, general information, or other topics please use the appropriate tool or a general-purpose assistant."}
+        metrics.CHAT_REQUESTS.inc(endpoint="/chat", path="refused")
+        return {"reply": GATEWAY_REFUSAL}
 
-    # Determine token budget required and enforce for authenticated users
-    subject = _get_auth_subject_from_request(request)
+    # Determine token budget required; cached replies are free but not a way around an empty balance
     est_needed = estimate_tokens_for_text(req.message) + 100  # include model/response overhead
+    if subject and _tokens_left(subject) < est_needed:
+        return JSONResponse(status_code=403, content={"detail": "insufficient tokens"})
+
+    # context-free question seen often enough: replay a cached reply (not charged)
+    cache_key = replycache.key(CHAT_SYSTEM_PROMPT, "gpt-4o-mini", 0.7, req.message)
+    cached = replycache.lookup(cache_key, "/chat")
+    if cached is not None:
+        metrics.CHAT_REQUESTS.inc(endpoint="/chat", path="cache")
+        if stream_query or wants_sse:
+            return StreamingResponse(replycache.replay_sse(cached), media_type="text/event-stream")
+        return {"reply": cached}
+
+    # reserve the tokens for authenticated users
+    caller = admission.Caller(_rate_limit_key_for_request(request), admission.PRIORITY_ANONYMOUS)
     if subject:
         users = load_users()
         u = users.get(subject)
@@ -933,41 +1224,65 @@ def chat(req: ChatRequest, request: Request):
         u["tokens_left"] = avail - est_needed
         users[subject] = u
         save_users(users)
+        metrics.TOKENS_RESERVED.inc(est_needed, endpoint="/chat")
+        caller = admission.Caller(f"user:{subject}", admission.PRIORITY_AUTHENTICATED)
 
-    system_prompt = os.getenv("SYSTEM_PROMPT") or (
-        "You are an empathetic coaching assistant. Speak directly to the user in a warm, second-person tone (use 'You...' phrasing). Be concise, supportive, and practical."
-    )
     messages = [
-        {"role": "system", "content": system_prompt},
+        {"role": "system", "content": CHAT_SYSTEM_PROMPT},
         {"role": "user", "content": req.message},
     ]
 
-    stream_query = request.query_params.get("stream", "false").lower() == "true"
-    accept_header = request.headers.get("accept", "")
-    wants_sse = "text/event-stream" in accept_header
-
+    metrics.CHAT_REQUESTS.inc(endpoint="/chat", path="upstream")
     if stream_query or wants_sse:
+        # open the stream before responding, so a refused call is still a 503
+        started = time.perf_counter()
+        try:
+            resp_iter = create_chat_completion(
+                "/chat",
+                caller=caller,
+                model="gpt-4o-mini",
+                messages=messages,
+                temperature=0.7,
+                max_tokens=100,
+                stream=True,
+            )
+        except Exception as e:
+            if subject:
+                _refund_tokens(subject, est_needed, "/chat")
+            if isinstance(e, admission.Rejected):
+                return _busy_response(e)
+            return JSONResponse(status_code=500, content={"detail": f"OpenAI error: {str(e)}"})
+
         def event_generator():
             try:
-                resp_iter = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=messages,
-                        temperature=0.7,
-                        max_tokens=100,
-                    stream=True,
-                )
+                first_token = True
+                parts = []
                 for chunk in resp_iter:
                     text = extract_delta_text(chunk)
                     if text:
+                        if first_token:
+                            metrics.CHAT_TTFT.observe(time.perf_counter() - started)
+                            first_token = False
+                        parts.append(text)
                         yield f"data: {json.dumps({'delta': text})}\n\n"
+                replycache.add(cache_key, "".join(parts))
+                if subject:
+                    _refund_cached_tokens(subject, [getattr(resp_iter, "usage", None)], est_needed, "/chat")
                 yield "data: [DONE]\n\n"
             except Exception as e:
+                if subject:
+                    _refund_tokens(subject, est_needed, "/chat")
                 yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            finally:
+                # also on client disconnect (GeneratorExit): free the upstream stream and its slot now
+                resp_iter.close()
 
         return StreamingResponse(event_generator(), media_type="text/event-stream")
 
     try:
-        response = client.chat.completions.create(
+        response = create_chat_completion(
+                "/chat",
+                caller=caller,
                 model="gpt-4o-mini",
                 messages=messages,
                 temperature=0.7,
@@ -976,26 +1291,416 @@ def chat(req: ChatRequest, request: Request):
         reply_text = ""
         try:
             reply_text = response.choices[0].message.content
+            replycache.add(cache_key, reply_text)
         except Exception:
             reply_text = str(response)
+        if subject:
+            usage = promptcache.parse_usage(getattr(response, "usage", None))
+            _refund_cached_tokens(subject, [usage], est_needed, "/chat")
         return {"reply": reply_text}
     except Exception as e:
         # On error, refund reserved tokens for authenticated user
+        if subject:
+            _refund_tokens(subject, est_needed, "/chat")
+        if isinstance(e, admission.Rejected):
+            return _busy_response(e)
+        return JSONResponse(status_code=500, content={"detail": f"OpenAI error: {str(e)}"})
+
+# ----- WebSocket chat -----
+# One connection carries many turns. The caller is authenticated once (auth
+# cookie or bearer header at the handshake, or a first {"type": "auth"}
+# message) and the subject, rate-limit key and admission identity stay on the
+# connection. Protocol, one turn at a time:
+#
+#   -> {"type": "chat", "user_id", "thread_id", "message"}
+#   <- {"type": "delta", "delta"} ...  then  {"type": "done", "reply", "count", "tokens_left"?}
+#   <- {"type": "error", "status", "detail"}   (the connection stays open)
+#   -> {"type": "ping"}  <- {"type": "pong"}
+#
+# Both sides of the turn are saved server-side (one load and one save), so the
+# client does not follow up with POST /messages/batch. Deltas are read from
+# upstream only as fast as the client takes them; a client that stops reading
+# for WS_SEND_TIMEOUT_SECONDS is disconnected. Connections with no turn for
+# WS_IDLE_TIMEOUT_SECONDS are closed.
+
+WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS") or "300")
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS") or "10")
+WS_CLOSE_IDLE = 1000
+WS_CLOSE_POLICY = 1008
+WS_CLOSE_SLOW_CONSUMER = 1013
+
+
+class _WsSlowConsumer(Exception):
+    pass
+
+
+class _WsConnection:
+    """Per-connection caller state, resolved once instead of on every turn."""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.subject: t.Optional[str] = None
+        self.rate_key = _rate_limit_key_for_request(websocket)
+        self.tokens_left: t.Optional[int] = None
+        self.turns = 0
+
+    def authenticate(self, subject: t.Optional[str]) -> None:
+        self.subject = subject
+        if subject:
+            self.rate_key = f"user:{subject}"
+            try:
+                self.tokens_left = int((load_users().get(subject) or {}).get("tokens_left", 0) or 0)
+            except Exception:
+                self.tokens_left = 0
+
+    def caller(self, user_id: str) -> admission.Caller:
+        if self.subject:
+            prio = admission.PRIORITY_AUTHENTICATED if (self.tokens_left or 0) > 0 else admission.PRIORITY_ANONYMOUS
+            return admission.Caller(f"user:{self.subject}", prio)
+        return admission.Caller(f"user:{user_id}", admission.PRIORITY_ANONYMOUS)
+
+    async def send(self, payload: dict) -> None:
         try:
-            if subject:
-                users = load_users()
-                u = users.get(subject)
-                if u:
-                    try:
-                        cur = int(u.get("tokens_left", 0) or 0)
-                    except Exception:
-                        cur = 0
-                    u["tokens_left"] = cur + est_needed
-                    users[subject] = u
-                    save_users(users)
+            await asyncio.wait_for(self.websocket.send_text(json.dumps(payload, ensure_ascii=False)),
+                                   WS_SEND_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise _WsSlowConsumer()
+
+    async def error(self, status: int, detail: str) -> None:
+        await self.send({"type": "error", "status": status, "detail": detail})
+
+
+def _ws_origin_allowed(websocket: WebSocket) -> bool:
+    # browsers send cookies on cross-site WebSocket handshakes and CORS does not apply
+    origin = websocket.headers.get("origin")
+    if not origin:
+        return True
+    allowed = [o.strip() for o in (_frontend_origins or "http://localhost:3000").split(",") if o.strip()]
+    return "*" in allowed or origin in allowed
+
+
+def _ws_reserve(conn: _WsConnection, text: str) -> t.Tuple[t.Optional[t.Tuple[int, str]], int]:
+    """Reserve the turn's tokens for an authenticated caller; returns (error, reserved)."""
+    if not conn.subject:
+        return None, 0
+    est_needed = estimate_tokens_for_text(text) + 100
+    # always debit against users.json: credits may have been added over HTTP
+    users = load_users()
+    u = users.get(conn.subject)
+    if not u:
+        return (401, "unknown user"), 0
+    try:
+        avail = int(u.get("tokens_left", 0) or 0)
+    except Exception:
+        avail = 0
+    if avail < est_needed:
+        conn.tokens_left = avail
+        return (403, "insufficient tokens"), 0
+    u["tokens_left"] = avail - est_needed
+    users[conn.subject] = u
+    save_users(users)
+    conn.tokens_left = avail - est_needed
+    metrics.TOKENS_RESERVED.inc(est_needed, endpoint="/ws/chat")
+    return None, est_needed
+
+
+async def _ws_chat_turn(conn: _WsConnection, payload: dict) -> str:
+    """Run one chat turn; returns the outcome label for metrics."""
+    user_id = payload.get("user_id") or conn.subject
+    thread_id = payload.get("thread_id")
+    text = payload.get("message")
+    if not user_id or not thread_id:
+        await conn.error(400, "user_id and thread_id are required")
+        return "invalid"
+    if conn.subject and conn.subject != user_id:
+        await conn.error(403, "token does not match user")
+        return "forbidden"
+    v = validate_message_text(text if isinstance(text, str) else None)
+    if v:
+        await conn.error(v.status_code, json.loads(v.body)["detail"])
+        return "invalid"
+    allowed, _ = _take_rate_limit(conn.rate_key, 30, 60)
+    if not allowed:
+        metrics.RATE_LIMIT_REJECTIONS.inc(endpoint="/ws/chat")
+        await conn.error(429, "rate limit exceeded")
+        return "rate_limited"
+
+    local = smalltalk.reply(text)
+    if local is not None:
+        metrics.CHAT_REQUESTS.inc(endpoint="/ws/chat", path="local")
+        await conn.send({"type": "delta", "delta": local})
+        return await _ws_finish_turn(conn, payload, user_id, thread_id, text, local, "local")
+
+    def classify():
+        with tracing.span("classifier"):
+            decision = gateway.decide(text, threshold=0.5)
+        metrics.GATEWAY_DECISIONS.inc(source=decision.source, allowed=bool(decision.allowed))
+        _log_gateway_decision(conn.subject, text, decision)
+        return decision
+
+    decision = await run_in_threadpool(classify)
+    reserved = 0
+    usage = None
+    if decision.allowed:
+        if conn.subject:
+            # a cached reply is free, but only for callers who could pay for a fresh one
+            conn.tokens_left = await run_in_threadpool(_tokens_left, conn.subject)
+            if conn.tokens_left < estimate_tokens_for_text(text) + 100:
+                await conn.error(403, "insufficient tokens")
+                return "insufficient_tokens"
+        cache_key = replycache.key(CHAT_SYSTEM_PROMPT, "gpt-4o-mini", 0.7, text)
+        cached = replycache.lookup(cache_key, "/ws/chat")
+        if cached is not None:
+            metrics.CHAT_REQUESTS.inc(endpoint="/ws/chat", path="cache")
+            for i, part in enumerate(replycache.chunks(cached)):
+                if i:
+                    await asyncio.sleep(replycache.REPLY_CACHE_REPLAY_DELAY_MS / 1000.0)
+                await conn.send({"type": "delta", "delta": part})
+            return await _ws_finish_turn(conn, payload, user_id, thread_id, text, cached, "cache")
+        err, reserved = await run_in_threadpool(_ws_reserve, conn, text)
+        if err:
+            await conn.error(*err)
+            return "insufficient_tokens" if err[0] == 403 else "forbidden"
+        metrics.CHAT_REQUESTS.inc(endpoint="/ws/chat", path="upstream")
+        try:
+            stream = await run_in_threadpool(
+                functools.partial(
+                    create_chat_completion,
+                    "/ws/chat",
+                    caller=conn.caller(user_id),
+                    model="gpt-4o-mini",
+                    messages=[{"role": "system", "content": CHAT_SYSTEM_PROMPT}, {"role": "user", "content": text}],
+                    temperature=0.7,
+                    max_tokens=100,
+                    stream=True,
+                )
+            )
+        except Exception as e:
+            if reserved:
+                await run_in_threadpool(_refund_tokens, conn.subject, reserved, "/ws/chat")
+                conn.tokens_left = (conn.tokens_left or 0) + reserved
+            if isinstance(e, admission.Rejected):
+                await conn.error(503, str(e))
+                return "busy"
+            await conn.error(500, f"OpenAI error: {e}")
+            return "error"
+        parts = []
+        started = time.perf_counter()
+        try:
+            # one chunk is pulled from upstream per delta the client has accepted
+            async for chunk in iterate_in_threadpool(stream):
+                delta = extract_delta_text(chunk)
+                if delta:
+                    if not parts:
+                        metrics.CHAT_TTFT.observe(time.perf_counter() - started)
+                    parts.append(delta)
+                    await conn.send({"type": "delta", "delta": delta})
+        except _WsSlowConsumer:
+            raise
+        except Exception as e:
+            await conn.error(500, f"OpenAI error: {e}")
+            return "error"
+        finally:
+            stream.close()
+        usage = getattr(stream, "usage", None)
+        reply = "".join(parts)
+        replycache.add(cache_key, reply)
+    else:
+        reply = GATEWAY_REFUSAL
+        metrics.CHAT_REQUESTS.inc(endpoint="/ws/chat", path="refused")
+        await conn.send({"type": "delta", "delta": reply})
+    return await _ws_finish_turn(conn, payload, user_id, thread_id, text, reply,
+                                 "ok" if decision.allowed else "refused", reserved, usage)
+
+
+async def _ws_finish_turn(conn: _WsConnection, payload: dict, user_id: str, thread_id: str, text: str,
+                          reply: str, outcome: str, reserved: int = 0, usage=None) -> str:
+    """Save both sides of a turn, settle the reservation and send `done`."""
+    now = datetime.utcnow().isoformat()
+    entries = [
+        {"role": "user", "content": text, "ts": payload.get("ts") or now},
+        {"role": "assistant", "content": reply, "ts": now},
+    ]
+    try:
+        start = await run_in_threadpool(_append_thread_messages, user_id, thread_id, entries)
+    except Exception as e:
+        print(f"[ws_chat] error saving {user_id}/{thread_id}: {e}")
+        await conn.error(500, str(e))
+        return "error"
+    if reserved:
+        refund = await run_in_threadpool(_refund_cached_tokens, conn.subject, [usage], reserved, "/ws/chat")
+        conn.tokens_left = (conn.tokens_left or 0) + refund
+    done = {"type": "done", "reply": reply, "count": start + len(entries)}
+    if conn.subject:
+        done["tokens_left"] = conn.tokens_left
+    await conn.send(done)
+    return outcome
+
+
+@app.websocket("/ws/chat")
+async def ws_chat(websocket: WebSocket):
+    if not _ws_origin_allowed(websocket):
+        await websocket.close(code=WS_CLOSE_POLICY, reason="origin not allowed")
+        return
+    await websocket.accept()
+    conn = _WsConnection(websocket)
+    await run_in_threadpool(conn.authenticate, _auth_subject(websocket))
+    metrics.WS_CONNECTIONS.inc()
+    reason = "client"
+    try:
+        while True:
+            try:
+                raw = await asyncio.wait_for(websocket.receive_text(), WS_IDLE_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                reason = "idle"
+                await websocket.close(code=WS_CLOSE_IDLE, reason="idle timeout")
+                return
+            try:
+                payload = json.loads(raw)
+                kind = payload.get("type")
+            except Exception:
+                await conn.error(400, "invalid JSON")
+                continue
+            if kind == "ping":
+                await conn.send({"type": "pong"})
+            elif kind == "auth":
+                sub = verify_token(payload.get("token") or "")
+                if not sub:
+                    await conn.error(401, "invalid token")
+                    continue
+                await run_in_threadpool(conn.authenticate, sub)
+                await conn.send({"type": "auth", "subject": sub, "tokens_left": conn.tokens_left})
+            elif kind == "chat":
+                started = time.perf_counter()
+                outcome = await _ws_chat_turn(conn, payload)
+                conn.turns += 1
+                metrics.WS_TURNS.inc(outcome=outcome)
+                metrics.WS_TURN_LATENCY.observe(time.perf_counter() - started, outcome=outcome)
+            else:
+                await conn.error(400, f"unknown message type: {kind}")
+    except WebSocketDisconnect:
+        pass
+    except _WsSlowConsumer:
+        reason = "slow_consumer"
+        try:
+            await websocket.close(code=WS_CLOSE_SLOW_CONSUMER, reason="client not reading")
         except Exception:
             pass
-        return JSONResponse(status_code=500, content={"detail": f"OpenAI error: {str(e)}"})
+    finally:
+        metrics.WS_CONNECTIONS.dec()
+        metrics.WS_DISCONNECTS.inc(reason=reason)
+
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _stream_summary_sections(endpoint: str, history: list, stream_tokens: bool,
+                             caller: t.Optional[admission.Caller] = None,
+                             usages: t.Optional[list] = None, max_tokens: int = 50):
+    """Start the summary calls; return an iterator of SSE events, one `section` per summary section.
+
+    The three upstream calls run concurrently, so the first section arrives
+    after a single round trip. With `stream_tokens` each call is streamed and
+    its text is forwarded as `delta` events before the post-processed section.
+    Reported token usage is appended to `usages`.
+
+    Returns once every call holds an admission slot. If one is refused, the
+    others are cancelled and `admission.Rejected` is raised before any event
+    is produced, so the caller can still answer 503. Closing the iterator
+    (the client went away) cancels the calls still running.
+    """
+    events: "queue.Queue" = queue.Queue()
+    admitted: "queue.Queue" = queue.Queue()
+    cancelled = threading.Event()
+    usages = [] if usages is None else usages
+
+    def run_section(key: str, prompt: str, process):
+        msgs_for_request = promptcache.summary_messages(history, prompt)
+        try:
+            with tracing.span("admission.wait", endpoint=endpoint):
+                slot = admission.acquire(caller)
+        except Exception as e:
+            admitted.put(e)  # Rejected, or anything else: never leave the caller waiting
+            return
+        admitted.put(None)
+        if cancelled.is_set():
+            slot.release()  # another section was refused; do not pay for this one
+            return
+        with tracing.span(f"openai.{key}"):
+            try:
+                if stream_tokens:
+                    parts = []
+                    stream = create_chat_completion(
+                        endpoint,
+                        slot=slot,
+                        model="gpt-4o-mini",
+                        messages=msgs_for_request,
+                        temperature=0.5,
+                        max_tokens=max_tokens,
+                        stream=True,
+                    )
+                    try:
+                        for chunk in stream:
+                            if cancelled.is_set():
+                                return
+                            text = extract_delta_text(chunk)
+                            if text:
+                                parts.append(text)
+                                events.put(("delta", {"section": key, "delta": text}))
+                    finally:
+                        stream.close()
+                    usages.append(getattr(stream, "usage", None))
+                    text = "".join(parts)
+                else:
+                    resp = create_chat_completion(
+                        endpoint,
+                        slot=slot,
+                        model="gpt-4o-mini",
+                        messages=msgs_for_request,
+                        temperature=0.5,
+                        max_tokens=max_tokens,
+                    )
+                    usages.append(promptcache.parse_usage(getattr(resp, "usage", None)))
+                    try:
+                        text = resp.choices[0].message.content
+                    except Exception:
+                        text = str(resp)
+            except Exception as e:
+                text = f"ERROR: {str(e)}"
+            finally:
+                slot.release()
+        events.put(("section", {"section": key, "value": process(text)}))
+
+    started = time.perf_counter()
+    for key, prompt, process in SUMMARY_SECTIONS:
+        # each thread gets its own copy of the request context so spans nest under it
+        ctx = contextvars.copy_context()
+        threading.Thread(target=ctx.run, args=(run_section, key, prompt, process), daemon=True).start()
+
+    for _ in SUMMARY_SECTIONS:
+        refused = admitted.get()
+        if refused is not None:
+            cancelled.set()
+            raise refused
+
+    def section_events():
+        try:
+            remaining = len(SUMMARY_SECTIONS)
+            first = True
+            while remaining:
+                event, data = events.get()
+                if first:
+                    metrics.SUMMARY_TTFC.observe(time.perf_counter() - started)
+                    first = False
+                if event == "section":
+                    remaining -= 1
+                yield _sse_event(event, data)
+        finally:
+            cancelled.set()
+
+    return section_events()
+
 
 @app.get("/summary/{user_id}/{thread_id}")
 def summary_for_thread(user_id: str, thread_id: str, request: Request):
@@ -1005,9 +1710,24 @@ def summary_for_thread(user_id: str, thread_id: str, request: Request):
       - uncovered
       - suggested_next_steps
     Results come from OpenAI (non-streaming).
+
+    With `?stream=true` or `Accept: text/event-stream` the response is SSE:
+    a `section` event ({"section", "value"}) for each section as soon as it
+    is ready, `delta` events ({"section", "delta"}) with the raw tokens when
+    `?tokens=true`, and a final `done` event with `message_count` and
+    `tokens_charged`.
     """
+    stream_query = request.query_params.get("stream", "false").lower() == "true"
+    wants_sse = stream_query or "text/event-stream" in request.headers.get("accept", "")
     msgs = load_messages(user_id, thread_id)
     if not msgs:
+        if wants_sse:
+            def empty_events():
+                for key, _, process in SUMMARY_SECTIONS:
+                    yield _sse_event("section", {"section": key, "value": process("")})
+                yield _sse_event("done", {"message_count": 0, "tokens_charged": 0})
+
+            return StreamingResponse(empty_events(), media_type="text/event-stream")
         # No messages: return an empty structured summary rather than a 404
         return {
             "current_state": "",
@@ -1016,31 +1736,37 @@ def summary_for_thread(user_id: str, thread_id: str, request: Request):
             "message_count": 0,
         }
 
-    # build conversation for model: include system then the messages
-    conversation = [{"role": "system", "content": "You are a helpful assistant that summarizes conversations."}]
-    for m in msgs:
-        conversation.append({"role": m.get("role", "user"), "content": m.get("content", "")})
+    history = [{"role": m.get("role", "user"), "content": m.get("content", "")} for m in msgs]
+    # system prompt + history, for the token estimate
+    conversation = [{"role": "system", "content": promptcache.SUMMARY_SYSTEM_PROMPT}] + history
+    usages: list = []
 
     def call_openai(prompt_template: str) -> str:
-        # send the conversation plus instruction as last system message
-        msgs_for_request = list(conversation)
-        msgs_for_request.append({"role": "system", "content": prompt_template})
+        # stable prefix first (system + history), the instruction last
+        msgs_for_request = promptcache.summary_messages(history, prompt_template)
         try:
-            resp = client.chat.completions.create(
+            resp = create_chat_completion(
+                "/summary/{user_id}/{thread_id}",
+                caller=caller,
                 model="gpt-4o-mini",
                 messages=msgs_for_request,
                 temperature=0.5,
                 max_tokens=50,
             )
+            usages.append(promptcache.parse_usage(getattr(resp, "usage", None)))
             try:
                 return resp.choices[0].message.content
             except Exception:
                 return str(resp)
+        except admission.Rejected:
+            raise
         except Exception as e:
             return f"ERROR: {str(e)}"
 
     # enforce token budget for authenticated users; require cookie or bearer token
     needed = estimate_tokens_for_summary(conversation)
+    charged = 0
+    caller = admission.Caller(f"user:{user_id}", admission.PRIORITY_ANONYMOUS)
     if not user_id.startswith("anon_"):
         subject = _get_auth_subject_from_request(request)
         if not subject:
@@ -1061,69 +1787,50 @@ def summary_for_thread(user_id: str, thread_id: str, request: Request):
         u["tokens_left"] = cur - needed
         users[user_id] = u
         save_users(users)
+        metrics.TOKENS_RESERVED.inc(needed, endpoint="/summary/{user_id}/{thread_id}")
+        charged = needed
+        caller = admission.Caller(f"user:{user_id}", admission.PRIORITY_AUTHENTICATED)
 
-    current = call_openai(CURRENT_PROMPT)
-    uncovered = call_openai(UNCOVERED_PROMPT)
-    suggested = call_openai(SUGGESTED_PROMPT)
+    if wants_sse:
+        stream_tokens = request.query_params.get("tokens", "false").lower() == "true"
 
-    # Post-process to enforce length and shape server-side
-    def limit_sentences(text: str, max_sentences: int = 3, max_words: int = 60) -> str:
-        if not text:
-            return ""
-        cleaned = str(text).replace("\n", " ").strip()
-        if not cleaned:
-            return ""
-        import re
-        sentences = re.split(r'(?<=[.!?])\s+', cleaned)
-        taken = " ".join(sentences[:max_sentences])
-        words = taken.split()
-        if len(words) > max_words:
-            return " ".join(words[:max_words]) + "…"
-        return taken
-
-    def extract_list_items(text: str):
-        if not text:
-            return []
-        normalized = str(text).replace('\r\n', '\n').strip()
-        if not normalized:
-            return []
-        lines = [l.strip() for l in normalized.split('\n') if l.strip()]
-        bullets = [l for l in lines if l.startswith('-') or l.startswith('•') or l[0].isdigit()]
-        if bullets:
-            cleaned = [re.sub(r'^[-•*\d\.\)\s]+', '', l).strip() for l in bullets]
-            return cleaned
-        # fallback to sentence split
-        import re as _re
-        sents = _re.split(r'(?<=[.!?])\s+', normalized)
-        if len(sents) > 1:
-            return sents
-        # fallback split by semicolon
-        parts = [p.strip() for p in normalized.split(';') if p.strip()]
-        return parts if parts else [normalized]
-
-    def process_current(text: str) -> str:
-        return limit_sentences(text, max_sentences=3, max_words=60)
-
-    def process_uncovered(text: str):
-        items = extract_list_items(text)
-        return items[:3]
-
-    def process_suggested(text: str):
-        items = extract_list_items(text)
-        # shorten titles to first clause and cap length
-        out = []
-        for it in items[:4]:
-            title = it.split(':')[0].split(' - ')[0].strip()
-            words = title.split()[:12]
-            out.append(' '.join(words))
-        return out
-
-    processed = {
-        "current_state": process_current(current),
-        "what_we_uncovered": process_uncovered(uncovered),
-        "suggested_next_steps": process_suggested(suggested),
-        "message_count": len(msgs),
-    }
+        try:
+            sections = _stream_summary_sections("/summary/{user_id}/{thread_id}", history, stream_tokens, caller, usages)
+        except Exception as e:
+            if charged:
+                _refund_tokens(user_id, charged, "/summary/{user_id}/{thread_id}")
+            if isinstance(e, admission.Rejected):
+                return _busy_response(e)
+            return JSONResponse(status_code=500, content={"detail": str(e)})
+
+        def event_generator():
+            yield from sections
+            refunded = _refund_cached_tokens(user_id, usages, charged, "/summary/{user_id}/{thread_id}") if charged else 0
+            yield _sse_event("done", {"message_count": len(msgs), "tokens_charged": charged - refunded})
+
+        return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+    try:
+        with tracing.span("openai.current_state"):
+            current = call_openai(CURRENT_PROMPT)
+        with tracing.span("openai.what_we_uncovered"):
+            uncovered = call_openai(UNCOVERED_PROMPT)
+        with tracing.span("openai.suggested_next_steps"):
+            suggested = call_openai(SUGGESTED_PROMPT)
+    except admission.Rejected as e:
+        if charged:
+            _refund_tokens(user_id, charged, "/summary/{user_id}/{thread_id}")
+        return _busy_response(e)
+    if charged:
+        _refund_cached_tokens(user_id, usages, charged, "/summary/{user_id}/{thread_id}")
+
+    with tracing.span("summary.postprocess"):
+        processed = {
+            "current_state": process_current(current),
+            "what_we_uncovered": process_uncovered(uncovered),
+            "suggested_next_steps": process_suggested(suggested),
+            "message_count": len(msgs),
+        }
 
     return processed
 
@@ -1133,6 +1840,7 @@ def summary_from_conversation(req: SummaryRequest, request: Request):
     # enforce rate limit: small window to protect expensive OpenAI calls
     allowed, remaining = check_rate_limit(request, limit=6, window_seconds=60)
     if not allowed:
+        metrics.RATE_LIMIT_REJECTIONS.inc(endpoint="/summary")
         return JSONResponse(status_code=429, content={"detail": "rate limit exceeded"})
     # If the conversation is empty or missing, return an empty summary rather than a 400
     if not isinstance(req.conversation, list) or len(req.conversation) == 0:
@@ -1144,15 +1852,18 @@ def summary_from_conversation(req: SummaryRequest, request: Request):
     if v:
         return v
 
+    caller = _admission_caller(request)
+
+    history = [{"role": m.role, "content": m.content} for m in req.conversation]
+
     def call_openai(prompt_template: str) -> str:
-        msgs_for_request = [{"role": "system", "content": "You are a helpful assistant that summarizes conversations."}]
-        # If a last_summary is provided, include it to preserve prior context
-        if getattr(req, "last_summary", None):
-            msgs_for_request.append({"role": "system", "content": f"Previous summary: {req.last_summary}"})
-        msgs_for_request.extend(req.conversation)
-        msgs_for_request.append({"role": "system", "content": prompt_template})
+        # The previous summary changes on every save, so it goes after the
+        # history (which only grows) to keep the cached prefix as long as possible.
+        msgs_for_request = promptcache.summary_messages(history, prompt_template, getattr(req, "last_summary", None))
         try:
-            resp = client.chat.completions.create(
+            resp = create_chat_completion(
+                "/summary",
+                caller=caller,
                 model="gpt-4o-mini",
                 messages=msgs_for_request,
                 temperature=0.5,
@@ -1162,68 +1873,27 @@ def summary_from_conversation(req: SummaryRequest, request: Request):
                 return resp.choices[0].message.content
             except Exception:
                 return str(resp)
+        except admission.Rejected:
+            raise
         except Exception as e:
             return f"ERROR: {str(e)}"
 
-    current = call_openai(CURRENT_PROMPT)
-    uncovered = call_openai(UNCOVERED_PROMPT)
-    suggested = call_openai(SUGGESTED_PROMPT)
-
-    # server-side truncation and shaping
-    def limit_sentences(text: str, max_sentences: int = 3, max_words: int = 60) -> str:
-        if not text:
-            return ""
-        cleaned = str(text).replace("\n", " ").strip()
-        if not cleaned:
-            return ""
-        import re
-        sentences = re.split(r'(?<=[.!?])\s+', cleaned)
-        taken = " ".join(sentences[:max_sentences])
-        words = taken.split()
-        if len(words) > max_words:
-            return " ".join(words[:max_words]) + "…"
-        return taken
-
-    def extract_list_items(text: str):
-        if not text:
-            return []
-        normalized = str(text).replace('\r\n', '\n').strip()
-        if not normalized:
-            return []
-        lines = [l.strip() for l in normalized.split('\n') if l.strip()]
-        bullets = [l for l in lines if l.startswith('-') or l.startswith('•') or l[0].isdigit()]
-        if bullets:
-            import re as _re
-            cleaned = [_re.sub(r'^[-•*\d\.\)\s]+', '', l).strip() for l in bullets]
-            return cleaned
-        import re as _re
-        sents = _re.split(r'(?<=[.!?])\s+', normalized)
-        if len(sents) > 1:
-            return sents
-        parts = [p.strip() for p in normalized.split(';') if p.strip()]
-        return parts if parts else [normalized]
-
-    def process_current(text: str) -> str:
-        return limit_sentences(text, max_sentences=3, max_words=60)
-
-    def process_uncovered(text: str):
-        items = extract_list_items(text)
-        return items[:3]
-
-    def process_suggested(text: str):
-        items = extract_list_items(text)
-        out = []
-        for it in items[:4]:
-            title = it.split(':')[0].split(' - ')[0].strip()
-            words = title.split()[:12]
-            out.append(' '.join(words))
-        return out
-
-    processed = {
-        "current_state": process_current(current),
-        "what_we_uncovered": process_uncovered(uncovered),
-        "suggested_next_steps": process_suggested(suggested),
-    }
+    try:
+        with tracing.span("openai.current_state"):
+            current = call_openai(CURRENT_PROMPT)
+        with tracing.span("openai.what_we_uncovered"):
+            uncovered = call_openai(UNCOVERED_PROMPT)
+        with tracing.span("openai.suggested_next_steps"):
+            suggested = call_openai(SUGGESTED_PROMPT)
+    except admission.Rejected as e:
+        return _busy_response(e)
+
+    with tracing.span("summary.postprocess"):
+        processed = {
+            "current_state": process_current(current),
+            "what_we_uncovered": process_uncovered(uncovered),
+            "suggested_next_steps": process_suggested(suggested),
+        }
 
     # Return structured JSON (not a serialized string) so clients can consume directly.
     return {"summary": processed}
@@ -1235,6 +1905,9 @@ def summary_save(payload: dict, request: Request):
        - user_id (str)
        - thread_id (str)
        - summary (object with current_state, what_we_uncovered, suggested_next_steps)
+    The summary is stored with `edited: true` and the thread's message count.
+    Background precomputation (summaryjobs) leaves it alone until the thread
+    has newer messages than that.
     """
     user_id = payload.get("user_id")
     thread_id = payload.get("thread_id")
@@ -1249,18 +1922,92 @@ def summary_save(payload: dict, request: Request):
         if sub != user_id:
             return JSONResponse(status_code=403, content={"detail": "forbidden"})
     try:
+        summary = dict(summary, edited=True, message_count=len(load_messages(user_id, thread_id)))
         save_summary(user_id, thread_id, summary)
         return {"ok": True}
     except Exception as e:
         return JSONResponse(status_code=500, content={"detail": str(e)})
 
 
+# bookkeeping stored with a saved summary, never sent back to clients
+SUMMARY_INTERNAL_KEYS = ("edited", "message_count", "generated_at")
+
+
 @app.get("/summary/saved/{user_id}/{thread_id}")
-def get_saved_summary(user_id: str, thread_id: str):
+def get_saved_summary(user_id: str, thread_id: str, request: Request, response: Response):
+    version = storage.summary_version(user_id, thread_id)
+    if version:
+        etag = httpcache.etag_for("s", version[0])
+        cached = httpcache.not_modified(request, etag, version[1])
+        if cached:
+            return cached
+        httpcache.set_validators(response, etag, version[1])
     s = load_saved_summary(user_id, thread_id)
     # If there's no saved summary yet, return an empty summary object (200)
     # This keeps client-side logic simpler and avoids noisy 404 logs.
     if not s:
         return {"summary": {}}
-    return {"summary": s}
+    # `edited` tells the user's own summary apart from a precomputed one
+    return {
+        "summary": {k: v for k, v in s.items() if k not in SUMMARY_INTERNAL_KEYS},
+        "edited": _is_edited(s),
+        "message_count": int(s.get("message_count") or 0),
+    }
+
+
+def _precompute_summary(user_id: str, thread_id: str) -> int:
+    """Compute and save a thread's summary for summaryjobs; returns the messages it covers.
+
+    Background runs are not charged: the user never asked for them, and the
+    operator opts in with SUMMARY_PRECOMPUTE_CONCURRENCY. Signed-in users who
+    could not afford the same summary on demand are skipped, so an empty
+    balance does not buy free summaries. A summary the user edited (see
+    /summary/save) is left alone while it covers every message; once the
+    thread has grown past it, it is replaced by a fresh one. Any upstream
+    error propagates, so a partial or failed summary is never saved.
+    """
+    endpoint = "summary.precompute"
+    msgs = load_messages(user_id, thread_id)
+    if not msgs or _edit_covers(user_id, thread_id, len(msgs)):
+        return len(msgs)
+    history = [{"role": m.get("role", "user"), "content": m.get("content", "")} for m in msgs]
+    if not user_id.startswith(storage.ANON_PREFIX):
+        needed = estimate_tokens_for_summary([{"role": "system", "content": promptcache.SUMMARY_SYSTEM_PROMPT}] + history)
+        try:
+            cur = int((load_users().get(user_id) or {}).get("tokens_left", 0) or 0)
+        except Exception:
+            cur = 0
+        if cur < needed:
+            return len(msgs)
+
+    caller = admission.Caller(f"user:{user_id}", admission.PRIORITY_BACKGROUND)
+    summary = {}
+    for key, prompt, process in SUMMARY_SECTIONS:
+        with tracing.span(f"openai.{key}"):
+            resp = create_chat_completion(
+                endpoint,
+                caller=caller,
+                model="gpt-4o-mini",
+                messages=promptcache.summary_messages(history, prompt),
+                temperature=0.5,
+                max_tokens=50,
+            )
+        summary[key] = process(resp.choices[0].message.content or "")
+    if _edit_covers(user_id, thread_id, len(msgs)):
+        return len(msgs)  # edited while we were generating
+    summary["message_count"] = len(msgs)
+    summary["generated_at"] = datetime.utcnow().isoformat()
+    save_summary(user_id, thread_id, summary)
+    return len(msgs)
+
+
+def _is_edited(summary: dict) -> bool:
+    # summaries saved before precomputation existed were all the user's own edits
+    return bool(summary.get("edited", "generated_at" not in summary))
+
+
+def _edit_covers(user_id: str, thread_id: str, message_count: int) -> bool:
+    """True if the saved summary is the user's edit and no message was added after it."""
+    s = load_saved_summary(user_id, thread_id) or {}
+    return bool(s) and _is_edited(s) and int(s.get("message_count") or 0) >= message_count
 # ...existing code...
\ No newline at end of file
@@ -0,0 +1,351 @@
+"""Prometheus-style metrics with multi-process aggregation.
+
+Each process keeps its counters/gauges/histograms in memory and periodically
+flushes a JSON snapshot to `METRICS_DIR/metrics_<pid>.json`. The `/metrics`
+endpoint flushes the current process, then merges every snapshot in the
+directory so a scrape of any gunicorn worker reports totals for all workers.
+
+Counters and histograms from exited workers are kept (so totals never go
+backwards when a worker is recycled); gauges only count live processes.
+
+No third-party dependency is required. Set `METRICS_DIR` (or the
+conventional `PROMETHEUS_MULTIPROC_DIR`) to a directory shared by all
+workers and empty it before the server starts, as with prometheus_client.
+By default a temp directory keyed on the master's pid *and* start time is
+used, so a restarted master gets a fresh directory even when it reuses the
+pid (PID 1 in a container), and directories left by masters that are gone
+are removed on the first flush.
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import typing as t
+from contextlib import contextmanager
+from pathlib import Path
+
+METRICS_ENABLED = str(os.getenv("METRICS_ENABLED", "true")).lower() in ("1", "true", "yes")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS") or "2")
+DEFAULT_DIR_PREFIX = "pma_metrics_"
+
+
+def _process_start(pid: int) -> t.Optional[str]:
+    """Start time of `pid` in clock ticks since boot (Linux), or None if unknown."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    fields = stat[stat.rfind(")") + 2:].split()
+    return fields[19] if len(fields) > 19 else None
+
+
+def _default_dir() -> Path:
+    # Workers share the master's directory (the gunicorn master, or this
+    # process when it has no parent, i.e. PID 1). The start time tells a
+    # restarted master apart from its predecessor even when the pid repeats;
+    # where it is unknown the pid alone is used.
+    master = os.getppid() or os.getpid()
+    start = _process_start(master)
+    name = f"{DEFAULT_DIR_PREFIX}{master}_{start}" if start else f"{DEFAULT_DIR_PREFIX}{master}"
+    return Path(tempfile.gettempdir()) / name
+
+
+_default_in_use = not (os.getenv("METRICS_DIR") or os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+METRICS_DIR = Path(
+    os.getenv("METRICS_DIR")
+    or os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    or _default_dir()
+)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_registry: "t.Dict[str, _Metric]" = {}
+_owner_pid = os.getpid()
+_last_flush = 0.0
+_pruned = False
+
+
+def _label_key(labelnames: t.Tuple[str, ...], labels: dict) -> t.Tuple[str, ...]:
+    return tuple(str(labels.get(n, "")) for n in labelnames)
+
+
+def _check_fork():
+    """Drop values inherited from a parent process (e.g. gunicorn --preload)."""
+    global _owner_pid, _last_flush
+    pid = os.getpid()
+    if pid != _owner_pid:
+        _owner_pid = pid
+        _last_flush = 0.0
+        for m in _registry.values():
+            m._values.clear()
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: t.Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict = {}
+        with _lock:
+            _registry[name] = self
+
+    def _snapshot(self) -> list:
+        return [[list(k), v] for k, v in self._values.items()]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            _check_fork()
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            _check_fork()
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            _check_fork()
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: t.Sequence[str] = (),
+                 buckets: t.Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            _check_fork()
+            v = self._values.get(key)
+            if v is None:
+                v = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._values[key] = v
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    v["buckets"][i] += 1
+                    break
+            v["sum"] += value
+            v["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+# --- multi-process snapshot files ---
+
+def _snapshot_path(pid: int) -> Path:
+    return METRICS_DIR / f"metrics_{pid}.json"
+
+
+def _stale_dir(name: str) -> bool:
+    """True for a default directory whose master has exited (or been replaced)."""
+    pid, _, start = name[len(DEFAULT_DIR_PREFIX):].partition("_")
+    if not pid.isdigit():
+        return False
+    if start:
+        return _process_start(int(pid)) != start
+    return not _pid_alive(int(pid))
+
+
+def _prune_stale_dirs():
+    """Remove default directories left behind by earlier masters."""
+    base = METRICS_DIR.parent
+    for d in base.glob(f"{DEFAULT_DIR_PREFIX}*"):
+        if d != METRICS_DIR and d.is_dir() and _stale_dir(d.name):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def flush():
+    """Write this process's values to its snapshot file (atomic replace)."""
+    global _last_flush, _pruned
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _check_fork()
+        data = {
+            "pid": os.getpid(),
+            "metrics": {
+                name: {
+                    "type": m.type,
+                    "help": m.documentation,
+                    "labelnames": list(m.labelnames),
+                    "buckets": list(getattr(m, "buckets", ())),
+                    "samples": m._snapshot(),
+                }
+                for name, m in _registry.items()
+            },
+        }
+        _last_flush = time.time()
+    try:
+        if _default_in_use and not _pruned:
+            _pruned = True
+            _prune_stale_dirs()
+        METRICS_DIR.mkdir(parents=True, exist_ok=True)
+        path = _snapshot_path(data["pid"])
+        tmp = path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, path)
+    except Exception:
+        # metrics must never break request handling
+        pass
+
+
+def maybe_flush():
+    if METRICS_ENABLED and time.time() - _last_flush >= METRICS_FLUSH_SECONDS:
+        flush()
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except Exception:
+        return True
+
+
+def collect() -> dict:
+    """Merge all process snapshots into {name: {type, help, labelnames, buckets, samples{key: value}}}."""
+    flush()
+    merged: dict = {}
+    try:
+        paths = list(METRICS_DIR.glob("metrics_*.json"))
+    except Exception:
+        paths = []
+    for p in paths:
+        try:
+            with p.open("r", encoding="utf-8") as f:
+                snap = json.load(f)
+        except Exception:
+            continue
+        alive = _pid_alive(int(snap.get("pid") or 0))
+        for name, m in (snap.get("metrics") or {}).items():
+            if m.get("type") == "gauge" and not alive:
+                continue
+            out = merged.setdefault(name, {
+                "type": m.get("type"),
+                "help": m.get("help", ""),
+                "labelnames": m.get("labelnames", []),
+                "buckets": m.get("buckets", []),
+                "samples": {},
+            })
+            for labels, value in m.get("samples", []):
+                key = tuple(labels)
+                if out["type"] == "histogram":
+                    cur = out["samples"].get(key)
+                    if cur is None:
+                        out["samples"][key] = {"buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"]}
+                    else:
+                        cur["buckets"] = [a + b for a, b in zip(cur["buckets"], value["buckets"])]
+                        cur["sum"] += value["sum"]
+                        cur["count"] += value["count"]
+                else:
+                    out["samples"][key] = out["samples"].get(key, 0.0) + value
+    return merged
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: t.Sequence[str], values: t.Sequence[str], extra: t.Optional[t.Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+def render() -> str:
+    """Render the merged metrics in the Prometheus text exposition format."""
+    lines = []
+    for name, m in sorted(collect().items()):
+        lines.append(f"# HELP {name} {m['help']}")
+        lines.append(f"# TYPE {name} {m['type']}")
+        names = m["labelnames"]
+        for key, value in sorted(m["samples"].items()):
+            if m["type"] == "histogram":
+                cumulative = 0
+                for bound, count in zip(m["buckets"], value["buckets"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_fmt_labels(names, key, ('le', _fmt_value(bound)))} {cumulative}")
+                lines.append(f"{name}_bucket{_fmt_labels(names, key, ('le', '+Inf'))} {value['count']}")
+                lines.append(f"{name}_sum{_fmt_labels(names, key)} {_fmt_value(value['sum'])}")
+                lines.append(f"{name}_count{_fmt_labels(names, key)} {value['count']}")
+            else:
+                lines.append(f"{name}{_fmt_labels(names, key)} {_fmt_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Instruments shared by the app ---
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency (time to response headers)", ("method", "route"))
+OPENAI_LATENCY = Histogram("openai_request_duration_seconds", "Upstream chat.completions call latency", ("endpoint", "stream", "outcome"))
+CHAT_REQUESTS = Counter("chat_requests_total", "Chat turns by how they were answered (local, cache, upstream, refused)", ("endpoint", "path"))
+CHAT_TTFT = Histogram("chat_time_to_first_token_seconds", "Time from upstream call start to the first streamed /chat delta", ())
+SUMMARY_TTFC = Histogram("summary_time_to_first_content_seconds", "Time from the start of a streamed summary to its first delta or section event", ())
+GATEWAY_DECISIONS = Counter("gateway_decisions_total", "Gateway allow/deny decisions by source", ("source", "allowed"))
+TOKENS_RESERVED = Counter("tokens_reserved_total", "Tokens reserved from users' tokens_left", ("endpoint",))
+TOKENS_REFUNDED = Counter("tokens_refunded_total", "Tokens refunded to users after upstream failures", ("endpoint",))
+TOKENS_CACHE_DISCOUNT = Counter("tokens_cache_discount_total", "Reserved tokens given back because the prompt was served from the provider cache", ("endpoint",))
+RATE_LIMIT_REJECTIONS = Counter("rate_limit_rejections_total", "Requests rejected by the in-memory rate limiter", ("endpoint",))
+WS_CONNECTIONS = Gauge("ws_chat_connections", "Open /ws/chat connections", ())
+WS_TURNS = Counter("ws_chat_turns_total", "Chat turns handled over /ws/chat", ("outcome",))
+WS_TURN_LATENCY = Histogram("ws_chat_turn_duration_seconds", "Time from a /ws/chat turn's request to its done/error message", ("outcome",))
+WS_DISCONNECTS = Counter("ws_chat_disconnects_total", "/ws/chat connections closed, by reason", ("reason",))
+MESSAGE_BATCH_SIZE = Histogram("message_batch_size", "Messages per POST /messages/batch request", (), buckets=(1, 2, 4, 8, 16, 32, 64))
+STORAGE_LATENCY = Histogram(
+    "storage_operation_duration_seconds",
+    "Storage read/write latency",
+    ("op", "kind"),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
@@ -0,0 +1,92 @@
+"""Snapshot + append-only op log shared by the per-user derived indexes.
+
+A derived index (search postings, related-thread vectors, ...) is stored as
+
+    <name>.idx    snapshot written atomically (tmp + rename)
+    <name>.log    JSON lines appended since the snapshot
+    <name>.lock   flock serialising writers across worker processes
+
+Writers append one line per change; readers remember the snapshot they
+loaded (inode + mtime) and the log offset they have replayed, so each
+refresh only reads bytes appended since the last one.
+"""
+import fcntl
+import os
+import typing as t
+from contextlib import contextmanager
+from pathlib import Path
+
+import serialization
+
+
+class OpLog:
+    def __init__(self, directory: Path, name: str):
+        self.snapshot = directory / f"{name}.idx"
+        self.log = directory / f"{name}.log"
+        self.lock = directory / f"{name}.lock"
+
+    @contextmanager
+    def locked(self):
+        self.lock.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock, "a") as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lf, fcntl.LOCK_UN)
+
+    def snapshot_sig(self) -> t.Optional[t.Tuple[int, int]]:
+        try:
+            st = self.snapshot.stat()
+            return (st.st_ino, st.st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    def append(self, op: dict) -> None:
+        """Append one op. Callers should hold `locked()` if they also compact."""
+        self.extend([op])
+
+    def extend(self, ops: t.Sequence[dict]) -> None:
+        """Append several ops with one lock and one write."""
+        if not ops:
+            return
+        with self.locked():
+            with open(self.log, "ab") as f:
+                f.write(b"".join(serialization.dumps(op) + b"\n" for op in ops))
+
+    def read_since(self, offset: int) -> t.Tuple[t.List[dict], int]:
+        """Return complete ops appended after `offset` and the new offset."""
+        try:
+            with open(self.log, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], offset
+        # only consume complete lines; a concurrent append may be mid-write
+        end = data.rfind(b"\n") + 1
+        ops = []
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                ops.append(serialization.loads(line))
+            except Exception:
+                continue
+        return ops, offset + end
+
+    def write_snapshot(self, data: bytes) -> t.Optional[t.Tuple[int, int]]:
+        """Atomically replace the snapshot and truncate the log. Caller holds the lock."""
+        self.snapshot.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.snapshot.with_name(f".{self.snapshot.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, self.snapshot)
+        with open(self.log, "wb"):
+            pass
+        return self.snapshot_sig()
+
+    def remove(self) -> None:
+        for p in (self.snapshot, self.log, self.lock):
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,126 @@
+"""Prompt assembly for the provider's prefix cache, and cached-token accounting.
+
+The provider caches the longest previously seen prompt prefix (in 128-token
+steps, for prompts of 1024 tokens or more) and reports the reused part as
+`usage.prompt_tokens_details.cached_tokens`. A request only hits the cache
+if its messages start exactly like an earlier one. Messages are therefore
+ordered from most to least stable:
+
+  1. the fixed system prompt
+  2. the conversation history (grows only by appending)
+  3. volatile context such as the previous summary
+  4. the per-call instruction
+
+The three summary sections then share everything up to their instruction,
+and a summary of the next turn reuses the previous turn's history.
+
+`record_usage` feeds the prompt_tokens_total / prompt_cached_tokens_total
+counters and the per-call prompt_cache_hit_ratio histogram. The cache hit
+ratio is rate(prompt_cached_tokens_total) / rate(prompt_tokens_total).
+`cached_discount` is the part of a reservation to give back for cached
+tokens, which are billed at PROMPT_CACHED_TOKEN_RATE of the full price.
+"""
+import math
+import os
+import typing as t
+
+import metrics
+
+PROMPT_CACHED_TOKEN_RATE = float(os.getenv("PROMPT_CACHED_TOKEN_RATE") or "0.5")
+
+SUMMARY_SYSTEM_PROMPT = "You are a helpful assistant that summarizes conversations."
+
+PROMPT_TOKENS = metrics.Counter("prompt_tokens_total", "Prompt tokens sent upstream", ("endpoint",))
+PROMPT_CACHED_TOKENS = metrics.Counter("prompt_cached_tokens_total", "Prompt tokens served from the provider's prefix cache", ("endpoint",))
+PROMPT_CACHE_HIT_RATIO = metrics.Histogram(
+    "prompt_cache_hit_ratio", "Fraction of each call's prompt tokens that were cached", ("endpoint",),
+    buckets=(0.0, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0),
+)
+
+
+class Usage(t.NamedTuple):
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+
+
+def _field(obj, name: str):
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def parse_usage(usage) -> t.Optional[Usage]:
+    """Read a `usage` object or dict; None when the response carried none."""
+    if usage is None:
+        return None
+    try:
+        cached = _field(_field(usage, "prompt_tokens_details"), "cached_tokens") or 0
+        return Usage(
+            int(_field(usage, "prompt_tokens") or 0),
+            int(cached),
+            int(_field(usage, "completion_tokens") or 0),
+        )
+    except (TypeError, ValueError):
+        return None
+
+
+def record_usage(endpoint: str, usage) -> t.Optional[Usage]:
+    u = parse_usage(usage)
+    if u is None or not u.prompt_tokens:
+        return u
+    PROMPT_TOKENS.inc(u.prompt_tokens, endpoint=endpoint)
+    PROMPT_CACHED_TOKENS.inc(u.cached_tokens, endpoint=endpoint)
+    PROMPT_CACHE_HIT_RATIO.observe(u.cached_tokens / u.prompt_tokens, endpoint=endpoint)
+    return u
+
+
+def cached_discount(usage: t.Optional[Usage]) -> int:
+    """Tokens to refund for a call whose prompt was partly cached."""
+    if not usage or not usage.cached_tokens:
+        return 0
+    return int(math.floor(usage.cached_tokens * (1.0 - PROMPT_CACHED_TOKEN_RATE)))
+
+
+def summary_messages(history: t.Sequence[dict], instruction: str,
+                     last_summary: t.Optional[str] = None) -> t.List[dict]:
+    msgs = [{"role": "system", "content": SUMMARY_SYSTEM_PROMPT}]
+    msgs.extend(history)
+    if last_summary:
+        msgs.append({"role": "system", "content": f"Previous summary: {last_summary}"})
+    msgs.append({"role": "system", "content": instruction})
+    return msgs
+
+
+class UsageStream:
+    """Pass a streamed completion through, recording its trailing usage chunk.
+
+    Streams are requested with `stream_options={"include_usage": True}`; the
+    provider then sends one last chunk with empty `choices` and the usage,
+    which is consumed here rather than handed to the caller.
+    """
+
+    def __init__(self, stream: t.Iterable, endpoint: str):
+        self._stream = stream
+        self._it = iter(stream)
+        self.endpoint = endpoint
+        self.usage: t.Optional[Usage] = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            chunk = next(self._it)
+            usage = _field(chunk, "usage")
+            if usage is not None and not _field(chunk, "choices"):
+                self.usage = record_usage(self.endpoint, usage)
+                continue
+            return chunk
+
+    def close(self) -> None:
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            close()
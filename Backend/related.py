@@ -0,0 +1,326 @@
+"""Related-thread lookup from per-thread TF-IDF vectors.
+
+Each thread is represented by the sum of its messages' vectors, produced by
+the fitted vectorizer inside `topic_classifier.pkl` (every pipeline step but
+the final classifier). Vectors for one user are kept as rows of a SciPy CSR
+matrix, so "threads similar to this one" is a single sparse matrix-vector
+product followed by `argpartition`; nothing loops over threads in Python.
+
+Persistence follows the same snapshot + op-log scheme as search (see
+`oplog.py`): the snapshot is an `.npz` of the matrix, each new message
+appends its sparse vector to the log, and in-memory indexes fold pending
+rows into the matrix in one batched update right before a query. Indexes
+built with a different vectorizer (e.g. after retraining) are rebuilt from
+the thread files on first use. At most RELATED_CACHE_USERS indexes stay in
+memory per process (least recently used first, each for at most
+RELATED_CACHE_TTL_SECONDS); an evicted one is reloaded from its snapshot.
+"""
+import io
+import os
+import threading
+import time
+import typing as t
+
+import numpy as np
+import scipy.sparse as sp
+
+import metrics
+import storage
+import tracing
+from cache import TTLCache
+from oplog import OpLog
+
+RELATED_LOG_COMPACT_LINES = int(os.getenv("RELATED_LOG_COMPACT_LINES") or "500")
+RELATED_CACHE_USERS = int(os.getenv("RELATED_CACHE_USERS") or "1000")
+RELATED_CACHE_TTL_SECONDS = float(os.getenv("RELATED_CACHE_TTL_SECONDS") or "3600")
+
+RELATED_LATENCY = metrics.Histogram(
+    "related_threads_query_duration_seconds",
+    "Related-threads query latency (pending merge + similarity)",
+    (),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+
+_vectorizer = None
+_fingerprint = ""
+
+
+def vectorizer_from_pipeline(pipe):
+    """Return the transform part of a fitted sklearn Pipeline (all steps but the classifier)."""
+    try:
+        if pipe is not None and len(pipe.steps) > 1:
+            return pipe[:-1]
+    except Exception:
+        pass
+    return None
+
+
+def set_vectorizer(vec) -> None:
+    """Install the vectorizer used for thread vectors; indexes built with another one are rebuilt."""
+    global _vectorizer, _fingerprint
+    fingerprint = ""
+    if vec is not None:
+        try:
+            import joblib
+            fingerprint = joblib.hash(vec)
+        except Exception:
+            fingerprint = str(id(vec))
+    _vectorizer, _fingerprint = vec, fingerprint
+    _cache.clear()
+
+
+def available() -> bool:
+    return _vectorizer is not None
+
+
+def _vectorize(texts: t.List[str]) -> sp.csr_matrix:
+    return sp.csr_matrix(_vectorizer.transform(texts))
+
+
+class RelatedIndex:
+    """Thread vectors for one user, with batched application of pending updates."""
+
+    def __init__(self, n_features: int, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.matrix = sp.csr_matrix((0, n_features), dtype=np.float64)
+        self.norms = np.zeros(0)
+        self.thread_ids: t.List[str] = []
+        self.row_of: t.Dict[str, int] = {}
+        self._pending: t.List[t.Tuple[int, list, list]] = []
+        self._drops: t.Set[int] = set()
+        # reentrant: log replays hold it across apply()
+        self._lock = threading.RLock()
+        self.snapshot_sig = None
+        self.log_offset = 0
+        self.log_lines = 0
+
+    def _row(self, thread_id: str) -> int:
+        row = self.row_of.get(thread_id)
+        if row is None:
+            row = len(self.thread_ids)
+            self.thread_ids.append(thread_id)
+            self.row_of[thread_id] = row
+        return row
+
+    def add(self, thread_id: str, indices: t.Sequence[int], values: t.Sequence[float]):
+        with self._lock:
+            self._pending.append((self._row(thread_id), list(indices), list(values)))
+
+    def drop(self, thread_id: str):
+        with self._lock:
+            row = self.row_of.get(thread_id)
+            if row is None:
+                return
+            # apply earlier adds first so the drop clears them too
+            self._merge_locked()
+            self._drops.add(row)
+
+    def apply(self, op: dict):
+        if op.get("op") == "add":
+            self.add(op["t"], op.get("j") or [], op.get("v") or [])
+        elif op.get("op") == "drop":
+            self.drop(op["t"])
+
+    def _merge_locked(self):
+        n = len(self.thread_ids)
+        m = self.matrix
+        if not self._pending and not self._drops and m.shape[0] == n:
+            return
+        if m.shape[0] < n:
+            m = sp.vstack([m, sp.csr_matrix((n - m.shape[0], m.shape[1]))], format="csr")
+        if self._drops:
+            keep = np.ones(n)
+            keep[list(self._drops)] = 0.0
+            m = sp.diags(keep) @ m
+            self._drops.clear()
+        if self._pending:
+            rows = np.concatenate([np.full(len(ix), r, dtype=np.int64) for r, ix, _ in self._pending])
+            cols = np.concatenate([np.asarray(ix, dtype=np.int64) for _, ix, _ in self._pending])
+            vals = np.concatenate([np.asarray(v, dtype=np.float64) for _, _, v in self._pending])
+            m = m + sp.csr_matrix((vals, (rows, cols)), shape=m.shape)
+            self._pending.clear()
+        m = sp.csr_matrix(m)
+        m.eliminate_zeros()
+        self.matrix = m
+        self.norms = np.sqrt(np.asarray(m.multiply(m).sum(axis=1)).ravel())
+
+    def related(self, thread_id: str, limit: int = 5) -> t.List[dict]:
+        with self._lock:
+            self._merge_locked()
+            row = self.row_of.get(thread_id)
+            if row is None or row >= len(self.norms) or self.norms[row] == 0:
+                return []
+            m, norms = self.matrix, self.norms
+            sims = np.asarray((m @ m[row].T).todense()).ravel()
+        denom = norms * norms[row]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sims = np.where(denom > 0, sims / denom, 0.0)
+        sims[row] = -1.0
+        k = min(limit, len(sims) - 1)
+        if k <= 0:
+            return []
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        top = top[sims[top] > 0]
+        return [{"thread_id": self.thread_ids[i], "score": round(float(sims[i]), 4)} for i in top]
+
+    def to_snapshot(self) -> bytes:
+        with self._lock:
+            self._merge_locked()
+            buf = io.BytesIO()
+            np.savez(
+                buf,
+                data=self.matrix.data,
+                indices=self.matrix.indices,
+                indptr=self.matrix.indptr,
+                shape=np.asarray(self.matrix.shape),
+                thread_ids=np.asarray(self.thread_ids, dtype=str),
+                fingerprint=np.asarray(self.fingerprint),
+            )
+            return buf.getvalue()
+
+    @classmethod
+    def from_snapshot(cls, data: bytes) -> "RelatedIndex":
+        z = np.load(io.BytesIO(data), allow_pickle=False)
+        shape = tuple(int(x) for x in z["shape"])
+        idx = cls(shape[1], str(z["fingerprint"]))
+        idx.matrix = sp.csr_matrix((z["data"], z["indices"], z["indptr"]), shape=shape)
+        idx.thread_ids = [str(x) for x in z["thread_ids"]]
+        idx.row_of = {tid: i for i, tid in enumerate(idx.thread_ids)}
+        idx.norms = np.sqrt(np.asarray(idx.matrix.multiply(idx.matrix).sum(axis=1)).ravel())
+        return idx
+
+
+# --- persistence ---
+
+_cache = TTLCache(maxsize=RELATED_CACHE_USERS, ttl=RELATED_CACHE_TTL_SECONDS)
+
+
+def _oplog(user_id: str) -> OpLog:
+    return OpLog(storage.user_dir(user_id), "_related")
+
+
+def _n_features() -> int:
+    return _vectorize([""]).shape[1]
+
+
+def _build_from_stores(user_id: str) -> RelatedIndex:
+    idx = RelatedIndex(_n_features(), _fingerprint)
+    texts: t.List[str] = []
+    owners: t.List[int] = []
+    for thread_id, path in storage.list_thread_files(user_id):
+        try:
+            msgs = storage.read_thread_file(path)
+        except Exception:
+            continue
+        row = idx._row(thread_id)
+        for m in msgs if isinstance(msgs, list) else []:
+            if isinstance(m, dict) and m.get("content"):
+                texts.append(str(m["content"]))
+                owners.append(row)
+    n = len(idx.thread_ids)
+    if texts:
+        # one transform for all messages, then sum rows per thread with an indicator matrix
+        x = _vectorize(texts)
+        g = sp.csr_matrix((np.ones(len(owners)), (np.asarray(owners), np.arange(len(owners)))), shape=(n, len(owners)))
+        idx.matrix = sp.csr_matrix(g @ x)
+    else:
+        idx.matrix = sp.csr_matrix((n, idx.matrix.shape[1]))
+    idx.norms = np.sqrt(np.asarray(idx.matrix.multiply(idx.matrix).sum(axis=1)).ravel())
+    return idx
+
+
+def _write_snapshot(log: OpLog, idx: RelatedIndex):
+    with idx._lock:
+        idx.snapshot_sig = log.write_snapshot(idx.to_snapshot())
+        idx.log_offset = 0
+        idx.log_lines = 0
+
+
+def rebuild_index(user_id: str) -> RelatedIndex:
+    log = _oplog(user_id)
+    with log.locked():
+        idx = _build_from_stores(user_id)
+        _write_snapshot(log, idx)
+    _cache.set(user_id, idx)
+    return idx
+
+
+def _replay_log(log: OpLog, idx: RelatedIndex):
+    # read and apply under the index lock so two threads never replay the same bytes
+    with idx._lock:
+        ops, idx.log_offset = log.read_since(idx.log_offset)
+        for op in ops:
+            idx.apply(op)
+        idx.log_lines += len(ops)
+
+
+def _load(user_id: str) -> RelatedIndex:
+    log = _oplog(user_id)
+    idx = _cache.get(user_id)
+    sig = log.snapshot_sig()
+    if sig is None:
+        return rebuild_index(user_id)
+    if idx is None or idx.snapshot_sig != sig:
+        try:
+            idx = RelatedIndex.from_snapshot(log.snapshot.read_bytes())
+        except Exception:
+            return rebuild_index(user_id)
+        if idx.fingerprint != _fingerprint:
+            return rebuild_index(user_id)
+        idx.snapshot_sig = sig
+    _replay_log(log, idx)
+    _cache.set(user_id, idx)
+    return idx
+
+
+def _append_op(user_id: str, op: dict):
+    log = _oplog(user_id)
+    if log.snapshot_sig() is None:
+        rebuild_index(user_id)
+        return
+    log.append(op)
+    idx = _load(user_id)
+    if idx.log_lines >= RELATED_LOG_COMPACT_LINES:
+        with log.locked():
+            if log.snapshot_sig() == idx.snapshot_sig:
+                _replay_log(log, idx)
+                _write_snapshot(log, idx)
+
+
+def index_message(user_id: str, thread_id: str, content: str):
+    if not available() or not content:
+        return
+    with tracing.span("related.index_message"):
+        vec = _vectorize([str(content)])
+        _append_op(user_id, {"op": "add", "t": thread_id, "j": vec.indices.tolist(), "v": vec.data.tolist()})
+
+
+def index_messages(user_id: str, thread_id: str, contents: t.Sequence[str]):
+    """Add several messages to one thread's vector as a single op (thread vectors are sums)."""
+    contents = [str(c) for c in contents if c]
+    if not available() or not contents:
+        return
+    with tracing.span("related.index_messages"):
+        vec = sp.csr_matrix(_vectorize(contents).sum(axis=0))
+        _append_op(user_id, {"op": "add", "t": thread_id, "j": vec.indices.tolist(), "v": vec.data.tolist()})
+
+
+def forget_user(user_id: str):
+    """Drop a user's cached index after their directory was removed."""
+    _cache.pop(user_id)
+
+
+def drop_thread(user_id: str, thread_id: str):
+    if not available():
+        return
+    with tracing.span("related.drop_thread"):
+        _append_op(user_id, {"op": "drop", "t": thread_id})
+
+
+def related_threads(user_id: str, thread_id: str, limit: int = 5) -> t.List[dict]:
+    start = time.perf_counter()
+    with tracing.span("related.query"):
+        results = _load(user_id).related(thread_id, limit=limit)
+    RELATED_LATENCY.observe(time.perf_counter() - start)
+    return results
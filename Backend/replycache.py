@@ -0,0 +1,105 @@
+"""Cache of context-free /chat replies.
+
+/chat and /ws/chat send only the system prompt and one user message, so the
+same question always gets an equivalent completion. With
+REPLY_CACHE_SIZE > 0 the replies are kept in a TTL/LRU cache (see cache.py)
+keyed on (system prompt, model, temperature bucket, normalized message).
+Normalization is the same as the gateway's decision cache.
+
+Each key holds a pool of up to REPLY_CACHE_VARIANTS different replies. A key
+answers from the cache only once its pool is full, and then with a random
+variant, so a repeated question does not always get the same words. Until
+then every call goes upstream and adds its reply to the pool. Hits never
+reach upstream and are not charged to `tokens_left`.
+
+Hits are replayed over SSE a few words at a time, REPLY_CACHE_REPLAY_DELAY_MS
+apart, so they read like a live stream. The hit rate is
+rate(reply_cache_requests_total{result="hit"}) / rate(reply_cache_requests_total),
+and reply_cache_upstream_calls_saved_total counts the avoided calls. Each
+worker process has its own cache.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import typing as t
+
+import gateway
+import metrics
+from cache import TTLCache
+
+REPLY_CACHE_SIZE = int(os.getenv("REPLY_CACHE_SIZE") or "0")
+REPLY_CACHE_TTL_SECONDS = float(os.getenv("REPLY_CACHE_TTL_SECONDS") or "3600")
+REPLY_CACHE_VARIANTS = int(os.getenv("REPLY_CACHE_VARIANTS") or "3")
+REPLY_CACHE_TEMPERATURE_STEP = float(os.getenv("REPLY_CACHE_TEMPERATURE_STEP") or "0.25")
+REPLY_CACHE_REPLAY_DELAY_MS = float(os.getenv("REPLY_CACHE_REPLAY_DELAY_MS") or "20")
+REPLAY_WORDS_PER_CHUNK = 2
+
+REPLY_CACHE_REQUESTS = metrics.Counter("reply_cache_requests_total", "Reply cache lookups by result (hit/miss)", ("endpoint", "result"))
+REPLY_CACHE_SAVED = metrics.Counter("reply_cache_upstream_calls_saved_total", "Upstream chat calls answered from the reply cache", ("endpoint",))
+REPLY_CACHE_ENTRIES = metrics.Gauge("reply_cache_entries", "Keys in this process's reply cache", ())
+
+_cache = TTLCache(maxsize=REPLY_CACHE_SIZE, ttl=REPLY_CACHE_TTL_SECONDS)
+_lock = threading.Lock()
+
+Key = t.Tuple[str, str, float, str]
+
+
+def enabled() -> bool:
+    return _cache.maxsize > 0
+
+
+def key(system_prompt: str, model: str, temperature: float, message: str) -> Key:
+    step = REPLY_CACHE_TEMPERATURE_STEP
+    bucket = round(round(temperature / step) * step, 3) if step > 0 else float(temperature)
+    prompt_hash = hashlib.sha1(system_prompt.encode("utf-8")).hexdigest()[:16]
+    return (prompt_hash, model, bucket, gateway.normalize(message))
+
+
+def lookup(k: Key, endpoint: str, rng: t.Optional[random.Random] = None) -> t.Optional[str]:
+    """A cached reply once the key's variant pool is full, else None (go upstream)."""
+    if not enabled():
+        return None
+    pool = _cache.get(k)
+    if pool is None or len(pool) < REPLY_CACHE_VARIANTS:
+        REPLY_CACHE_REQUESTS.inc(endpoint=endpoint, result="miss")
+        return None
+    REPLY_CACHE_REQUESTS.inc(endpoint=endpoint, result="hit")
+    REPLY_CACHE_SAVED.inc(endpoint=endpoint)
+    return (rng or random).choice(pool)
+
+
+def add(k: Key, reply: str) -> None:
+    """Add an upstream reply to the key's variant pool (duplicates and empty replies are skipped)."""
+    if not enabled() or not reply or not reply.strip():
+        return
+    with _lock:
+        pool = _cache.get(k) or ()
+        if reply in pool or len(pool) >= REPLY_CACHE_VARIANTS:
+            return
+        _cache.set(k, pool + (reply,))
+    REPLY_CACHE_ENTRIES.set(len(_cache))
+
+
+def clear() -> None:
+    _cache.clear()
+    REPLY_CACHE_ENTRIES.set(0)
+
+
+def chunks(reply: str) -> t.List[str]:
+    """Split a reply into a few words per chunk; joining them gives the reply back."""
+    words = re.findall(r"\s*\S+|\s+$", reply)
+    return ["".join(words[i:i + REPLAY_WORDS_PER_CHUNK]) for i in range(0, len(words), REPLAY_WORDS_PER_CHUNK)] or [reply]
+
+
+async def replay_sse(reply: str) -> t.AsyncIterator[str]:
+    """Stream a cached reply in /chat's SSE format at a natural pace."""
+    delay = REPLY_CACHE_REPLAY_DELAY_MS / 1000.0
+    for i, part in enumerate(chunks(reply)):
+        if i and delay:
+            await asyncio.sleep(delay)
+        yield f"data: {json.dumps({'delta': part})}\n\n"
+    yield "data: [DONE]\n\n"
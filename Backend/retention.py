@@ -0,0 +1,195 @@
+"""Expire anonymous users' data.
+
+`anon_*` users can write threads without signing up, and nothing else ever
+removes them. `storage.record_activity` appends one line per anonymous
+thread write to the activity index in `DATA_DIR/_activity/`: a snapshot of
+{user: {thread: last_activity}} plus an append-only log, flock-protected
+(see `oplog.py`). A sweep reads that index, never DATA_DIR itself:
+
+  - threads idle for ANON_TTL_DAYS lose their messages and saved summary;
+  - threads with no messages left (deleted, or never written) go after
+    ANON_EMPTY_TTL_HOURS;
+  - a user with nothing left loses their directory, including the derived
+    search / related-thread indexes.
+
+The index may lag the files (another worker wrote a thread moments ago), so
+the newer of the indexed time and the file's mtime is used. Entries are
+removed from the index only after their files are gone. Activity logged
+while a sweep runs is kept.
+
+One worker sweeps every ANON_GC_INTERVAL_SECONDS (0 disables); the others
+skip that round. `scripts/gc_anonymous.py` runs a sweep by hand and
+backfills the index for data written before it existed.
+"""
+import fcntl
+import os
+import threading
+import time
+import typing as t
+
+import metrics
+import related
+import search
+import serialization
+import storage
+
+ANON_TTL_DAYS = float(os.getenv("ANON_TTL_DAYS") or "30")
+ANON_EMPTY_TTL_HOURS = float(os.getenv("ANON_EMPTY_TTL_HOURS") or "1")
+ANON_GC_INTERVAL_SECONDS = float(os.getenv("ANON_GC_INTERVAL_SECONDS") or "3600")
+
+GC_THREADS_REMOVED = metrics.Counter("anon_gc_threads_removed_total", "Anonymous threads removed by the TTL sweeper", ())
+GC_USERS_REMOVED = metrics.Counter("anon_gc_users_removed_total", "Anonymous users whose directories were removed", ())
+GC_BYTES_RECLAIMED = metrics.Counter("anon_gc_bytes_reclaimed_total", "Bytes freed by the anonymous-data sweeper", ())
+GC_INDEXED_THREADS = metrics.Gauge("anon_gc_indexed_threads", "Anonymous threads tracked by the activity index", ())
+
+Activity = t.Dict[str, t.Dict[str, float]]
+
+
+def _apply(state: Activity, ops: t.Iterable[dict]) -> None:
+    for op in ops:
+        try:
+            user, thread, ts = op["u"], op["t"], float(op["ts"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        threads = state.setdefault(user, {})
+        if ts > threads.get(thread, 0.0):
+            threads[thread] = ts
+
+
+def load_activity() -> t.Tuple[Activity, int]:
+    """Read the snapshot and log; returns the state and the log offset consumed."""
+    log = storage.activity_log()
+    state: Activity = {}
+    try:
+        state = {u: dict(th) for u, th in serialization.load_file(log.snapshot).items()}
+    except FileNotFoundError:
+        pass
+    ops, offset = log.read_since(0)
+    _apply(state, ops)
+    return state, offset
+
+
+def _last_activity(user_id: str, thread_id: str, indexed: float) -> t.Tuple[float, bool]:
+    """(newest of index time and file mtimes, whether the thread still has messages)."""
+    newest = indexed
+    has_messages = False
+    hot = storage._thread_path(user_id, thread_id)
+    for p in (hot, storage._cold_path(hot), storage._summary_path(user_id, thread_id)):
+        try:
+            newest = max(newest, p.stat().st_mtime)
+        except FileNotFoundError:
+            continue
+    try:
+        if hot.exists():
+            has_messages = bool(serialization.load_file(hot))
+        elif storage._cold_path(hot).exists():
+            has_messages = bool(storage.read_cold_file(storage._cold_path(hot)))
+    except Exception:
+        has_messages = True  # unreadable: leave it to the full TTL
+    return newest, has_messages
+
+
+def sweep(now: t.Optional[float] = None, ttl_days: float = ANON_TTL_DAYS,
+          empty_ttl_hours: float = ANON_EMPTY_TTL_HOURS, dry_run: bool = False) -> dict:
+    """Remove expired anonymous threads; returns a report with the bytes reclaimed."""
+    now = time.time() if now is None else now
+    start = time.perf_counter()
+    report = {"indexed": 0, "threads": 0, "users": 0, "bytes": 0, "seconds": 0.0}
+    log = storage.activity_log()
+    with log.locked():
+        state, offset = load_activity()
+    report["indexed"] = sum(len(th) for th in state.values())
+
+    removed: t.Dict[str, t.List[str]] = {}
+    for user_id, threads in state.items():
+        for thread_id, indexed in threads.items():
+            last, has_messages = _last_activity(user_id, thread_id, indexed)
+            ttl = (ttl_days * 86400.0) if has_messages else (empty_ttl_hours * 3600.0)
+            if now - last < ttl:
+                continue
+            removed.setdefault(user_id, []).append(thread_id)
+            report["threads"] += 1
+            if dry_run:
+                continue
+            report["bytes"] += (storage.delete_thread(user_id, thread_id, track=False)
+                                + storage.delete_summary(user_id, thread_id))
+
+    if not dry_run:
+        for user_id, thread_ids in removed.items():
+            if len(thread_ids) == len(state[user_id]) and not storage.list_thread_files(user_id):
+                freed = storage.remove_user_dir(user_id)
+                if freed or not storage.user_dir(user_id).exists():
+                    report["users"] += 1
+                    report["bytes"] += freed
+                    search.forget_user(user_id)
+                    related.forget_user(user_id)
+                    continue
+            for thread_id in thread_ids:
+                try:
+                    search.drop_thread(user_id, thread_id)
+                    related.drop_thread(user_id, thread_id)
+                except Exception as e:
+                    print(f"[retention] index update failed for {user_id}/{thread_id}: {e}")
+
+        with log.locked():
+            for user_id, thread_ids in removed.items():
+                for thread_id in thread_ids:
+                    state[user_id].pop(thread_id, None)
+                if not state[user_id]:
+                    del state[user_id]
+            # keep activity logged by other workers while this sweep ran
+            ops, _ = log.read_since(offset)
+            _apply(state, ops)
+            log.write_snapshot(serialization.dumps(state))
+        GC_THREADS_REMOVED.inc(report["threads"])
+        GC_USERS_REMOVED.inc(report["users"])
+        GC_BYTES_RECLAIMED.inc(report["bytes"])
+        GC_INDEXED_THREADS.set(sum(len(th) for th in state.values()))
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+
+def backfill() -> int:
+    """Index every existing anonymous thread (full scan; run once after upgrading)."""
+    ops = []
+    for user_id in storage.list_user_ids():
+        if not user_id.startswith(storage.ANON_PREFIX):
+            continue
+        for thread_id, path in storage.list_thread_files(user_id):
+            try:
+                ts = path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            ops.append({"u": user_id, "t": thread_id, "ts": ts})
+    log = storage.activity_log()
+    with log.locked():
+        state, _ = load_activity()
+        _apply(state, ops)
+        log.write_snapshot(serialization.dumps(state))
+    return len(ops)
+
+
+def _sweep_loop(interval: float):
+    lock_path = storage.DATA_DIR / ".anon_gc.lock"
+    while True:
+        time.sleep(interval)
+        try:
+            with open(lock_path, "a") as lf:
+                try:
+                    # one worker sweeps at a time; the others skip this round
+                    fcntl.flock(lf, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+                report = sweep()
+                if report["threads"]:
+                    print("[retention] anonymous data sweep:", report)
+        except Exception as e:
+            print("[retention] anonymous data sweep failed:", e)
+
+
+def start_sweeper(interval: float = ANON_GC_INTERVAL_SECONDS) -> t.Optional[threading.Thread]:
+    if interval <= 0 or ANON_TTL_DAYS <= 0:
+        return None
+    th = threading.Thread(target=_sweep_loop, args=(interval,), name="anon-gc", daemon=True)
+    th.start()
+    return th
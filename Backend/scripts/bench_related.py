@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark the related-threads index at realistic per-user scale.
+
+Usage:
+  python scripts/bench_related.py [--threads 10000] [--msgs-per-thread 8] [--queries 200]
+
+Builds one user's index with N threads using the fitted vectorizer from
+topic_classifier.pkl, then reports build time, incremental update cost,
+and query latency with and without pending updates to fold in.
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import joblib
+
+import related
+
+MODEL = Path(__file__).resolve().parent.parent / "topic_classifier.pkl"
+WORDS = ("manager career job anxious stress partner relationship weekend trip goal habit routine decision "
+         "feel stuck overwhelmed team project deadline promotion sleep work family friends health money").split()
+
+
+def fake_message(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 30)))
+
+
+def ms(samples):
+    samples = sorted(samples)
+    return f"p50={statistics.median(samples) * 1000:.3f}ms p95={samples[int(len(samples) * 0.95) - 1] * 1000:.3f}ms"
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark related-threads similarity")
+    ap.add_argument("--threads", type=int, default=10000)
+    ap.add_argument("--msgs-per-thread", type=int, default=8)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    related.set_vectorizer(related.vectorizer_from_pipeline(joblib.load(MODEL)))
+    n_features = related._n_features()
+
+    texts, owners = [], []
+    for tid in range(args.threads):
+        for _ in range(args.msgs_per_thread):
+            texts.append(fake_message(rng))
+            owners.append(tid)
+
+    start = time.perf_counter()
+    idx = related.RelatedIndex(n_features, related._fingerprint)
+    x = related._vectorize(texts)
+    for i in range(len(texts)):
+        row = x.getrow(i)
+        idx.add(f"t{owners[i]}", row.indices, row.data)
+    vec_s = time.perf_counter() - start
+    start = time.perf_counter()
+    idx.related("t0")
+    merge_s = time.perf_counter() - start
+    print(f"threads={args.threads} messages={len(texts)} features={n_features} nnz={idx.matrix.nnz}")
+    print(f"initial load: vectorize+queue {vec_s:.2f}s, batched merge {merge_s:.3f}s")
+
+    # steady-state queries (nothing pending)
+    lat = []
+    for _ in range(args.queries):
+        tid = f"t{rng.randrange(args.threads)}"
+        t0 = time.perf_counter()
+        idx.related(tid, limit=5)
+        lat.append(time.perf_counter() - t0)
+    print("query, no pending updates:", ms(lat))
+
+    # one new message per query, as under live traffic
+    upd, lat = [], []
+    for _ in range(args.queries):
+        tid = f"t{rng.randrange(args.threads)}"
+        t0 = time.perf_counter()
+        v = related._vectorize([fake_message(rng)])
+        idx.add(tid, v.indices, v.data)
+        upd.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        idx.related(tid, limit=5)
+        lat.append(time.perf_counter() - t0)
+    print("incremental update (vectorize + queue):", ms(upd))
+    print("query after one pending update:", ms(lat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark thread-file serialization: the legacy pretty-printed stdlib format
+versus the compact format written by `serialization.py` (stdlib and orjson).
+
+Usage:
+  python scripts/bench_serialization.py [--sizes 10,500,5000] [--repeat 20]
+
+For each thread size it reports serialize time, parse time and file size.
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+SAMPLE = [
+    "I've been feeling stuck at work and my manager keeps moving the goalposts.",
+    "It sounds like the uncertainty is wearing on you. What would a good week look like?",
+    "Honestly I'd just like to finish one project without it being re-scoped — é, ü and ✓ included.",
+]
+
+
+def make_thread(n: int) -> list:
+    base = datetime(2026, 1, 1)
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": SAMPLE[i % len(SAMPLE)],
+            "ts": (base + timedelta(seconds=37 * i)).isoformat(),
+        }
+        for i in range(n)
+    ]
+
+
+def _formats():
+    fmts = {
+        "json indent=2 (legacy)": (
+            lambda o: json.dumps(o, ensure_ascii=False, indent=2).encode("utf-8"),
+            lambda b: json.loads(b.decode("utf-8")),
+        ),
+        "json compact": (
+            lambda o: json.dumps(o, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+            lambda b: json.loads(b.decode("utf-8")),
+        ),
+    }
+    if orjson is not None:
+        fmts["orjson compact"] = (orjson.dumps, orjson.loads)
+    return fmts
+
+
+def bench(n: int, repeat: int, tmpdir: Path):
+    thread = make_thread(n)
+    rows = []
+    for name, (dump, load) in _formats().items():
+        path = tmpdir / f"bench_{n}.json"
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            data = dump(thread)
+            path.write_bytes(data)
+        ser = (time.perf_counter() - t0) / repeat
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            load(path.read_bytes())
+        par = (time.perf_counter() - t0) / repeat
+        rows.append((name, ser * 1000, par * 1000, path.stat().st_size))
+    return rows
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark storage serialization formats")
+    ap.add_argument("--sizes", default="10,500,5000")
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args(argv)
+
+    import serialization
+    print("serialization backend in use:", serialization.BACKEND)
+    with tempfile.TemporaryDirectory() as d:
+        for n in [int(x) for x in args.sizes.split(",") if x.strip()]:
+            print(f"\n== {n} messages")
+            print(f"{'format':26} {'serialize+write ms':>19} {'read+parse ms':>14} {'bytes':>10}")
+            rows = bench(n, args.repeat, Path(d))
+            legacy_size = rows[0][3]
+            for name, ser, par, size in rows:
+                print(f"{name:26} {ser:>19.3f} {par:>14.3f} {size:>10} ({size / legacy_size:.0%})")
+
+
+if __name__ == "__main__":
+    main()
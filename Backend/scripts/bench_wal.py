@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Benchmark storage write throughput with many concurrent writers.
+
+Usage:
+  python scripts/bench_wal.py [--writers 100] [--writes 50] [--messages 20] [--dir PATH]
+
+Each writer thread saves its own thread file `--writes` times through
+`storage.save_messages`. Three modes are compared in a temporary DATA_DIR
+(use --dir to put it on the disk you care about; tmpfs makes fsync free):
+
+  direct        WAL disabled: rewrite the file, no durability (old behaviour)
+  fsync-each    rewrite + fsync per save (durable without a log)
+  wal           write-ahead log with group commit (one fsync per batch)
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import serialization
+import storage
+import wal
+
+
+def _fsync_each(path, obj):
+    with open(path, "wb") as f:
+        f.write(serialization.dumps(obj))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _fsync_count() -> int:
+    return sum(v["count"] for v in wal.WAL_BATCH_RECORDS._values.values())
+
+
+def run(mode: str, base: Path, writers: int, writes: int, messages: int) -> dict:
+    data_dir = base / mode
+    data_dir.mkdir()
+    storage.DATA_DIR = data_dir
+    storage.USERS_FILE = data_dir / "users.json"
+    storage._legacy_pending = False
+    storage.WAL_ENABLED = mode == "wal"
+    orig_dump = serialization.dump_file
+    if mode == "fsync-each":
+        serialization.dump_file = _fsync_each
+    if mode == "wal":
+        storage.start_wal()
+    batches_before = _fsync_count()
+    payload = [{"role": "user", "content": "x" * 200, "ts": "2026-01-01T00:00:00"} for _ in range(messages)]
+    latencies = [[] for _ in range(writers)]
+    barrier = threading.Barrier(writers + 1)
+
+    def worker(i):
+        barrier.wait()
+        for _ in range(writes):
+            t0 = time.perf_counter()
+            storage.save_messages(f"bench{i % 10}", f"t{i}", payload)
+            latencies[i].append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(writers)]
+    for th in threads:
+        th.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for th in threads:
+        th.join()
+    elapsed = time.perf_counter() - start
+    serialization.dump_file = orig_dump
+    lat = sorted(x for per in latencies for x in per)
+    total = len(lat)
+    out = {
+        "mode": mode,
+        "writes": total,
+        "seconds": elapsed,
+        "writes_per_s": total / elapsed,
+        "p50_ms": statistics.median(lat) * 1000,
+        "p99_ms": lat[int(0.99 * (total - 1))] * 1000,
+    }
+    if mode == "wal":
+        batches = _fsync_count() - batches_before
+        out["records_per_fsync"] = total / batches if batches else None
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark concurrent storage writes with and without the WAL")
+    ap.add_argument("--writers", type=int, default=100)
+    ap.add_argument("--writes", type=int, default=50, help="saves per writer")
+    ap.add_argument("--messages", type=int, default=20, help="messages per saved thread")
+    ap.add_argument("--dir", help="parent directory for the temporary DATA_DIRs")
+    args = ap.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as d:
+        print(f"{args.writers} writers x {args.writes} saves, {args.messages} messages per thread, in {d}")
+        print(f"{'mode':12} {'writes/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'records/fsync':>14}")
+        for mode in ("direct", "fsync-each", "wal"):
+            r = run(mode, Path(d), args.writers, args.writes, args.messages)
+            per = "-" if r.get("records_per_fsync") is None else f"{r['records_per_fsync']:.1f}"
+            print(f"{r['mode']:12} {r['writes_per_s']:>10.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {per:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Compress inactive thread and summary files into the cold tier and report
+disk savings and cold-read latency.
+
+Usage:
+  python scripts/compact_cold_threads.py --days 21
+  python scripts/compact_cold_threads.py --days 0 --measure-reads 50
+
+The server runs the same compaction periodically (COLD_TIER_AFTER_DAYS,
+COLD_COMPACT_INTERVAL_SECONDS); this script is for one-off runs and for
+measuring the effect.
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import storage
+
+
+def measure_cold_reads(limit: int) -> list:
+    """Time decompress+parse of up to `limit` cold files (without promoting them)."""
+    timings = []
+    for p in (storage.DATA_DIR / storage.COLD_DIR_NAME).glob("??/*/*.json" + storage.COLD_SUFFIX):
+        if len(timings) >= limit:
+            break
+        start = time.perf_counter()
+        storage.read_cold_file(p)
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return timings
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Move inactive threads to the compressed cold tier")
+    ap.add_argument("--days", type=float, default=storage.COLD_TIER_AFTER_DAYS, help="inactivity threshold in days")
+    ap.add_argument("--measure-reads", type=int, default=20, help="cold files to time reads on (0 to skip)")
+    args = ap.parse_args(argv)
+
+    report = storage.compact_cold_files(args.days)
+    saved = report["bytes_before"] - report["bytes_after"]
+    ratio = (report["bytes_after"] / report["bytes_before"]) if report["bytes_before"] else 0.0
+    print(f"Compacted {report['files']} files in {report['seconds']}s: "
+          f"{report['bytes_before']} -> {report['bytes_after']} bytes "
+          f"(saved {saved} bytes, {ratio:.0%} of original)")
+
+    if args.measure_reads:
+        timings = measure_cold_reads(args.measure_reads)
+        if timings:
+            timings.sort()
+            print(f"Cold read latency over {len(timings)} files: "
+                  f"p50={statistics.median(timings):.3f}ms max={timings[-1]:.3f}ms")
+        else:
+            print("No cold files to measure.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Local fake OpenAI chat-completions server for load testing.
+
+Usage:
+  python scripts/fake_openai_server.py --port 9100 --latency-ms 300 --tokens-per-sec 40
+
+Then point the backend at it:
+  OPENAI_API_KEY=fake OPENAI_BASE_URL=http://127.0.0.1:9100/v1 \
+      gunicorn -k uvicorn.workers.UvicornWorker main:app --workers 2
+
+Only `POST /v1/chat/completions` is implemented, in both streaming (SSE) and
+non-streaming form. Latency, token rate and error injection are configurable
+so upstream behaviour can be held constant while the backend is measured.
+
+Prompt caching is imitated: the longest run of leading messages seen in an
+earlier request is reported as `usage.prompt_tokens_details.cached_tokens`
+(in 128-token steps, only for prompts of 1024+ tokens). Streams send a usage
+chunk when the request sets `stream_options.include_usage`.
+"""
+import argparse
+import collections
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "You are carrying a lot right now and it makes sense to feel stretched. "
+    "Try naming the one decision that would make the rest of the week lighter, "
+    "then take a small step toward it today. Notice what helps and keep it."
+).split()
+
+STATS = {"requests": 0, "streamed": 0, "errors_injected": 0, "prompt_tokens": 0, "cached_tokens": 0}
+_stats_lock = threading.Lock()
+_prefixes: "collections.OrderedDict[str, None]" = collections.OrderedDict()
+PREFIX_CACHE_ENTRIES = 10000
+
+
+def _bump(key: str):
+    with _stats_lock:
+        STATS[key] = STATS.get(key, 0) + 1
+
+
+def _reply_words(max_tokens: int, reply_tokens: int) -> list:
+    n = max(1, min(int(max_tokens or reply_tokens), reply_tokens))
+    return [WORDS[i % len(WORDS)] for i in range(n)]
+
+
+def _prompt_tokens(messages: list) -> int:
+    # same rough 4-chars-per-token heuristic the backend uses
+    total = 0
+    for m in messages or []:
+        total += max(1, (len(str(m.get("content") or "")) + 3) // 4)
+    return total
+
+
+def _cached_tokens(messages: list) -> int:
+    """Tokens in the longest message prefix seen before; remembers this request's prefixes."""
+    h = hashlib.sha1()
+    cached = tokens = 0
+    with _stats_lock:
+        for m in messages or []:
+            h.update(json.dumps([m.get("role"), m.get("content")]).encode("utf-8"))
+            tokens += max(1, (len(str(m.get("content") or "")) + 3) // 4)
+            key = h.hexdigest()
+            if key in _prefixes:
+                _prefixes.move_to_end(key)
+                cached = tokens
+            else:
+                _prefixes[key] = None
+                if len(_prefixes) > PREFIX_CACHE_ENTRIES:
+                    _prefixes.popitem(last=False)
+    if tokens < 1024:
+        return 0
+    return cached // 128 * 128
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: argparse.Namespace = None
+
+    def log_message(self, fmt, *args):
+        if self.config.verbose:
+            super().log_message(fmt, *args)
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            with _stats_lock:
+                return self._send_json(200, dict(STATS))
+        return self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send_json(404, {"error": {"message": "not found"}})
+        try:
+            payload = json.loads(raw or b"{}")
+        except Exception:
+            return self._send_json(400, {"error": {"message": "invalid json"}})
+        _bump("requests")
+
+        cfg = self.config
+        if cfg.error_rate and random.random() < cfg.error_rate:
+            _bump("errors_injected")
+            time.sleep(cfg.latency_ms / 1000.0)
+            return self._send_json(cfg.error_status, {"error": {"message": "injected upstream error", "type": "server_error"}})
+
+        model = payload.get("model") or "gpt-4o-mini"
+        words = _reply_words(payload.get("max_tokens"), cfg.reply_tokens)
+        prompt_tokens = _prompt_tokens(payload.get("messages"))
+        cached_tokens = _cached_tokens(payload.get("messages"))
+        with _stats_lock:
+            STATS["prompt_tokens"] += prompt_tokens
+            STATS["cached_tokens"] += cached_tokens
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(words),
+            "total_tokens": prompt_tokens + len(words),
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        per_token = 1.0 / cfg.tokens_per_sec if cfg.tokens_per_sec > 0 else 0.0
+        jitter = random.uniform(-cfg.jitter_ms, cfg.jitter_ms) if cfg.jitter_ms else 0.0
+        time.sleep(max(0.0, (cfg.latency_ms + jitter) / 1000.0))
+
+        if payload.get("stream"):
+            _bump("streamed")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            try:
+                for i, w in enumerate(words):
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {"content": (w if i == 0 else " " + w)}, "finish_reason": None}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    if per_token:
+                        time.sleep(per_token)
+                final = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                }
+                self.wfile.write(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+                if (payload.get("stream_options") or {}).get("include_usage"):
+                    tail = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [],
+                        "usage": usage,
+                    }
+                    self.wfile.write(f"data: {json.dumps(tail)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            return
+
+        if per_token:
+            time.sleep(per_token * len(words))
+        body = {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(words)},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        }
+        return self._send_json(200, body)
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Fake OpenAI chat-completions server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9100)
+    ap.add_argument("--latency-ms", type=float, default=200.0, help="delay before the first token / response")
+    ap.add_argument("--jitter-ms", type=float, default=0.0, help="uniform +/- jitter applied to --latency-ms")
+    ap.add_argument("--tokens-per-sec", type=float, default=50.0, help="generation rate; 0 disables per-token delay")
+    ap.add_argument("--reply-tokens", type=int, default=40, help="upper bound on tokens per reply (max_tokens also applies)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with --error-status")
+    ap.add_argument("--error-status", type=int, default=500)
+    ap.add_argument("--verbose", action="store_true")
+    return ap.parse_args(argv)
+
+
+def make_server(args) -> ThreadingHTTPServer:
+    handler = type("ConfiguredHandler", (Handler,), {"config": args})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = make_server(args)
+    print(f"Fake OpenAI server listening on http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("stats:", json.dumps(STATS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Remove expired anonymous (`anon_*`) threads and report the space reclaimed.
+
+Usage:
+  python scripts/gc_anonymous.py --backfill          # once, to index pre-existing anonymous data
+  python scripts/gc_anonymous.py --days 30 --dry-run
+  python scripts/gc_anonymous.py --days 30 --empty-hours 1
+
+The server runs the same sweep periodically (ANON_TTL_DAYS,
+ANON_EMPTY_TTL_HOURS, ANON_GC_INTERVAL_SECONDS). Sweeps read the activity
+index only; --backfill is the one step that lists DATA_DIR.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import retention
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Expire idle anonymous users' threads")
+    ap.add_argument("--days", type=float, default=retention.ANON_TTL_DAYS, help="TTL for threads with messages")
+    ap.add_argument("--empty-hours", type=float, default=retention.ANON_EMPTY_TTL_HOURS,
+                    help="TTL for threads with no messages left")
+    ap.add_argument("--backfill", action="store_true", help="index existing anonymous threads before sweeping")
+    ap.add_argument("--dry-run", action="store_true", help="report what would be removed without deleting")
+    args = ap.parse_args(argv)
+
+    if args.backfill:
+        print(f"Indexed {retention.backfill()} anonymous threads")
+    report = retention.sweep(ttl_days=args.days, empty_ttl_hours=args.empty_hours, dry_run=args.dry_run)
+    verb = "Would remove" if args.dry_run else "Removed"
+    print(f"{verb} {report['threads']} of {report['indexed']} indexed threads "
+          f"({report['users']} users emptied), reclaimed {report['bytes']} bytes in {report['seconds']}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,568 @@
+#!/usr/bin/env python3
+"""
+End-to-end load-test harness for the backend.
+
+Usage:
+  # 1. start the fake upstream and the backend pointed at it
+  python scripts/fake_openai_server.py --port 9100 &
+  OPENAI_API_KEY=fake OPENAI_BASE_URL=http://127.0.0.1:9100/v1 WEB_CONCURRENCY=2 \
+      gunicorn -k uvicorn.workers.UvicornWorker main:app --workers 2 --bind 127.0.0.1:8000 &
+
+  # 2. drive it with scripted users and write a results file
+  python scripts/loadtest.py --base-url http://127.0.0.1:8000 --users 20 --duration 60 \
+      --label "workers=2" --out loadtest_results.json
+
+  # 3. compare two runs (e.g. two releases or two WEB_CONCURRENCY settings)
+  python scripts/loadtest.py --compare before.json after.json
+
+Each virtual user signs up (or uses an `anon_*` id), then loops over a weighted
+mix of `/message`, `/chat` (SSE), `/summary`, `/threads` and `/users/login`
+(add e.g. `batch=20` to the mix to save turns through `/messages/batch`).
+Latency percentiles (p50/p95/p99) and RPS are reported per route. Only the
+standard library is used so the harness runs anywhere the backend does.
+
+Comparing the HTTP and WebSocket chat paths:
+  # a full turn over HTTP (SSE /chat, then save both sides via /messages/batch)
+  python scripts/loadtest.py --mix http_turn=1 --server-pid $(pgrep -o gunicorn) --out http.json
+  # the same turn over one persistent /ws/chat connection per user
+  python scripts/loadtest.py --mix ws_turn=1 --server-pid $(pgrep -o gunicorn) --out ws.json
+  python scripts/loadtest.py --compare http.json ws.json
+
+Both record a `turn:*` route, so turns/sec is its rps. With --server-pid the
+server's CPU time (the pid and all its descendants, read from /proc) is
+measured over the run and reported as milliseconds of CPU per turn.
+"""
+import argparse
+import base64
+import http.client
+import json
+import os
+import random
+import socket
+import ssl
+import struct
+import sys
+import threading
+import time
+import typing as t
+import uuid
+from datetime import datetime
+from urllib.parse import urlparse
+
+DEFAULT_MIX = "message=40,chat=20,threads=20,summary=10,login=10"
+
+CHAT_PROMPTS = [
+    "I feel stuck in my job and I'm not sure what to do next",
+    "My manager keeps changing priorities and I'm stressed",
+    "I'm anxious about a big career decision",
+    "How do I build a better morning routine?",
+    "I feel overwhelmed with work and my relationship",
+    "hi",
+    "thanks, that helps",
+]
+
+
+def parse_mix(spec: str) -> t.List[t.Tuple[str, float]]:
+    pairs = []
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, weight = part.partition("=")
+        pairs.append((name.strip(), float(weight or 1)))
+    return pairs
+
+
+def percentile(sorted_vals: t.List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_vals:
+        return 0.0
+    k = max(0, min(len(sorted_vals) - 1, int(round(pct / 100.0 * len(sorted_vals) + 0.5)) - 1))
+    return sorted_vals[k]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: t.Dict[str, list] = {}
+        self.ttft: t.Dict[str, list] = {}
+
+    def add(self, route: str, seconds: float, status: int, ttft: t.Optional[float] = None):
+        with self._lock:
+            self.samples.setdefault(route, []).append((seconds, status))
+            if ttft is not None:
+                self.ttft.setdefault(route, []).append(ttft)
+
+
+class WebSocketClient:
+    """Just enough RFC 6455 for a JSON text protocol: masked text frames out, unfragmented frames in."""
+
+    def __init__(self, host: str, port: int, path: str, secure: bool, timeout: float,
+                 headers: t.Optional[dict] = None):
+        sock = socket.create_connection((host, port), timeout=timeout)
+        if secure:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+        self.sock = sock
+        self.buf = b""
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        lines = [f"GET {path} HTTP/1.1", f"Host: {host}:{port}", "Upgrade: websocket", "Connection: Upgrade",
+                 f"Sec-WebSocket-Key: {key}", "Sec-WebSocket-Version: 13"]
+        lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode("ascii"))
+        while b"\r\n\r\n" not in self.buf:
+            self._fill()
+        head, self.buf = self.buf.split(b"\r\n\r\n", 1)
+        if not head.startswith(b"HTTP/1.1 101"):
+            raise ConnectionError(head.split(b"\r\n", 1)[0].decode("latin-1"))
+
+    def _fill(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError("connection closed")
+        self.buf += data
+
+    def _take(self, n: int) -> bytes:
+        while len(self.buf) < n:
+            self._fill()
+        out, self.buf = self.buf[:n], self.buf[n:]
+        return out
+
+    def send_json(self, obj: dict):
+        payload = json.dumps(obj).encode("utf-8")
+        n = len(payload)
+        if n < 126:
+            header = struct.pack("!BB", 0x81, 0x80 | n)
+        elif n < 65536:
+            header = struct.pack("!BBH", 0x81, 0x80 | 126, n)
+        else:
+            header = struct.pack("!BBQ", 0x81, 0x80 | 127, n)
+        mask = os.urandom(4)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self.sock.sendall(header + mask + masked)
+
+    def recv_json(self) -> dict:
+        while True:
+            b0, b1 = self._take(2)
+            n = b1 & 0x7F
+            if n == 126:
+                n = struct.unpack("!H", self._take(2))[0]
+            elif n == 127:
+                n = struct.unpack("!Q", self._take(8))[0]
+            payload = self._take(n)
+            opcode = b0 & 0x0F
+            if opcode == 0x1:
+                return json.loads(payload)
+            if opcode == 0x8:
+                code = struct.unpack("!H", payload[:2])[0] if len(payload) >= 2 else 1005
+                raise ConnectionError(f"closed by server ({code})")
+            if opcode == 0x9:  # ping -> pong
+                self.sock.sendall(struct.pack("!BB", 0x8A, 0x80 | n) + b"\0\0\0\0" + payload)
+
+    def close(self):
+        try:
+            self.sock.sendall(struct.pack("!BB", 0x88, 0x80) + b"\0\0\0\0")
+        except Exception:
+            pass
+        self.sock.close()
+
+
+class VirtualUser:
+    def __init__(self, idx: int, args, recorder: Recorder, rng: random.Random):
+        self.idx = idx
+        self.args = args
+        self.rec = recorder
+        self.rng = rng
+        parsed = urlparse(args.base_url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.https = parsed.scheme == "https"
+        self.conn = None
+        self.ws: t.Optional[WebSocketClient] = None
+        self.anonymous = rng.random() < args.anon_fraction
+        self.user_id = None
+        self.token = None
+        self.email = None
+        self.password = "loadtest-pw"
+        self.threads = [f"lt_{idx}_{i}" for i in range(max(1, args.threads_per_user))]
+
+    # --- transport -------------------------------------------------------
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        self.conn = cls(self.host, self.port, timeout=self.args.timeout)
+
+    def _headers(self, extra: t.Optional[dict] = None) -> dict:
+        h = {"Content-Type": "application/json"}
+        if self.token:
+            h["Authorization"] = f"Bearer {self.token}"
+        if extra:
+            h.update(extra)
+        return h
+
+    def request(self, route: str, method: str, path: str, body: t.Optional[dict] = None,
+                headers: t.Optional[dict] = None, sse: bool = False, record: bool = True):
+        """Perform one request; returns (status, parsed_json_or_None)."""
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        ttft = None
+        status = 0
+        parsed = None
+        start = time.perf_counter()
+        try:
+            if self.conn is None:
+                self._connect()
+            self.conn.request(method, path, body=data, headers=self._headers(headers))
+            resp = self.conn.getresponse()
+            status = resp.status
+            if sse and status == 200:
+                # read the event stream line by line until [DONE]
+                while True:
+                    line = resp.readline()
+                    if not line:
+                        break
+                    if line.startswith(b"data:"):
+                        if ttft is None:
+                            ttft = time.perf_counter() - start
+                        if line.strip() == b"data: [DONE]":
+                            break
+                resp.read()
+            else:
+                raw = resp.read()
+                try:
+                    parsed = json.loads(raw) if raw else None
+                except Exception:
+                    parsed = None
+            if resp.getheader("connection", "").lower() == "close":
+                self.conn.close()
+                self.conn = None
+        except Exception:
+            status = 0
+            try:
+                if self.conn:
+                    self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+        elapsed = time.perf_counter() - start
+        if record:
+            self.rec.add(route, elapsed, status, ttft)
+        return status, parsed
+
+    # --- scripted behaviour ---------------------------------------------
+    def setup(self):
+        if self.anonymous:
+            self.user_id = f"anon_lt{uuid.uuid4().hex[:10]}"
+            return
+        self.email = f"loadtest+{uuid.uuid4().hex[:12]}@example.com"
+        status, body = self.request("/users/create", "POST", "/users/create", {
+            "name": f"Load Test {self.idx}", "email": self.email, "password": self.password,
+        }, record=False)
+        if status == 200 and body:
+            self.user_id = body.get("user", {}).get("user_id")
+            self.token = body.get("token")
+        if not self.user_id:
+            # fall back to anonymous so the run still exercises the routes
+            self.anonymous = True
+            self.user_id = f"anon_lt{uuid.uuid4().hex[:10]}"
+
+    def top_up(self):
+        if self.anonymous or not self.token:
+            return
+        self.request("/users/{user_id}/credits", "POST", f"/users/{self.user_id}/credits",
+                     {"amount": 5000}, record=False)
+
+    def do_message(self):
+        tid = self.rng.choice(self.threads)
+        self.request("/message", "POST", "/message", {
+            "user_id": self.user_id, "thread_id": tid, "role": self.rng.choice(["user", "assistant"]),
+            "content": self.rng.choice(CHAT_PROMPTS),
+        })
+
+    def do_batch(self):
+        # one chat turn (user + assistant) saved in a single request
+        tid = self.rng.choice(self.threads)
+        self.request("/messages/batch", "POST", "/messages/batch", {"messages": [
+            {"user_id": self.user_id, "thread_id": tid, "role": "user", "content": self.rng.choice(CHAT_PROMPTS)},
+            {"user_id": self.user_id, "thread_id": tid, "role": "assistant", "content": self.rng.choice(CHAT_PROMPTS)},
+        ]})
+
+    def do_chat(self):
+        status, body = self.request("/chat", "POST", "/chat?stream=true",
+                                    {"message": self.rng.choice(CHAT_PROMPTS)},
+                                    headers={"Accept": "text/event-stream"}, sse=True)
+        if status == 403:
+            self.top_up()
+
+    def do_http_turn(self):
+        # what the frontend does per turn over HTTP: stream the reply, then save both sides
+        tid = self.rng.choice(self.threads)
+        prompt = self.rng.choice(CHAT_PROMPTS)
+        start = time.perf_counter()
+        status, _ = self.request("/chat", "POST", "/chat?stream=true", {"message": prompt},
+                                 headers={"Accept": "text/event-stream"}, sse=True)
+        if status == 200:
+            status, _ = self.request("/messages/batch", "POST", "/messages/batch", {"messages": [
+                {"user_id": self.user_id, "thread_id": tid, "role": "user", "content": prompt},
+                {"user_id": self.user_id, "thread_id": tid, "role": "assistant", "content": "(streamed reply)"},
+            ]})
+        self.rec.add("turn:http", time.perf_counter() - start, status)
+        if status == 403:
+            self.top_up()
+
+    def _ws_connect(self):
+        self.ws = WebSocketClient(self.host, self.port, "/ws/chat", self.https, self.args.timeout)
+        if self.token:
+            self.ws.send_json({"type": "auth", "token": self.token})
+            self.ws.recv_json()
+
+    def do_ws_turn(self):
+        tid = self.rng.choice(self.threads)
+        status = 0
+        ttft = None
+        start = time.perf_counter()
+        try:
+            if self.ws is None:
+                self._ws_connect()
+            self.ws.send_json({"type": "chat", "user_id": self.user_id, "thread_id": tid,
+                               "message": self.rng.choice(CHAT_PROMPTS)})
+            while True:
+                msg = self.ws.recv_json()
+                if msg.get("type") == "delta":
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                elif msg.get("type") == "done":
+                    status = 200
+                    break
+                elif msg.get("type") == "error":
+                    status = int(msg.get("status") or 500)
+                    break
+        except Exception:
+            status = 0
+            if self.ws is not None:
+                self.ws.close()
+            self.ws = None
+        self.rec.add("turn:ws", time.perf_counter() - start, status, ttft)
+        if status == 403:
+            self.top_up()
+
+    def do_summary(self):
+        tid = self.rng.choice(self.threads)
+        status, _ = self.request("/summary/{user_id}/{thread_id}", "GET", f"/summary/{self.user_id}/{tid}")
+        if status == 403:
+            self.top_up()
+
+    def do_threads(self):
+        self.request("/threads/{user_id}", "GET", f"/threads/{self.user_id}")
+
+    def do_login(self):
+        if self.anonymous:
+            return self.do_threads()
+        status, body = self.request("/users/login", "POST", "/users/login",
+                                    {"email": self.email, "password": self.password})
+        if status == 200 and body and body.get("token"):
+            self.token = body["token"]
+
+    def run(self, deadline: float, mix: t.List[t.Tuple[str, float]]):
+        self.setup()
+        names = [m[0] for m in mix]
+        weights = [m[1] for m in mix]
+        think = self.args.think_ms / 1000.0
+        while time.time() < deadline:
+            action = self.rng.choices(names, weights=weights, k=1)[0]
+            fn = getattr(self, f"do_{action}", None)
+            if fn is None:
+                continue
+            fn()
+            if think:
+                time.sleep(self.rng.uniform(0, 2 * think))
+        if self.ws is not None:
+            self.ws.close()
+
+
+def _proc_cpu_seconds(pids: t.List[int]) -> t.Optional[float]:
+    """utime+stime of the given pids and all their descendants (Linux /proc)."""
+    ticks = os.sysconf("SC_CLK_TCK")
+    stats = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                # the command name may contain spaces; fields resume after its ')'
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        stats[int(entry)] = (int(fields[1]), int(fields[11]) + int(fields[12]))  # ppid, utime+stime
+    if not any(p in stats for p in pids):
+        return None
+    tree = set(pids)
+    grew = True
+    while grew:
+        grew = False
+        for pid, (ppid, _) in stats.items():
+            if ppid in tree and pid not in tree:
+                tree.add(pid)
+                grew = True
+    return sum(stats[p][1] for p in tree if p in stats) / ticks
+
+
+def summarize(rec: Recorder, wall: float) -> dict:
+    routes = {}
+    all_lat = []
+    total_errors = 0
+    for route, samples in sorted(rec.samples.items()):
+        lats = sorted(s[0] for s in samples)
+        all_lat.extend(lats)
+        statuses: t.Dict[str, int] = {}
+        errors = 0
+        for _, st in samples:
+            statuses[str(st)] = statuses.get(str(st), 0) + 1
+            if st == 0 or st >= 500:
+                errors += 1
+        total_errors += errors
+        entry = {
+            "count": len(samples),
+            "errors": errors,
+            "rps": round(len(samples) / wall, 3) if wall else 0.0,
+            "mean_ms": round(1000 * sum(lats) / len(lats), 2),
+            "p50_ms": round(1000 * percentile(lats, 50), 2),
+            "p95_ms": round(1000 * percentile(lats, 95), 2),
+            "p99_ms": round(1000 * percentile(lats, 99), 2),
+            "max_ms": round(1000 * lats[-1], 2),
+            "status_counts": statuses,
+        }
+        ttfts = sorted(rec.ttft.get(route, []))
+        if ttfts:
+            entry["ttft_p50_ms"] = round(1000 * percentile(ttfts, 50), 2)
+            entry["ttft_p95_ms"] = round(1000 * percentile(ttfts, 95), 2)
+            entry["ttft_p99_ms"] = round(1000 * percentile(ttfts, 99), 2)
+        routes[route] = entry
+    all_lat.sort()
+    total = {
+        "count": len(all_lat),
+        "errors": total_errors,
+        "rps": round(len(all_lat) / wall, 3) if wall else 0.0,
+        "p50_ms": round(1000 * percentile(all_lat, 50), 2),
+        "p95_ms": round(1000 * percentile(all_lat, 95), 2),
+        "p99_ms": round(1000 * percentile(all_lat, 99), 2),
+    }
+    return {"routes": routes, "total": total}
+
+
+def run(args) -> dict:
+    mix = parse_mix(args.mix)
+    rec = Recorder()
+    rng = random.Random(args.seed)
+    users = [VirtualUser(i, args, rec, random.Random(rng.random())) for i in range(args.users)]
+    pids = [int(p) for p in (args.server_pid or "").split(",") if p.strip()]
+    cpu_before = _proc_cpu_seconds(pids) if pids else None
+    deadline = time.time() + args.duration
+    threads = [threading.Thread(target=u.run, args=(deadline, mix), daemon=True) for u in users]
+    started = time.time()
+    for th in threads:
+        th.start()
+        if args.ramp_ms:
+            time.sleep(args.ramp_ms / 1000.0)
+    for th in threads:
+        th.join(timeout=args.duration + args.timeout + 5)
+    wall = time.time() - started
+    result = summarize(rec, wall)
+    cpu_after = _proc_cpu_seconds(pids) if pids else None
+    if cpu_before is not None and cpu_after is not None:
+        turns = sum(1 for route, samples in rec.samples.items() if route.startswith("turn:")
+                    for _, st in samples if st == 200)
+        cpu = cpu_after - cpu_before
+        result["server_cpu"] = {
+            "seconds": round(cpu, 3),
+            "turns": turns,
+            "ms_per_turn": round(1000 * cpu / turns, 3) if turns else None,
+        }
+    result["meta"] = {
+        "label": args.label,
+        "base_url": args.base_url,
+        "users": args.users,
+        "anon_fraction": args.anon_fraction,
+        "duration_s": round(wall, 3),
+        "mix": args.mix,
+        "seed": args.seed,
+        "server_pid": args.server_pid or None,
+        "web_concurrency": os.getenv("WEB_CONCURRENCY"),
+        "started_at": datetime.utcfromtimestamp(started).isoformat(),
+    }
+    return result
+
+
+def print_report(result: dict):
+    meta = result.get("meta", {})
+    print(f"label={meta.get('label')} users={meta.get('users')} duration={meta.get('duration_s')}s")
+    print(f"{'route':34} {'count':>7} {'err':>5} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for route, r in result["routes"].items():
+        print(f"{route:34} {r['count']:>7} {r['errors']:>5} {r['rps']:>8} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9}")
+    tot = result["total"]
+    print(f"{'TOTAL':34} {tot['count']:>7} {tot['errors']:>5} {tot['rps']:>8} {tot['p50_ms']:>9} {tot['p95_ms']:>9} {tot['p99_ms']:>9}")
+    cpu = result.get("server_cpu")
+    if cpu:
+        print(f"server cpu={cpu['seconds']}s turns={cpu['turns']} cpu/turn={cpu['ms_per_turn']}ms")
+
+
+def compare(path_a: str, path_b: str):
+    with open(path_a, "r", encoding="utf-8") as f:
+        a = json.load(f)
+    with open(path_b, "r", encoding="utf-8") as f:
+        b = json.load(f)
+    print(f"A={a.get('meta', {}).get('label')}  B={b.get('meta', {}).get('label')}")
+    print(f"{'route':34} {'metric':>8} {'A':>10} {'B':>10} {'delta%':>8}")
+    routes = sorted(set(a["routes"]) | set(b["routes"]))
+    for route in routes + ["TOTAL"]:
+        ra = a["total"] if route == "TOTAL" else a["routes"].get(route, {})
+        rb = b["total"] if route == "TOTAL" else b["routes"].get(route, {})
+        for metric in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+            va, vb = ra.get(metric), rb.get(metric)
+            if va is None or vb is None:
+                continue
+            delta = ((vb - va) / va * 100.0) if va else 0.0
+            print(f"{route:34} {metric:>8} {va:>10} {vb:>10} {delta:>7.1f}%")
+    # turns/sec across transports (turn:http in one file vs turn:ws in the other)
+    ta = sum(r["rps"] for k, r in a["routes"].items() if k.startswith("turn:"))
+    tb = sum(r["rps"] for k, r in b["routes"].items() if k.startswith("turn:"))
+    if ta and tb:
+        print(f"{'turns':34} {'rps':>8} {ta:>10} {tb:>10} {(tb - ta) / ta * 100.0:>7.1f}%")
+    va = (a.get("server_cpu") or {}).get("ms_per_turn")
+    vb = (b.get("server_cpu") or {}).get("ms_per_turn")
+    if va and vb:
+        print(f"{'server cpu/turn':34} {'ms':>8} {va:>10} {vb:>10} {(vb - va) / va * 100.0:>7.1f}%")
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Load-test the backend with scripted users")
+    ap.add_argument("--base-url", default="http://127.0.0.1:8000")
+    ap.add_argument("--users", type=int, default=10, help="number of concurrent scripted users")
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="weighted route mix, e.g. 'message=40,chat=20'")
+    ap.add_argument("--anon-fraction", type=float, default=0.25, help="share of users using anon_* ids")
+    ap.add_argument("--threads-per-user", type=int, default=3)
+    ap.add_argument("--think-ms", type=float, default=0.0, help="mean think time between requests")
+    ap.add_argument("--ramp-ms", type=float, default=0.0, help="delay between starting users")
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--label", default="", help="free-form label stored in the results (release, worker count)")
+    ap.add_argument("--server-pid", default="", help="comma-separated server pid(s); reports CPU ms per turn")
+    ap.add_argument("--out", default="loadtest_results.json", help="machine-readable results file")
+    ap.add_argument("--compare", nargs=2, metavar=("A", "B"), help="compare two results files and exit")
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return 0
+    result = run(args)
+    print_report(result)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print("Wrote results to", args.out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,32 +1,60 @@
 #!/usr/bin/env python3
 """
-One-shot migration script to re-hash plaintext passwords in Backend/data/users.json.
+Re-hash plaintext passwords in Backend/data/users.json across a process pool.
 
 Usage:
-  python scripts/migrate_hash_passwords.py
+  python scripts/migrate_hash_passwords.py [--workers N] [--checkpoint-every 2000] [--report-deprecated]
 
-This will read the users file, detect passwords that are not bcrypt hashes (using passlib.identify),
-hash them and overwrite the users.json file. It prints a summary of changes.
+Passwords that are not recognised hashes (passlib.identify) are hashed in
+worker processes. Every --checkpoint-every hashes the results are merged into
+users.json and written atomically (temp file + fsync + rename), so a crash
+loses at most one batch and re-running the script resumes where it stopped:
+already-hashed users are skipped. The file is re-read before each merge and
+a user is only updated if their stored password is still the plaintext that
+was hashed.
+
+Run it with the server stopped. users.json has no lock shared with the
+server, so a server write (signup, token change) that lands between a
+merge's read and its rename would be lost.
+
+Existing hashes that `needs_update` flags (deprecated schemes or rounds)
+cannot be re-hashed offline because the plaintext is not available; with
+--report-deprecated they are counted by scheme. Login upgrades them
+transparently the next time each user signs in.
 """
-import json
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
+
 from passlib.context import CryptContext
 
-BASE = Path(__file__).resolve().parent.parent
-DATA = BASE / "data" / "users.json"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import serialization
+from storage import USERS_FILE
 
 pwd = CryptContext(schemes=["pbkdf2_sha256", "bcrypt"], deprecated="auto")
 
+
 def load():
-    if not DATA.exists():
-        print("no users.json found at", DATA)
+    if not USERS_FILE.exists():
+        print("no users.json found at", USERS_FILE)
         return {}
-    with DATA.open("r", encoding="utf-8") as f:
-        return json.load(f)
+    return serialization.load_file(USERS_FILE)
+
 
 def save(d):
-    with DATA.open("w", encoding="utf-8") as f:
-        json.dump(d, f, ensure_ascii=False, indent=2)
+    """Atomically replace users.json."""
+    tmp = USERS_FILE.with_name(f".{USERS_FILE.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(serialization.dumps(d))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, USERS_FILE)
+
 
 def is_hashed(val):
     try:
@@ -34,31 +62,115 @@ def is_hashed(val):
     except Exception:
         return False
 
-def main():
+
+def _prepare(uid, pw):
+    # bcrypt has a 72-byte input limit; truncate if necessary to avoid errors.
+    raw = str(pw)
+    if len(raw.encode('utf-8')) > 72:
+        print(f"Warning: password for {uid} exceeds 72 bytes; truncating before hashing")
+        raw = raw.encode('utf-8')[:72].decode('utf-8', errors='ignore')
+    return raw
+
+
+def hash_batch(batch):
+    """Worker: [(uid, plaintext), ...] -> [(uid, hash), ...]."""
+    return [(uid, pwd.hash(raw)) for uid, raw in batch]
+
+
+def merge(results, plaintext):
+    """Apply hashed passwords to a fresh copy of users.json and write it atomically.
+
+    Not safe against concurrent server writes; see the module docstring.
+    """
     users = load()
-    changed = 0
-    for uid, u in list(users.items()):
-        pw = u.get("password")
-        if not pw:
+    applied = 0
+    for uid, new in results:
+        u = users.get(uid)
+        # skip users whose password changed (or who were deleted) while we were hashing
+        if not isinstance(u, dict) or u.get("password") != plaintext[uid]:
             continue
-        if is_hashed(pw):
-            continue
-        # treat as plaintext — hash and save.
-        # bcrypt has a 72-byte input limit; truncate if necessary to avoid errors.
-        raw = str(pw)
-        if len(raw.encode('utf-8')) > 72:
-            print(f"Warning: password for {uid} exceeds 72 bytes; truncating before hashing")
-            raw = raw.encode('utf-8')[:72].decode('utf-8', errors='ignore')
-        new = pwd.hash(raw)
         u["password"] = new
-        users[uid] = u
-        changed += 1
-        print(f"Re-hashed password for {uid}")
-    if changed:
+        applied += 1
+    if applied:
         save(users)
-        print(f"Updated {changed} users in {DATA}")
+    return applied
+
+
+def report_deprecated(users):
+    by_scheme = {}
+    for u in users.values():
+        pw = u.get("password") if isinstance(u, dict) else None
+        if not pw or not is_hashed(pw):
+            continue
+        try:
+            if pwd.needs_update(pw):
+                scheme = pwd.identify(pw)
+                by_scheme[scheme] = by_scheme.get(scheme, 0) + 1
+        except Exception:
+            continue
+    total = sum(by_scheme.values())
+    print(f"Deprecated hashes: {total}" + (f" ({', '.join(f'{k}: {v}' for k, v in sorted(by_scheme.items()))})" if total else ""))
+    if total:
+        print("These cannot be re-hashed without the plaintext; they are upgraded automatically at each user's next login.")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Hash plaintext passwords in users.json")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--batch-size", type=int, default=50, help="passwords per worker task")
+    ap.add_argument("--checkpoint-every", type=int, default=2000, help="hashes between atomic writes of users.json")
+    ap.add_argument("--report-deprecated", action="store_true")
+    args = ap.parse_args(argv)
+
+    users = load()
+    plaintext = {}
+    for uid in sorted(users):
+        u = users[uid]
+        pw = u.get("password") if isinstance(u, dict) else None
+        if pw and not is_hashed(pw):
+            plaintext[uid] = pw
+    print(f"{len(users)} users, {len(plaintext)} plaintext passwords to hash with {args.workers} workers")
+
+    changed = 0
+    if plaintext:
+        todo = [(uid, _prepare(uid, pw)) for uid, pw in plaintext.items()]
+        batches = [todo[i:i + args.batch_size] for i in range(0, len(todo), args.batch_size)]
+        pending_results = []
+        done_count = 0
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = set()
+            it = iter(batches)
+            for batch in it:
+                futures.add(pool.submit(hash_batch, batch))
+                if len(futures) >= 2 * args.workers:
+                    break
+            while futures:
+                finished, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    pending_results.extend(fut.result())
+                    nxt = next(it, None)
+                    if nxt is not None:
+                        futures.add(pool.submit(hash_batch, nxt))
+                if len(pending_results) >= args.checkpoint_every or not futures:
+                    done_count += len(pending_results)
+                    changed += merge(pending_results, plaintext)
+                    pending_results = []
+                    elapsed = time.perf_counter() - start
+                    rate = done_count / elapsed if elapsed > 0 else 0.0
+                    print(f"checkpoint: {done_count}/{len(todo)} hashed, {changed} written "
+                          f"({rate:.1f} hashes/s, {rate / args.workers:.1f} per core)")
+        elapsed = time.perf_counter() - start
+        rate = done_count / elapsed if elapsed > 0 else 0.0
+        print(f"Hashed {done_count} passwords in {elapsed:.1f}s: {rate:.1f} hashes/s total, "
+              f"{rate / args.workers:.1f} hashes/s per core ({args.workers} workers)")
+    if changed:
+        print(f"Updated {changed} users in {USERS_FILE}")
     else:
         print("No plaintext passwords found; no changes made.")
+    if args.report_deprecated:
+        report_deprecated(load())
+
 
 if __name__ == '__main__':
     main()
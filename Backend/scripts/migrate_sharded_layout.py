@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Move flat `data/<user>__<thread>.json` files into the sharded per-user layout
+(`data/<shard>/<user>/<thread>.json`).
+
+Usage:
+  python scripts/migrate_sharded_layout.py
+
+The server performs the same migration in the background on startup and
+reads flat files transparently until it finishes, so running this script is
+optional; it is safe to run while the server is up.
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import storage
+
+
+def main():
+    start = time.time()
+    moved = storage.migrate_flat_layout()
+    print(f"Moved {moved} files into {storage.DATA_DIR} in {time.time() - start:.2f}s")
+    if storage._has_legacy_files():
+        print("Some flat-layout files remain (unrecognised names); inspect them manually.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Rebuild the per-user full-text search indexes from the thread files in DATA_DIR.
+
+Usage:
+  python scripts/rebuild_search_index.py            # every user
+  python scripts/rebuild_search_index.py u123 u456  # specific users
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import search
+
+
+def main(argv=None):
+    users = sys.argv[1:] if argv is None else argv
+    start = time.time()
+    if users:
+        for uid in users:
+            idx = search.rebuild_index(uid)
+            print(f"Rebuilt index for {uid}: {len(idx.docs)} messages, {len(idx.postings)} terms")
+    else:
+        n = search.rebuild_all()
+        print(f"Rebuilt indexes for {n} users")
+    print(f"Done in {time.time() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+"""Per-user full-text search over thread messages (inverted index + BM25).
+
+Each user's index lives next to their threads in the sharded layout:
+
+    <shard>/<user>/_search.idx   snapshot: one entry per message with term frequencies
+    <shard>/<user>/_search.log   append-only ops since the snapshot (add / drop)
+    <shard>/<user>/_search.lock  flock taken by writers
+
+(see `oplog.py`). `index_message()` appends one line to the log, so
+indexing a new message is O(message) regardless of how much the user has
+written. Readers keep the index in memory per process and only replay log
+bytes they have not seen; once the log grows past SEARCH_LOG_COMPACT_LINES
+it is folded into a new snapshot. At most SEARCH_CACHE_USERS indexes are
+kept in memory (least recently used go first, and any is dropped after
+SEARCH_CACHE_TTL_SECONDS); an evicted one is reloaded from its snapshot.
+A user without a snapshot is rebuilt from
+their thread files on first use, and `rebuild_index()` can always
+regenerate it from DATA_DIR.
+"""
+import heapq
+import math
+import os
+import re
+import threading
+import time
+import typing as t
+
+import metrics
+import serialization
+import storage
+import tracing
+from cache import TTLCache
+from oplog import OpLog
+
+SEARCH_LOG_COMPACT_LINES = int(os.getenv("SEARCH_LOG_COMPACT_LINES") or "500")
+SEARCH_CACHE_USERS = int(os.getenv("SEARCH_CACHE_USERS") or "1000")
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS") or "3600")
+BM25_K1 = 1.2
+BM25_B = 0.75
+PREVIEW_CHARS = 200
+
+SEARCH_LATENCY = metrics.Histogram(
+    "search_query_duration_seconds",
+    "Search query latency (index refresh + scoring)",
+    (),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i if in into is it its me my of on or our "
+    "she so that the their them they this to was we were what when where which who will with you your".split()
+)
+
+
+def tokenize(text: str) -> t.List[str]:
+    out = []
+    for tok in _TOKEN_RE.findall(str(text or "").lower()):
+        tok = tok.strip("'")
+        if tok.endswith("'s"):
+            tok = tok[:-2]
+        if len(tok) < 2 or tok in _STOPWORDS:
+            continue
+        # light plural folding so "managers" finds "manager"
+        if len(tok) > 3 and tok.endswith("s") and not tok.endswith("ss"):
+            tok = tok[:-1]
+        out.append(tok)
+    return out
+
+
+def _term_freqs(text: str) -> t.Dict[str, int]:
+    tf: t.Dict[str, int] = {}
+    for tok in tokenize(text):
+        tf[tok] = tf.get(tok, 0) + 1
+    return tf
+
+
+class UserIndex:
+    """In-memory inverted index for one user.
+
+    A cached index is shared by request threads: log replay and snapshot
+    writes mutate it under `_lock`, and `search` reads it under the same lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (thread_id, message_idx) -> [length, role, ts, preview, term_freqs]
+        self.docs: t.Dict[t.Tuple[str, int], list] = {}
+        self.postings: t.Dict[str, t.Dict[t.Tuple[str, int], int]] = {}
+        self.total_len = 0
+        self.snapshot_sig: t.Optional[t.Tuple[int, int]] = None
+        self.log_offset = 0
+        self.log_lines = 0
+
+    def add(self, thread_id: str, idx: int, role: str, ts: t.Optional[str], text: str,
+            tf: t.Optional[t.Dict[str, int]] = None):
+        key = (thread_id, int(idx))
+        if key in self.docs:
+            self._remove(key)
+        tf = _term_freqs(text) if tf is None else tf
+        length = sum(tf.values())
+        self.docs[key] = [length, role, ts, str(text or "")[:PREVIEW_CHARS], tf]
+        self.total_len += length
+        for term, n in tf.items():
+            self.postings.setdefault(term, {})[key] = n
+
+    def _remove(self, key):
+        doc = self.docs.pop(key, None)
+        if not doc:
+            return
+        self.total_len -= doc[0]
+        for term in doc[4]:
+            plist = self.postings.get(term)
+            if plist is not None:
+                plist.pop(key, None)
+                if not plist:
+                    del self.postings[term]
+
+    def drop_thread(self, thread_id: str):
+        for key in [k for k in self.docs if k[0] == thread_id]:
+            self._remove(key)
+
+    def apply(self, op: dict):
+        if op.get("op") == "add":
+            self.add(op["t"], op["i"], op.get("r") or "", op.get("ts"), op.get("c") or "")
+        elif op.get("op") == "drop":
+            self.drop_thread(op["t"])
+
+    def search(self, query: str, limit: int = 20) -> t.List[dict]:
+        terms = set(tokenize(query))
+        with self._lock:
+            return self._search_locked(terms, limit)
+
+    def _search_locked(self, terms: t.Set[str], limit: int) -> t.List[dict]:
+        n_docs = len(self.docs)
+        if not terms or not n_docs:
+            return []
+        avgdl = (self.total_len / n_docs) or 1.0
+        scores: t.Dict[t.Tuple[str, int], float] = {}
+        for term in terms:
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            df = len(plist)
+            idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            for key, tf in plist.items():
+                dl = self.docs[key][0]
+                denom = tf + BM25_K1 * (1.0 - BM25_B + BM25_B * dl / avgdl)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (BM25_K1 + 1.0) / denom
+        top = heapq.nlargest(limit, scores.items(), key=lambda kv: kv[1])
+        results = []
+        for (thread_id, idx), score in top:
+            _, role, ts, preview, _ = self.docs[(thread_id, idx)]
+            results.append({
+                "thread_id": thread_id,
+                "message_index": idx,
+                "score": round(score, 4),
+                "role": role,
+                "ts": ts,
+                "snippet": preview,
+            })
+        return results
+
+    def to_snapshot(self) -> dict:
+        return {
+            "version": 1,
+            "docs": [[tid, idx, d[1], d[2], d[3], d[4]] for (tid, idx), d in self.docs.items()],
+        }
+
+    @classmethod
+    def from_snapshot(cls, data: dict) -> "UserIndex":
+        idx = cls()
+        for tid, i, role, ts, preview, tf in data.get("docs", []):
+            idx.add(tid, i, role, ts, preview, tf=tf)
+        return idx
+
+
+# --- persistence ---
+
+def _oplog(user_id: str) -> OpLog:
+    return OpLog(storage.user_dir(user_id), "_search")
+
+
+_cache = TTLCache(maxsize=SEARCH_CACHE_USERS, ttl=SEARCH_CACHE_TTL_SECONDS)
+
+
+def _build_from_stores(user_id: str) -> UserIndex:
+    idx = UserIndex()
+    for thread_id, path in storage.list_thread_files(user_id):
+        try:
+            msgs = storage.read_thread_file(path)
+        except Exception:
+            continue
+        for i, m in enumerate(msgs if isinstance(msgs, list) else []):
+            if isinstance(m, dict) and m.get("content"):
+                idx.add(thread_id, i, m.get("role") or "", m.get("ts"), m.get("content"))
+    return idx
+
+
+def _write_snapshot(log: OpLog, idx: UserIndex):
+    """Persist `idx` as the snapshot and truncate the log. Caller holds the log's lock."""
+    with idx._lock:
+        idx.snapshot_sig = log.write_snapshot(serialization.dumps(idx.to_snapshot()))
+        idx.log_offset = 0
+        idx.log_lines = 0
+
+
+def rebuild_index(user_id: str) -> UserIndex:
+    """Regenerate a user's index from their thread files in DATA_DIR."""
+    log = _oplog(user_id)
+    with log.locked():
+        idx = _build_from_stores(user_id)
+        _write_snapshot(log, idx)
+    _cache.set(user_id, idx)
+    return idx
+
+
+def _replay_log(log: OpLog, idx: UserIndex):
+    # read and apply under the index lock so two threads never replay the same bytes
+    with idx._lock:
+        ops, idx.log_offset = log.read_since(idx.log_offset)
+        for op in ops:
+            idx.apply(op)
+        idx.log_lines += len(ops)
+
+
+def _load(user_id: str) -> UserIndex:
+    """Return an up-to-date in-memory index, replaying only unseen log bytes."""
+    log = _oplog(user_id)
+    idx = _cache.get(user_id)
+    sig = log.snapshot_sig()
+    if sig is None:
+        return rebuild_index(user_id)
+    if idx is None or idx.snapshot_sig != sig:
+        try:
+            idx = UserIndex.from_snapshot(serialization.load_file(log.snapshot))
+        except Exception:
+            return rebuild_index(user_id)
+        idx.snapshot_sig = sig
+    _replay_log(log, idx)
+    _cache.set(user_id, idx)
+    return idx
+
+
+def _append_op(user_id: str, op: dict):
+    _append_ops(user_id, [op])
+
+
+def _append_ops(user_id: str, ops: t.List[dict]):
+    log = _oplog(user_id)
+    if log.snapshot_sig() is None:
+        # the first build reads the stores, which already contain this change
+        rebuild_index(user_id)
+        return
+    log.extend(ops)
+    idx = _load(user_id)
+    if idx.log_lines >= SEARCH_LOG_COMPACT_LINES:
+        with log.locked():
+            # skip if another worker already folded the log into a new snapshot
+            if log.snapshot_sig() == idx.snapshot_sig:
+                _replay_log(log, idx)
+                _write_snapshot(log, idx)
+
+
+def index_message(user_id: str, thread_id: str, idx: int, role: str, content: str, ts: t.Optional[str] = None):
+    with tracing.span("search.index_message"):
+        _append_op(user_id, {"op": "add", "t": thread_id, "i": int(idx), "r": role, "ts": ts, "c": content})
+
+
+def index_messages(user_id: str, thread_id: str, entries: t.Sequence[t.Tuple[int, dict]]):
+    """Index several messages of one thread, given as (position, message) pairs."""
+    with tracing.span("search.index_messages"):
+        _append_ops(user_id, [
+            {"op": "add", "t": thread_id, "i": int(i), "r": m.get("role"), "ts": m.get("ts"), "c": m.get("content")}
+            for i, m in entries
+        ])
+
+
+def forget_user(user_id: str):
+    """Drop a user's cached index after their directory was removed."""
+    _cache.pop(user_id)
+
+
+def drop_thread(user_id: str, thread_id: str):
+    with tracing.span("search.drop_thread"):
+        _append_op(user_id, {"op": "drop", "t": thread_id})
+
+
+def search(user_id: str, query: str, limit: int = 20) -> t.List[dict]:
+    start = time.perf_counter()
+    with tracing.span("search.query"):
+        results = _load(user_id).search(query, limit=limit)
+    SEARCH_LATENCY.observe(time.perf_counter() - start)
+    return results
+
+
+def rebuild_all() -> int:
+    """Rebuild every user's index found in DATA_DIR (hot and cold tiers). Returns users rebuilt."""
+    users = storage.list_user_ids()
+    for user_id in users:
+        rebuild_index(user_id)
+    return len(users)
@@ -0,0 +1,58 @@
+"""JSON serialization used for storage files and API responses.
+
+Files are written in a compact form (no indentation, no spaces after
+separators). When `orjson` is installed it is used for both encoding and
+decoding; otherwise the stdlib `json` module is used with the same output
+shape, so files written by either backend are readable by the other. Older
+pretty-printed (`indent=2`) files remain readable.
+"""
+import json
+import typing as t
+from pathlib import Path
+
+from fastapi.responses import JSONResponse
+
+try:
+    # optional accelerator; the server runs fine without it
+    import orjson as _orjson
+except Exception:
+    _orjson = None
+
+BACKEND = "orjson" if _orjson is not None else "json"
+
+
+def dumps(obj: t.Any) -> bytes:
+    """Serialize to compact UTF-8 JSON bytes."""
+    if _orjson is not None:
+        try:
+            return _orjson.dumps(obj, option=_orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # e.g. integers beyond 64 bits; fall through to stdlib
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: t.Union[bytes, str]) -> t.Any:
+    if _orjson is not None:
+        return _orjson.loads(data)
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode("utf-8")
+    return json.loads(data)
+
+
+def load_file(path: Path) -> t.Any:
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def dump_file(path: Path, obj: t.Any) -> None:
+    data = dumps(obj)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered through `dumps` (orjson when available)."""
+
+    def render(self, content: t.Any) -> bytes:
+        return dumps(content)
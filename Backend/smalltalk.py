@@ -0,0 +1,121 @@
+"""Local replies for greetings and small talk.
+
+"hi", "thanks" and "how are you" do not need the model. When
+SMALLTALK_FAST_PATH is on (the default), /chat and /ws/chat answer them from
+the templates below, in the assistant's warm second-person voice. These
+replies skip the gateway classifier, the upstream call and the token
+reservation, so `tokens_left` is not charged.
+
+A message only qualifies when all of it, once lowercased and stripped of
+punctuation and emoji, is a known small-talk phrase: an optional greeting
+("hi", "hey there", "good morning") followed by at most one thanks or
+check-in phrase ("thanks so much", "how are you"). Anything with more in
+it ("hey, I want to die", "thanks for nothing") goes to the gateway and the
+model as before, however short it is.
+
+Replies follow the user's tone: an excited message ("hey!!", an emoji) gets
+an upbeat reply, and "good morning" is answered in kind. The share of chat
+traffic answered locally is
+rate(chat_requests_total{path="local"}) / rate(chat_requests_total).
+"""
+import os
+import random
+import re
+import typing as t
+
+SMALLTALK_FAST_PATH = str(os.getenv("SMALLTALK_FAST_PATH", "true")).lower() in ("1", "true", "yes")
+
+GREETINGS = frozenset({
+    "hi", "hii", "hello", "hey", "heya", "hiya", "howdy", "yo", "greetings",
+    "hi there", "hello there", "hey there", "hey hey", "hello again", "hi again",
+    "morning", "good morning", "good afternoon", "evening", "good evening",
+})
+THANKS = frozenset({
+    "thanks", "thank you", "thx", "ty", "cheers", "appreciate it", "many thanks",
+    "thanks a lot", "thanks so much", "thank you so much", "thank you very much",
+    "thanks again", "thank you again", "thanks for that", "thank you for that",
+    "thanks for your help", "thank you for your help",
+})
+CHECKINS = frozenset({
+    "how are you", "how are you doing", "how are you today", "how are things",
+    "hows it going", "how is it going", "whats up", "what is up", "sup",
+    "how have you been", "hows your day", "how is your day",
+})
+
+_NON_WORD = re.compile(r"[^a-z\s]+")
+_TIME_OF_DAY = re.compile(r"\bgood (morning|afternoon|evening)\b")
+_EXCITED = re.compile(r"!|[\U0001F300-\U0001FAFF☀-➿]")
+
+TEMPLATES: t.Dict[str, t.Dict[str, t.Tuple[str, ...]]] = {
+    "greeting": {
+        "calm": (
+            "{hello} What's on your mind today?",
+            "{hello} You can share whatever you're working through, big or small.",
+            "{hello} Where would you like to start today?",
+        ),
+        "upbeat": (
+            "{hello} Great to see you! What would you like to talk through?",
+            "{hello} You sound in good spirits! What's on your mind?",
+        ),
+    },
+    "thanks": {
+        "calm": (
+            "You're welcome. Take what's useful and leave the rest.",
+            "Glad it helped. You can come back to it any time.",
+            "You're welcome. Is there anything else on your mind?",
+        ),
+        "upbeat": (
+            "You're very welcome! You're putting real work into this.",
+            "Happy to help! Keep going, you're doing well.",
+        ),
+    },
+    "checkin": {
+        "calm": (
+            "I'm here and ready to listen. How are you doing today?",
+            "All good on my side, thanks for asking. How are things with you?",
+        ),
+        "upbeat": (
+            "Doing great, thanks for asking! How are you feeling today?",
+            "All good here! What's been going on with you?",
+        ),
+    },
+}
+
+
+def _normalize(text: str) -> str:
+    # apostrophes are dropped so "how's" and "hows" match; other punctuation and emoji split words
+    txt = text.lower().replace("'", "").replace("\u2019", "")
+    return " ".join(_NON_WORD.sub(" ", txt).split())
+
+
+def classify(text: str) -> t.Optional[str]:
+    """The small-talk kind ("greeting", "thanks", "checkin") or None if the model should answer."""
+    txt = _normalize(text or "")
+    if not txt:
+        return None
+    if txt in GREETINGS:
+        return "greeting"
+    words = txt.split()
+    # an optional leading greeting ("hey, how are you?"), then the whole rest is one known phrase
+    for i in range(len(words)):
+        if i and " ".join(words[:i]) not in GREETINGS:
+            continue
+        rest = " ".join(words[i:])
+        if rest in THANKS:
+            return "thanks"
+        if rest in CHECKINS:
+            return "checkin"
+    return None
+
+
+def reply(text: str, rng: t.Optional[random.Random] = None) -> t.Optional[str]:
+    """A templated reply for small talk, or None when the message needs the model."""
+    if not SMALLTALK_FAST_PATH:
+        return None
+    kind = classify(text)
+    if kind is None:
+        return None
+    tone = "upbeat" if _EXCITED.search(text) else "calm"
+    m = _TIME_OF_DAY.search(text.lower())
+    hello = f"Good {m.group(1)}!" if m else ("Hi there!" if tone == "upbeat" else "Hello!")
+    return (rng or random).choice(TEMPLATES[kind][tone]).format(hello=hello)
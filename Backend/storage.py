@@ -0,0 +1,740 @@
+"""File-based storage for users, threads and saved summaries.
+
+Layout under DATA_DIR:
+
+    users.json
+    <shard>/<user>/<thread>.json            messages for one thread
+    <shard>/<user>/<thread>__summary.json   saved summary for one thread
+
+`<shard>` is the first two hex digits of sha1(<user>), which keeps every
+directory small and means listing one user's threads only touches that
+user's directory.
+
+Older deployments stored everything flat as `<user>__<thread>.json`. Those
+files are still read (and moved into the sharded layout on first access),
+and `migrate_flat_layout()` moves the rest in the background.
+
+Cold tier: files untouched for COLD_TIER_AFTER_DAYS are gzip-compressed into
+`DATA_DIR/_cold/` (same relative layout, `.json.gz`) by `compact_cold_files()`.
+Loading a cold thread or summary decompresses it and promotes it back to the
+hot tier, so callers never see the difference.
+
+Writes go through the write-ahead log in `DATA_DIR/_wal/` (see `wal.py`):
+a save returns once its record is fsynced (group-committed with concurrent
+writers) and the file has been replaced. WAL_ENABLED=false writes files
+directly with no durability guarantee, as before.
+
+Anonymous activity: every write for an `anon_*` user is noted in the
+append-only `DATA_DIR/_activity/` log (at most once per thread per
+ACTIVITY_RESOLUTION_SECONDS per process), so `retention.py` can expire
+anonymous data without listing DATA_DIR.
+
+Change feed: every thread/summary write or delete appends a
+{"seq", "t": thread, "e": event, "ts"} record to the user's
+`<shard>/<user>/_changes.log` under its flock, with `seq` increasing by one
+per record. Only the last CHANGES_MAX_RECORDS records are kept;
+`_changes.idx` holds the seq of the newest record trimmed away (the floor).
+`changefeed.py` serves the feed and wakes up waiting clients.
+"""
+import gzip
+import hashlib
+import os
+import shutil
+import threading
+import time
+import typing as t
+from pathlib import Path
+
+import metrics
+import serialization
+import tracing
+import wal
+from oplog import OpLog
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+DATA_DIR.mkdir(exist_ok=True)
+
+USERS_FILE = DATA_DIR / "users.json"
+
+SUMMARY_SUFFIX = "__summary.json"
+
+WAL_DIR_NAME = "_wal"
+WAL_ENABLED = str(os.getenv("WAL_ENABLED", "true")).lower() in ("1", "true", "yes")
+
+CHANGES_MAX_RECORDS = int(os.getenv("CHANGES_MAX_RECORDS") or "1000")
+
+ACTIVITY_DIR_NAME = "_activity"
+ACTIVITY_RESOLUTION_SECONDS = float(os.getenv("ACTIVITY_RESOLUTION_SECONDS") or "60")
+ANON_PREFIX = "anon_"
+
+COLD_DIR_NAME = "_cold"
+COLD_SUFFIX = ".gz"
+COLD_TIER_AFTER_DAYS = float(os.getenv("COLD_TIER_AFTER_DAYS") or "21")
+COLD_COMPACT_INTERVAL_SECONDS = float(os.getenv("COLD_COMPACT_INTERVAL_SECONDS") or "3600")
+
+COLD_FILES_COMPACTED = metrics.Counter("storage_cold_files_compacted_total", "Files moved to the compressed cold tier", ())
+COLD_BYTES_SAVED = metrics.Counter("storage_cold_bytes_saved_total", "Bytes saved by cold-tier compression", ())
+COLD_PROMOTIONS = metrics.Counter("storage_cold_promotions_total", "Cold files promoted back to the hot tier", ("kind",))
+COLD_READ_LATENCY = metrics.Histogram(
+    "storage_cold_read_duration_seconds",
+    "Latency of decompressing and promoting a cold file",
+    ("kind",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+
+
+def _safe(value: str) -> str:
+    return "".join(ch for ch in value if ch.isalnum() or ch in "-_")
+
+
+def _shard(safe_user: str) -> str:
+    return hashlib.sha1(safe_user.encode("utf-8")).hexdigest()[:2]
+
+
+def user_dir(user_id: str) -> Path:
+    safe_user = _safe(user_id)
+    return DATA_DIR / _shard(safe_user) / safe_user
+
+
+def _thread_path(user_id: str, thread_id: str) -> Path:
+    return user_dir(user_id) / f"{_safe(thread_id)}.json"
+
+
+def _summary_path(user_id: str, thread_id: str) -> Path:
+    return user_dir(user_id) / f"{_safe(thread_id)}{SUMMARY_SUFFIX}"
+
+
+# --- flat (legacy) layout compatibility ---
+
+def _legacy_thread_path(user_id: str, thread_id: str) -> Path:
+    return DATA_DIR / f"{_safe(user_id)}__{_safe(thread_id)}.json"
+
+
+def _legacy_summary_path(user_id: str, thread_id: str) -> Path:
+    return DATA_DIR / f"{_safe(user_id)}__{_safe(thread_id)}{SUMMARY_SUFFIX}"
+
+
+def _has_legacy_files() -> bool:
+    try:
+        return any(p.is_file() for p in DATA_DIR.glob("*__*.json"))
+    except Exception:
+        return False
+
+
+# Checked once at import; cleared when migrate_flat_layout() finishes so the
+# steady state never looks at the flat namespace again.
+_legacy_pending = _has_legacy_files()
+_migrate_lock = threading.Lock()
+
+
+def _adopt_legacy(new: Path, legacy: Path) -> None:
+    """Move a flat-layout file to its sharded location if needed."""
+    if not _legacy_pending:
+        return
+    try:
+        if not legacy.exists():
+            return
+        if new.exists():
+            # the sharded copy was written after the flat one; it wins
+            legacy.unlink()
+            return
+        new.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(legacy, new)
+    except FileNotFoundError:
+        # another worker migrated it first
+        pass
+
+
+def _legacy_target(name: str) -> t.Optional[Path]:
+    """Map a flat file name to its sharded path (None if not a thread/summary file)."""
+    if "__" not in name or not name.endswith(".json"):
+        return None
+    user, rest = name.split("__", 1)
+    if not user or not rest:
+        return None
+    if rest.endswith(SUMMARY_SUFFIX):
+        thread = rest[: -len(SUMMARY_SUFFIX)]
+        return _summary_path(user, thread) if thread else None
+    return _thread_path(user, rest[: -len(".json")])
+
+
+def migrate_flat_layout() -> int:
+    """Move all flat `<user>__<thread>.json` files into the sharded layout.
+
+    Safe to run while the server is handling requests and from several
+    workers at once. Returns the number of files moved by this call.
+    """
+    global _legacy_pending
+    if not _legacy_pending:
+        return 0
+    moved = 0
+    with _migrate_lock:
+        for p in list(DATA_DIR.glob("*__*.json")):
+            target = _legacy_target(p.name)
+            if target is None:
+                continue
+            try:
+                if target.exists():
+                    p.unlink()
+                    continue
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(p, target)
+                moved += 1
+            except FileNotFoundError:
+                continue
+        _legacy_pending = _has_legacy_files()
+    return moved
+
+
+def start_background_migration() -> t.Optional[threading.Thread]:
+    if not _legacy_pending:
+        return None
+    th = threading.Thread(target=migrate_flat_layout, name="storage-migrate", daemon=True)
+    th.start()
+    return th
+
+
+# --- cold tier ---
+
+def _cold_path(hot: Path) -> Path:
+    rel = hot.relative_to(DATA_DIR)
+    return DATA_DIR / COLD_DIR_NAME / rel.with_name(rel.name + COLD_SUFFIX)
+
+
+def _cold_user_dir(user_id: str) -> Path:
+    return DATA_DIR / COLD_DIR_NAME / user_dir(user_id).relative_to(DATA_DIR)
+
+
+def _promote(hot: Path, kind: str) -> None:
+    """If `hot` only exists in the cold tier, decompress it back into place."""
+    if hot.exists():
+        return
+    cold = _cold_path(hot)
+    if not cold.exists():
+        return
+    start = time.perf_counter()
+    try:
+        with tracing.span("storage.promote_cold"):
+            with gzip.open(cold, "rb") as f:
+                data = f.read()
+            hot.parent.mkdir(parents=True, exist_ok=True)
+            tmp = hot.with_name(f".{hot.name}.{os.getpid()}.promote")
+            tmp.write_bytes(data)
+            os.replace(tmp, hot)
+            try:
+                cold.unlink()
+            except FileNotFoundError:
+                pass
+        COLD_PROMOTIONS.inc(kind=kind)
+        COLD_READ_LATENCY.observe(time.perf_counter() - start, kind=kind)
+    except FileNotFoundError:
+        # promoted concurrently by another worker
+        pass
+
+
+def _drop_cold(hot: Path) -> None:
+    """Remove a stale cold copy after the hot file has been rewritten."""
+    try:
+        _cold_path(hot).unlink()
+    except FileNotFoundError:
+        pass
+
+
+def read_cold_file(cold: Path) -> t.Any:
+    with gzip.open(cold, "rb") as f:
+        return serialization.loads(f.read())
+
+
+def compact_cold_files(max_age_days: float = COLD_TIER_AFTER_DAYS, now: t.Optional[float] = None) -> dict:
+    """Compress thread/summary files not modified for `max_age_days` into the cold tier.
+
+    Returns a report with the number of files moved and bytes before/after.
+    """
+    now = time.time() if now is None else now
+    cutoff = now - max_age_days * 86400.0
+    report = {"files": 0, "bytes_before": 0, "bytes_after": 0, "seconds": 0.0}
+    start = time.perf_counter()
+    for hot in DATA_DIR.glob("??/*/*.json"):
+        try:
+            st = hot.stat()
+            if st.st_mtime > cutoff:
+                continue
+            cold = _cold_path(hot)
+            cold.parent.mkdir(parents=True, exist_ok=True)
+            data = hot.read_bytes()
+            tmp = cold.with_name(f".{cold.name}.{os.getpid()}.tmp")
+            with gzip.open(tmp, "wb", compresslevel=6) as f:
+                f.write(data)
+            # skip the file if it was written while we were compressing it
+            st2 = hot.stat()
+            if (st2.st_mtime_ns, st2.st_size) != (st.st_mtime_ns, st.st_size):
+                tmp.unlink()
+                continue
+            os.replace(tmp, cold)
+            # a write can still land before the hot file goes; it is removed only if unchanged
+            if not _delete_if_unchanged(hot, st):
+                _drop_cold(hot)  # the cold copy is already stale
+                continue
+            size_after = cold.stat().st_size
+        except FileNotFoundError:
+            continue
+        report["files"] += 1
+        report["bytes_before"] += st.st_size
+        report["bytes_after"] += size_after
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    if report["files"]:
+        COLD_FILES_COMPACTED.inc(report["files"])
+        COLD_BYTES_SAVED.inc(report["bytes_before"] - report["bytes_after"])
+    return report
+
+
+def _compaction_loop(interval: float, max_age_days: float):
+    import fcntl
+    lock_path = DATA_DIR / ".cold_compaction.lock"
+    while True:
+        time.sleep(interval)
+        try:
+            with open(lock_path, "a") as lf:
+                try:
+                    # one worker compacts at a time; the others skip this round
+                    fcntl.flock(lf, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+                report = compact_cold_files(max_age_days)
+                if report["files"]:
+                    print("[storage] cold-tier compaction:", report)
+        except Exception as e:
+            print("[storage] cold-tier compaction failed:", e)
+
+
+def start_compaction_worker(interval: float = COLD_COMPACT_INTERVAL_SECONDS,
+                            max_age_days: float = COLD_TIER_AFTER_DAYS) -> t.Optional[threading.Thread]:
+    if interval <= 0 or max_age_days <= 0:
+        return None
+    th = threading.Thread(target=_compaction_loop, args=(interval, max_age_days), name="storage-compact", daemon=True)
+    th.start()
+    return th
+
+
+# --- write path ---
+
+def _write_file(path: Path, obj: t.Any) -> None:
+    if WAL_ENABLED:
+        wal.get(DATA_DIR / WAL_DIR_NAME).write(path, serialization.dumps(obj))
+    else:
+        serialization.dump_file(path, obj)
+
+
+def start_wal() -> None:
+    """Open this process's log, replaying segments left by crashed processes."""
+    if WAL_ENABLED:
+        wal.get(DATA_DIR / WAL_DIR_NAME)
+
+
+def _delete_if_unchanged(path: Path, st: os.stat_result) -> bool:
+    """Remove `path` only if it still has `st`'s mtime and size; returns whether it was removed.
+
+    Through the log the check is ordered after every acknowledged write of the
+    path, and the delete is replayed after a crash (see wal.py).
+    """
+    if WAL_ENABLED:
+        return wal.get(DATA_DIR / WAL_DIR_NAME).delete_if_unchanged(path, st.st_mtime_ns, st.st_size)
+    try:
+        st2 = path.stat()
+        if (st2.st_mtime_ns, st2.st_size) != (st.st_mtime_ns, st.st_size):
+            return False
+        path.unlink()
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _delete_file(path: Path) -> int:
+    """Remove `path` if present; returns the bytes freed."""
+    try:
+        size = path.stat().st_size
+    except FileNotFoundError:
+        return 0
+    if WAL_ENABLED:
+        wal.get(DATA_DIR / WAL_DIR_NAME).delete(path)
+    else:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            return 0
+    return size
+
+
+# --- anonymous activity index ---
+
+_activity_seen: t.Dict[t.Tuple[str, str], float] = {}
+_activity_lock = threading.Lock()
+
+
+def activity_log() -> OpLog:
+    return OpLog(DATA_DIR / ACTIVITY_DIR_NAME, "anon")
+
+
+def record_activity(user_id: str, thread_id: str, now: t.Optional[float] = None) -> None:
+    """Note that an anonymous user's thread was written (no-op for other users)."""
+    if not user_id.startswith(ANON_PREFIX):
+        return
+    now = time.time() if now is None else now
+    key = (user_id, thread_id)
+    with _activity_lock:
+        last = _activity_seen.get(key)
+        if last is not None and now - last < ACTIVITY_RESOLUTION_SECONDS:
+            return
+        if len(_activity_seen) >= 10000:
+            _activity_seen.clear()
+        _activity_seen[key] = now
+    try:
+        activity_log().append({"u": user_id, "t": thread_id, "ts": now})
+    except Exception as e:
+        print("[storage] activity index append failed:", e)
+
+
+# --- change feed ---
+
+CHANGE_MESSAGES = "messages"
+CHANGE_SUMMARY = "summary"
+CHANGE_DELETED = "deleted"
+CHANGE_SUMMARY_DELETED = "summary_deleted"
+
+_change_listeners: t.List[t.Callable[[str, dict], None]] = []
+# log path -> (size, last seq, records) as of this process's last append
+_change_tail: t.Dict[Path, t.Tuple[int, int, int]] = {}
+_change_tail_lock = threading.Lock()
+
+
+def change_log(user_id: str) -> OpLog:
+    return OpLog(user_dir(user_id), "_changes")
+
+
+def on_change(fn: t.Callable[[str, dict], None]) -> None:
+    """Call `fn(user_id, record)` after each change this process records."""
+    _change_listeners.append(fn)
+
+
+def change_floor(log: OpLog) -> int:
+    try:
+        return int(serialization.load_file(log.snapshot).get("floor", 0))
+    except (FileNotFoundError, AttributeError, TypeError, ValueError):
+        return 0
+
+
+def read_changes(log: OpLog) -> t.Tuple[t.List[dict], int]:
+    """(records in seq order, floor) for one user's change log."""
+    ops, _ = log.read_since(0)
+    return [op for op in ops if isinstance(op, dict) and "seq" in op], change_floor(log)
+
+
+def _trim_changes(log: OpLog, records: t.List[dict]) -> None:
+    """Keep the newest half of CHANGES_MAX_RECORDS. Caller holds the lock."""
+    keep = records[-max(1, CHANGES_MAX_RECORDS // 2):]
+    floor = keep[0]["seq"] - 1
+    tmp = log.snapshot.with_name(f".{log.snapshot.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(serialization.dumps({"floor": floor}))
+    os.replace(tmp, log.snapshot)
+    tmp = log.log.with_name(f".{log.log.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(b"".join(serialization.dumps(r) + b"\n" for r in keep))
+    os.replace(tmp, log.log)
+
+
+def record_change(user_id: str, thread_id: str, event: str, now: t.Optional[float] = None) -> t.Optional[dict]:
+    """Append one record to the user's change feed; returns it (None if the append failed)."""
+    log = change_log(user_id)
+    rec = None
+    try:
+        with tracing.span("storage.record_change"), log.locked():
+            try:
+                size = log.log.stat().st_size
+            except FileNotFoundError:
+                size = 0
+            with _change_tail_lock:
+                cached = _change_tail.get(log.log)
+            if cached and cached[0] == size:
+                _, seq, count = cached
+            else:
+                # another process appended (or trimmed) since our last write
+                records, floor = read_changes(log)
+                seq, count = (records[-1]["seq"] if records else floor), len(records)
+            rec = {"seq": seq + 1, "t": thread_id, "e": event, "ts": time.time() if now is None else now}
+            line = serialization.dumps(rec) + b"\n"
+            with open(log.log, "ab") as f:
+                f.write(line)
+            size += len(line)
+            count += 1
+            if count > CHANGES_MAX_RECORDS:
+                records, _ = read_changes(log)
+                _trim_changes(log, records)
+                size, count = log.log.stat().st_size, min(count, max(1, CHANGES_MAX_RECORDS // 2))
+            with _change_tail_lock:
+                if len(_change_tail) >= 10000:
+                    _change_tail.clear()
+                _change_tail[log.log] = (size, rec["seq"], count)
+    except Exception as e:
+        print(f"[storage] change feed append failed for {user_id}: {e}")
+        return None
+    for fn in list(_change_listeners):
+        try:
+            fn(user_id, rec)
+        except Exception as e:
+            print("[storage] change listener failed:", e)
+    return rec
+
+
+# --- users ---
+
+def load_users() -> dict:
+    if not USERS_FILE.exists():
+        return {}
+    try:
+        with metrics.STORAGE_LATENCY.time(op="read", kind="users"), tracing.span("storage.load_users"):
+            return serialization.load_file(USERS_FILE)
+    except Exception:
+        return {}
+
+
+def save_users(users: dict):
+    with metrics.STORAGE_LATENCY.time(op="write", kind="users"), tracing.span("storage.save_users"):
+        _write_file(USERS_FILE, users)
+
+
+# --- summaries ---
+
+def load_saved_summary(user_id: str, thread_id: str) -> t.Optional[dict]:
+    p = _summary_path(user_id, thread_id)
+    _adopt_legacy(p, _legacy_summary_path(user_id, thread_id))
+    _promote(p, "summary")
+    if not p.exists():
+        return None
+    try:
+        with metrics.STORAGE_LATENCY.time(op="read", kind="summary"), tracing.span("storage.load_saved_summary"):
+            return serialization.load_file(p)
+    except Exception:
+        return None
+
+
+def save_summary(user_id: str, thread_id: str, summary: dict):
+    p = _summary_path(user_id, thread_id)
+    _adopt_legacy(p, _legacy_summary_path(user_id, thread_id))
+    with metrics.STORAGE_LATENCY.time(op="write", kind="summary"), tracing.span("storage.save_summary"):
+        p.parent.mkdir(parents=True, exist_ok=True)
+        _write_file(p, summary)
+    _drop_cold(p)
+    record_activity(user_id, thread_id)
+    record_change(user_id, thread_id, CHANGE_SUMMARY)
+
+
+# --- messages ---
+
+def load_messages(user_id: str, thread_id: str) -> t.List[dict]:
+    p = _thread_path(user_id, thread_id)
+    _adopt_legacy(p, _legacy_thread_path(user_id, thread_id))
+    _promote(p, "messages")
+    if not p.exists():
+        return []
+    try:
+        with metrics.STORAGE_LATENCY.time(op="read", kind="messages"), tracing.span("storage.load_messages"):
+            return serialization.load_file(p)
+    except Exception:
+        return []
+
+
+def save_messages(user_id: str, thread_id: str, messages: t.List[dict]):
+    p = _thread_path(user_id, thread_id)
+    _adopt_legacy(p, _legacy_thread_path(user_id, thread_id))
+    with metrics.STORAGE_LATENCY.time(op="write", kind="messages"), tracing.span("storage.save_messages"):
+        p.parent.mkdir(parents=True, exist_ok=True)
+        _write_file(p, messages)
+    _drop_cold(p)
+    record_activity(user_id, thread_id)
+    record_change(user_id, thread_id, CHANGE_MESSAGES)
+
+
+def _unlink(path: Path) -> int:
+    """Remove a file outside the WAL (cold and flat-layout copies); returns the bytes freed."""
+    try:
+        size = path.stat().st_size
+        path.unlink()
+        return size
+    except FileNotFoundError:
+        return 0
+
+
+def delete_thread(user_id: str, thread_id: str, track: bool = True) -> int:
+    """Remove a thread's messages from every tier; returns the bytes freed.
+
+    With `track` the deletion counts as activity, so the sweeper later removes
+    whatever is left of an anonymous thread (its summary).
+    """
+    p = _thread_path(user_id, thread_id)
+    with metrics.STORAGE_LATENCY.time(op="delete", kind="messages"), tracing.span("storage.delete_thread"):
+        freed = _delete_file(p) + _unlink(_cold_path(p)) + _unlink(_legacy_thread_path(user_id, thread_id))
+    if track:
+        record_activity(user_id, thread_id)
+    if freed:
+        record_change(user_id, thread_id, CHANGE_DELETED)
+    return freed
+
+
+def delete_summary(user_id: str, thread_id: str) -> int:
+    p = _summary_path(user_id, thread_id)
+    with metrics.STORAGE_LATENCY.time(op="delete", kind="summary"), tracing.span("storage.delete_summary"):
+        freed = _delete_file(p) + _unlink(_cold_path(p)) + _unlink(_legacy_summary_path(user_id, thread_id))
+    if freed:
+        record_change(user_id, thread_id, CHANGE_SUMMARY_DELETED)
+    return freed
+
+
+def remove_user_dir(user_id: str) -> int:
+    """Remove a user's directories (derived indexes included) once no thread or
+    summary files are left in them; returns the bytes freed, 0 if anything remains.
+
+    Thread and summary files are never removed here (they go through the
+    write-ahead log), so one written after the check keeps the directory.
+    """
+    dirs = [d for d in (user_dir(user_id), _cold_user_dir(user_id)) if d.is_dir()]
+    for d in dirs:
+        for entry in os.scandir(d):
+            if _is_data_file(entry.name):
+                return 0
+    freed = 0
+    for d in dirs:
+        for entry in os.scandir(d):
+            # data files written since the check, and in-flight temp files, stay
+            if _is_data_file(entry.name):
+                continue
+            try:
+                st = entry.stat()
+                if entry.name.startswith(".") and time.time() - st.st_mtime < 60:
+                    continue
+                size = st.st_size
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.unlink(entry.path)
+                freed += size
+            except FileNotFoundError:
+                pass
+        try:
+            os.rmdir(d)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return 0  # something was written meanwhile
+    return freed
+
+
+def _is_data_file(name: str) -> bool:
+    name = name[: -len(COLD_SUFFIX)] if name.endswith(COLD_SUFFIX) else name
+    return name.endswith(".json") and not name.startswith(".")
+
+
+# --- version tags ---
+# Cheap validators for conditional GETs, computed from stat() only; nothing is
+# read or hashed. Writes replace files (new inode and mtime), so any change
+# produces a new tag.
+
+def _stat_tag(st: os.stat_result) -> str:
+    return f"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def _file_version(hot: Path, legacy: Path) -> t.Optional[t.Tuple[str, float]]:
+    for p in (hot, _cold_path(hot), legacy):
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            continue
+        return _stat_tag(st), st.st_mtime
+    return None
+
+
+def thread_version(user_id: str, thread_id: str) -> t.Optional[t.Tuple[str, float]]:
+    """(tag, mtime) of a thread file in whichever tier holds it, or None if it does not exist."""
+    return _file_version(_thread_path(user_id, thread_id), _legacy_thread_path(user_id, thread_id))
+
+
+def summary_version(user_id: str, thread_id: str) -> t.Optional[t.Tuple[str, float]]:
+    return _file_version(_summary_path(user_id, thread_id), _legacy_summary_path(user_id, thread_id))
+
+
+def threads_version(user_id: str) -> t.Optional[t.Tuple[str, float]]:
+    """(tag, newest mtime) over all of a user's thread files. None while the user still has flat files.
+
+    The date also covers the directories themselves: unlinking a thread moves
+    the directory's mtime but no remaining file's, and If-Modified-Since
+    clients would otherwise keep getting 304 with the deleted thread listed.
+    None as well once the user has no directory left at all.
+    """
+    if _legacy_pending and any(DATA_DIR.glob(f"{_safe(user_id)}__*.json")):
+        return None
+    h = hashlib.blake2b(digest_size=8)
+    newest = 0.0
+    found = False
+    for directory in (_cold_user_dir(user_id), user_dir(user_id)):
+        try:
+            newest = max(newest, os.stat(directory).st_mtime)
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except FileNotFoundError:
+            continue
+        found = True
+        for entry in entries:
+            name = entry.name[: -len(COLD_SUFFIX)] if entry.name.endswith(COLD_SUFFIX) else entry.name
+            if not name.endswith(".json") or name.endswith(SUMMARY_SUFFIX) or name.startswith("."):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            h.update(f"{entry.name}:{_stat_tag(st)};".encode("utf-8"))
+            newest = max(newest, st.st_mtime)
+    if not found:
+        return None
+    return h.hexdigest(), newest
+
+
+def list_user_ids() -> t.List[str]:
+    """Every user with a directory in the hot or cold tier (full scan; for maintenance jobs)."""
+    users = set()
+    for base in (DATA_DIR, DATA_DIR / COLD_DIR_NAME):
+        for d in base.glob("??/*"):
+            if d.is_dir():
+                users.add(d.name)
+    return sorted(users)
+
+
+def read_thread_file(path: Path) -> t.Any:
+    """Read a path returned by `list_thread_files` (hot or cold) without promoting it."""
+    if path.name.endswith(COLD_SUFFIX):
+        return read_cold_file(path)
+    return serialization.load_file(path)
+
+
+def list_thread_files(user_id: str) -> t.List[t.Tuple[str, Path]]:
+    """Return (thread_id, path) for every thread file of one user.
+
+    Only the user's own directory (and its cold-tier mirror) is listed. While
+    a flat-layout migration is still pending, that user's flat files are
+    adopted first.
+    """
+    if _legacy_pending:
+        for p in list(DATA_DIR.glob(f"{_safe(user_id)}__*.json")):
+            target = _legacy_target(p.name)
+            if target is not None:
+                _adopt_legacy(target, p)
+    out: t.Dict[str, Path] = {}
+    # cold entries first so a hot file wins over a stale cold copy
+    for directory, suffix in ((_cold_user_dir(user_id), COLD_SUFFIX), (user_dir(user_id), "")):
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    name = entry.name[: -len(suffix)] if suffix else entry.name
+                    if not entry.name.endswith(suffix) or not name.endswith(".json") or name.endswith(SUMMARY_SUFFIX):
+                        continue
+                    out[name[: -len(".json")]] = Path(entry.path)
+        except FileNotFoundError:
+            continue
+    return list(out.items())
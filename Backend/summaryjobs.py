@@ -0,0 +1,232 @@
+"""Background summary precomputation.
+
+Summaries used to be generated only when the panel asked for them, so every
+open paid the full GET /summary/{user_id}/{thread_id} latency. With
+SUMMARY_PRECOMPUTE_CONCURRENCY > 0, message writes queue a refresh and a
+background worker stores the result with `storage.save_summary`;
+GET /summary/saved/{user_id}/{thread_id} then returns it straight away.
+
+The job file lives in `DATA_DIR/_summary_jobs/`. It is a snapshot of
+{user: {thread: {"n": messages, "b": messages summarized, "ts": last write}}}
+plus an append-only log, flock-protected (see `oplog.py`). Writers append one
+op per write and never read the file. There is one entry per thread, so
+repeated writes never queue a second job. A thread is due once it has
+SUMMARY_PRECOMPUTE_AFTER_MESSAGES messages more than its last summary, or
+after SUMMARY_PRECOMPUTE_IDLE_MINUTES without writes.
+
+One worker process holds `.summary_jobs.lock` and runs the queue. At most
+SUMMARY_PRECOMPUTE_CONCURRENCY jobs run at once, and their upstream calls
+queue behind interactive traffic (`admission.PRIORITY_BACKGROUND`). If that
+process exits, another worker takes over from the job file. A failed job is
+retried with backoff and nothing is saved for it. The job itself
+(`main._precompute_summary`) is registered through `start`.
+"""
+import fcntl
+import os
+import threading
+import time
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import serialization
+import storage
+from oplog import OpLog
+
+SUMMARY_PRECOMPUTE_CONCURRENCY = int(os.getenv("SUMMARY_PRECOMPUTE_CONCURRENCY") or "0")
+SUMMARY_PRECOMPUTE_AFTER_MESSAGES = int(os.getenv("SUMMARY_PRECOMPUTE_AFTER_MESSAGES") or "6")
+SUMMARY_PRECOMPUTE_IDLE_MINUTES = float(os.getenv("SUMMARY_PRECOMPUTE_IDLE_MINUTES") or "10")
+SUMMARY_PRECOMPUTE_POLL_SECONDS = float(os.getenv("SUMMARY_PRECOMPUTE_POLL_SECONDS") or "5")
+
+JOBS_DIR_NAME = "_summary_jobs"
+COMPACT_LOG_BYTES = 1 << 20
+MAX_BACKOFF_SECONDS = 3600.0
+
+SUMMARY_JOBS = metrics.Counter("summary_precompute_jobs_total", "Background summary jobs by outcome", ("outcome",))
+SUMMARY_JOB_DURATION = metrics.Histogram(
+    "summary_precompute_duration_seconds", "Time to compute and save one background summary", ("outcome",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+SUMMARY_JOBS_PENDING = metrics.Gauge("summary_precompute_pending", "Threads with messages newer than their saved summary", ())
+SUMMARY_JOBS_RUNNING = metrics.Gauge("summary_precompute_running", "Background summary jobs in progress", ())
+
+# run(user_id, thread_id) -> number of messages the saved summary covers
+Runner = t.Callable[[str, str], int]
+Jobs = t.Dict[str, t.Dict[str, dict]]
+
+
+def enabled() -> bool:
+    return SUMMARY_PRECOMPUTE_CONCURRENCY > 0
+
+
+def job_log() -> OpLog:
+    return OpLog(storage.DATA_DIR / JOBS_DIR_NAME, "jobs")
+
+
+def note_messages(user_id: str, thread_id: str, count: int, now: t.Optional[float] = None) -> None:
+    """Record that a thread now has `count` messages (no-op when precompute is off)."""
+    if not enabled():
+        return
+    try:
+        job_log().append({"op": "w", "u": user_id, "t": thread_id, "n": int(count),
+                          "ts": time.time() if now is None else now})
+    except Exception as e:
+        print("[summaryjobs] job file append failed:", e)
+
+
+def _apply(state: Jobs, ops: t.Iterable[dict]) -> None:
+    for op in ops:
+        try:
+            kind, user, thread, n = op["op"], op["u"], op["t"], int(op["n"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        threads = state.setdefault(user, {})
+        job = threads.setdefault(thread, {"n": 0, "b": None, "ts": 0.0})
+        if kind == "w":
+            job["n"] = n
+            job["ts"] = max(job["ts"], float(op.get("ts") or 0.0))
+        elif kind == "d":
+            job["b"] = n if job["b"] is None else max(job["b"], n)
+            if job["n"] <= job["b"]:
+                # summary is current; the next write recreates the entry
+                del threads[thread]
+                if not threads:
+                    del state[user]
+
+
+def _saved_count(user_id: str, thread_id: str) -> int:
+    try:
+        return int((storage.load_saved_summary(user_id, thread_id) or {}).get("message_count") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class JobQueue:
+    """The leader's view of the job file, with the jobs it is running."""
+
+    def __init__(self, run: Runner, concurrency: int = SUMMARY_PRECOMPUTE_CONCURRENCY,
+                 after_messages: int = SUMMARY_PRECOMPUTE_AFTER_MESSAGES,
+                 idle_minutes: float = SUMMARY_PRECOMPUTE_IDLE_MINUTES):
+        self.run = run
+        self.concurrency = max(1, concurrency)
+        self.after_messages = after_messages
+        self.idle_seconds = idle_minutes * 60.0
+        self.log = job_log()
+        self.state: Jobs = {}
+        self.offset = 0
+        self._lock = threading.Lock()
+        self._running: t.Dict[t.Tuple[str, str], int] = {}
+        self._failures: t.Dict[t.Tuple[str, str], t.Tuple[int, float]] = {}
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="summary-job")
+        with self.log.locked():
+            try:
+                self.state = serialization.load_file(self.log.snapshot)
+            except FileNotFoundError:
+                pass
+            ops, self.offset = self.log.read_since(0)
+        _apply(self.state, ops)
+
+    def refresh(self) -> None:
+        ops, self.offset = self.log.read_since(self.offset)
+        with self._lock:
+            _apply(self.state, ops)
+        if self.offset >= COMPACT_LOG_BYTES:
+            self.compact()
+
+    def compact(self) -> None:
+        with self.log.locked():
+            ops, _ = self.log.read_since(self.offset)
+            with self._lock:
+                _apply(self.state, ops)
+                self.log.write_snapshot(serialization.dumps(self.state))
+            self.offset = 0
+
+    def due(self, now: float) -> t.List[t.Tuple[str, str, int]]:
+        """(user, thread, messages) for every thread whose summary should be refreshed now."""
+        out = []
+        pending = 0
+        with self._lock:
+            for user_id, threads in self.state.items():
+                for thread_id, job in threads.items():
+                    if job["b"] is None:
+                        job["b"] = _saved_count(user_id, thread_id)
+                    if job["n"] <= job["b"]:
+                        continue
+                    pending += 1
+                    key = (user_id, thread_id)
+                    if key in self._running or self._failures.get(key, (0, 0.0))[1] > now:
+                        continue
+                    if job["n"] - job["b"] >= self.after_messages or now - job["ts"] >= self.idle_seconds:
+                        out.append((user_id, thread_id, job["n"]))
+        SUMMARY_JOBS_PENDING.set(pending)
+        return out
+
+    def tick(self, now: t.Optional[float] = None) -> int:
+        """Start due jobs up to the concurrency bound; returns how many were started."""
+        now = time.time() if now is None else now
+        self.refresh()
+        started = 0
+        for user_id, thread_id, n in self.due(now):
+            with self._lock:
+                if len(self._running) >= self.concurrency:
+                    break
+                self._running[(user_id, thread_id)] = n
+                SUMMARY_JOBS_RUNNING.set(len(self._running))
+            self._pool.submit(self._run_job, user_id, thread_id)
+            started += 1
+        return started
+
+    def _run_job(self, user_id: str, thread_id: str) -> None:
+        key = (user_id, thread_id)
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            covered = self.run(user_id, thread_id)
+            self.log.append({"op": "d", "u": user_id, "t": thread_id, "n": int(covered)})
+            self._failures.pop(key, None)
+        except Exception as e:
+            outcome = "error"
+            failures = self._failures.get(key, (0, 0.0))[0] + 1
+            backoff = min(MAX_BACKOFF_SECONDS, SUMMARY_PRECOMPUTE_POLL_SECONDS * (2 ** failures))
+            self._failures[key] = (failures, time.time() + backoff)
+            print(f"[summaryjobs] summary for {user_id}/{thread_id} failed (retry in {backoff:.0f}s): {e}")
+        finally:
+            with self._lock:
+                self._running.pop(key, None)
+                SUMMARY_JOBS_RUNNING.set(len(self._running))
+            SUMMARY_JOBS.inc(outcome=outcome)
+            SUMMARY_JOB_DURATION.observe(time.perf_counter() - start, outcome=outcome)
+
+    def drain(self, timeout: float = 30.0) -> None:
+        """Wait for running jobs to finish (tests and shutdown)."""
+        deadline = time.monotonic() + timeout
+        while self._running and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+def _leader_loop(run: Runner, poll: float):
+    lock_path = storage.DATA_DIR / ".summary_jobs.lock"
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    lf = open(lock_path, "a")
+    while True:
+        try:
+            # one worker runs the queue; the others only append to the job file
+            fcntl.flock(lf, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except OSError:
+            time.sleep(poll)
+    jobs = JobQueue(run)
+    while True:
+        try:
+            jobs.tick()
+        except Exception as e:
+            print("[summaryjobs] queue tick failed:", e)
+        time.sleep(poll)
+
+
+def start(run: Runner, poll: float = SUMMARY_PRECOMPUTE_POLL_SECONDS) -> t.Optional[threading.Thread]:
+    if not enabled():
+        return None
+    th = threading.Thread(target=_leader_loop, args=(run, poll), name="summary-jobs", daemon=True)
+    th.start()
+    return th
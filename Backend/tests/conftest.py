@@ -0,0 +1,18 @@
+import pytest
+
+import storage
+
+
+@pytest.fixture
+def data_dir(monkeypatch, tmp_path):
+    """Point storage at an empty `tmp_path` and reset its module-level caches.
+
+    Tests that need something else (legacy files pending, WAL on) override it
+    with monkeypatch after requesting this fixture.
+    """
+    monkeypatch.setattr(storage, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(storage, "USERS_FILE", tmp_path / "users.json")
+    monkeypatch.setattr(storage, "_legacy_pending", False)
+    monkeypatch.setattr(storage, "_activity_seen", {})
+    monkeypatch.setattr(storage, "_change_tail", {})
+    return tmp_path
@@ -0,0 +1,138 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+import admission
+import gateway
+import main
+from main import app
+
+
+client = TestClient(app)
+
+
+def _wait_for_queue(ctl, n):
+    for _ in range(200):
+        if ctl.queued() == n:
+            return
+        time.sleep(0.005)
+    raise AssertionError(f"queue never reached {n}")
+
+
+def test_authenticated_callers_are_admitted_before_anonymous():
+    ctl = admission.AdmissionController(max_concurrency=1, per_user=4, max_queue=10, timeout=5)
+    held = ctl.acquire(admission.Caller("user:a", admission.PRIORITY_AUTHENTICATED))
+    order = []
+
+    def take(caller):
+        slot = ctl.acquire(caller)
+        order.append(caller.key)
+        slot.release()
+
+    anon = threading.Thread(target=take, args=(admission.Caller("ip:1", admission.PRIORITY_ANONYMOUS),))
+    anon.start()
+    _wait_for_queue(ctl, 1)
+    auth = threading.Thread(target=take, args=(admission.Caller("user:b", admission.PRIORITY_AUTHENTICATED),))
+    auth.start()
+    _wait_for_queue(ctl, 2)
+    held.release()
+    anon.join()
+    auth.join()
+    assert order == ["user:b", "ip:1"]
+    assert ctl.in_flight() == 0
+
+
+def test_per_user_cap_does_not_block_other_users():
+    ctl = admission.AdmissionController(max_concurrency=4, per_user=1, max_queue=10, timeout=0.05)
+    ctl.acquire(admission.Caller("user:tabs"))
+    with pytest.raises(admission.Rejected) as exc:
+        ctl.acquire(admission.Caller("user:tabs"))
+    assert exc.value.reason == "timeout"
+    ctl.acquire(admission.Caller("user:other")).release()
+
+    full = admission.AdmissionController(max_concurrency=1, per_user=1, max_queue=0, timeout=5)
+    full.acquire(admission.Caller("a"))
+    with pytest.raises(admission.Rejected) as exc:
+        full.acquire(admission.Caller("b"))
+    assert exc.value.reason == "queue_full"
+
+
+def test_streams_hold_their_slot_until_closed():
+    ctl = admission.AdmissionController(max_concurrency=1, per_user=1, max_queue=0, timeout=0)
+    stream = admission.HeldStream(iter([1, 2]), ctl.acquire(admission.Caller("a")))
+    assert next(stream) == 1
+    assert ctl.in_flight() == 1
+    assert list(stream) == [2]
+    assert ctl.in_flight() == 0
+
+
+def test_chat_returns_503_when_upstream_is_saturated(monkeypatch):
+    busy = admission.AdmissionController(max_concurrency=0, per_user=1, max_queue=0, timeout=0)
+    monkeypatch.setattr(admission, "controller", busy)
+    monkeypatch.setattr(main.client.chat.completions, "create", lambda **kw: pytest.fail("upstream called"))
+    r = client.post("/chat", json={"message": "I feel stuck in my career and anxious about it"})
+    assert r.status_code == 503
+    assert "retry-after" in r.headers
+
+
+def _saturate(monkeypatch):
+    busy = admission.AdmissionController(max_concurrency=0, per_user=1, max_queue=0, timeout=0)
+    monkeypatch.setattr(admission, "controller", busy)
+    monkeypatch.setattr(main.client.chat.completions, "create", lambda **kw: pytest.fail("upstream called"))
+
+
+def _new_user():
+    email = f"busy{time.time_ns()}@example.com"
+    uid = client.post("/users/create", json={"name": "Busy", "email": email, "password": "pw"}).json()["user"]["user_id"]
+    return uid, {"Authorization": f"Bearer {main.create_token_for_user(uid)}"}
+
+
+def test_streamed_calls_return_503_and_refund_when_saturated(monkeypatch):
+    monkeypatch.setattr(gateway, "decide", lambda text, threshold=0.5: gateway.Decision(True, "personal", 0.9, "test", False, "test"))
+    uid, headers = _new_user()
+    client.post("/message", json={"user_id": uid, "thread_id": "t1", "role": "user", "content": "should I move abroad?"}, headers=headers)
+    before = main.load_users()[uid]["tokens_left"]
+    _saturate(monkeypatch)
+
+    r = client.post("/chat?stream=true", json={"message": f"I feel stuck in my career ({uid})"}, headers=headers)
+    assert r.status_code == 503 and "retry-after" in r.headers
+    assert main.load_users()[uid]["tokens_left"] == before
+
+    r = client.get(f"/summary/{uid}/t1?stream=true&tokens=true", headers=headers)
+    assert r.status_code == 503 and "retry-after" in r.headers
+    assert main.load_users()[uid]["tokens_left"] == before
+
+
+def test_an_abandoned_chat_stream_is_closed_at_once(monkeypatch):
+    monkeypatch.setattr(gateway, "decide", lambda text, threshold=0.5: gateway.Decision(True, "personal", 0.9, "test", False, "test"))
+    ctl = admission.AdmissionController(max_concurrency=1, per_user=1, max_queue=0, timeout=0)
+    closed = []
+
+    def upstream():
+        try:
+            while True:
+                yield SimpleNamespace(choices=[SimpleNamespace(delta={"content": "and "})])
+        finally:
+            closed.append(True)
+
+    opened = []
+
+    def create(endpoint, caller=None, **kw):
+        # kept referenced, like a live HTTP response: only an explicit close() frees it
+        opened.append(admission.HeldStream(upstream(), ctl.acquire(caller)))
+        return opened[-1]
+
+    monkeypatch.setattr(main, "create_chat_completion", create)
+    # hand back the SSE generator itself, as the server would iterate it
+    monkeypatch.setattr(main, "StreamingResponse", lambda content, media_type=None: content)
+    request = Request({"type": "http", "method": "POST", "path": "/chat", "query_string": b"stream=true",
+                       "headers": [], "client": ("10.0.0.9", 1234)})
+    events = main.chat(main.ChatRequest(message=f"I keep doubting my decisions ({time.time_ns()})"), request)
+    assert next(events).startswith("data: ")
+    assert ctl.in_flight() == 1
+    events.close()  # the client disconnected
+    assert closed == [True] and ctl.in_flight() == 0
@@ -0,0 +1,84 @@
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+import changefeed
+import main
+import storage
+from main import app
+
+
+client = TestClient(app)
+
+
+def _later(delay, fn, *args):
+    th = threading.Thread(target=lambda: (time.sleep(delay), fn(*args)))
+    th.start()
+    return th
+
+
+def test_writes_and_deletes_are_recorded_in_seq_order(data_dir):
+    uid = "anon_feed"
+    assert client.get(f"/changes/{uid}").json() == {"changes": [], "seq": 0, "reset": False}
+
+    storage.save_messages(uid, "t1", [{"role": "user", "content": "hi"}])
+    storage.save_summary(uid, "t1", {"summary": "s"})
+    storage.save_messages(uid, "t2", [{"role": "user", "content": "yo"}])
+    storage.delete_thread(uid, "t1")
+    storage.delete_thread(uid, "missing")  # nothing freed, nothing recorded
+
+    body = client.get(f"/changes/{uid}?since=0").json()
+    assert [(c["seq"], c["thread_id"], c["event"]) for c in body["changes"]] == [
+        (1, "t1", "messages"), (2, "t1", "summary"), (3, "t2", "messages"), (4, "t1", "deleted")]
+    assert body["seq"] == 4 and not body["reset"]
+
+    start = time.perf_counter()
+    assert client.get(f"/changes/{uid}?since=4&timeout=0.2").json()["changes"] == []
+    assert time.perf_counter() - start >= 0.2
+    # thread files only; the change log is not a thread
+    assert sorted(tid for tid, _ in storage.list_thread_files(uid)) == ["t2"]
+
+
+def test_long_poll_wakes_on_local_and_other_process_writes(monkeypatch, data_dir):
+    monkeypatch.setattr(changefeed, "CHANGES_WATCH_INTERVAL_SECONDS", 0.05)
+    uid = "anon_wake"
+    storage.save_messages(uid, "t1", [{"role": "user", "content": "hi"}])
+
+    th = _later(0.2, storage.save_messages, uid, "t1", [{"role": "user", "content": "again"}])
+    start = time.perf_counter()
+    body = client.get(f"/changes/{uid}?since=1&timeout=10").json()
+    th.join()
+    assert time.perf_counter() - start < 2
+    assert [c["seq"] for c in body["changes"]] == [2]
+    assert changefeed.CHANGES_WAKEUP_LATENCY._values[("local",)]["count"] >= 1
+
+    # a write by another worker process reaches no in-process listener; the watcher finds it
+    monkeypatch.setattr(storage, "_change_listeners", [])
+    th = _later(0.2, storage.record_change, uid, "t9", storage.CHANGE_MESSAGES)
+    body = client.get(f"/changes/{uid}?since=2&timeout=10").json()
+    th.join()
+    assert [(c["seq"], c["thread_id"]) for c in body["changes"]] == [(3, "t9")]
+    assert changefeed.CHANGES_WAKEUP_LATENCY._values[("watch",)]["count"] >= 1
+    assert changefeed.hub._waiters == {}
+
+
+def test_trimmed_or_removed_history_asks_for_a_reset(monkeypatch, data_dir):
+    monkeypatch.setattr(storage, "CHANGES_MAX_RECORDS", 6)
+    uid = "anon_trim"
+    for i in range(8):
+        storage.record_change(uid, f"t{i}", storage.CHANGE_MESSAGES)
+    records, floor = storage.read_changes(storage.change_log(uid))
+    assert floor > 0 and records[-1]["seq"] == 8 and len(records) <= 6
+
+    assert client.get(f"/changes/{uid}?since=0").json() == {"changes": [], "seq": 8, "reset": True}
+    assert [c["seq"] for c in client.get(f"/changes/{uid}?since={floor}").json()["changes"]][-1] == 8
+    # the user's data was removed: the client's cursor is ahead of the log
+    storage.remove_user_dir(uid)
+    assert client.get(f"/changes/{uid}?since=8&timeout=0").json()["reset"] is True
+
+
+def test_changes_require_the_owner():
+    assert client.get("/changes/u_someone?since=0&timeout=0").status_code == 401
+    headers = {"Authorization": f"Bearer {main.create_token_for_user('u_other')}"}
+    assert client.get("/changes/u_someone?since=0&timeout=0", headers=headers).status_code == 403
@@ -0,0 +1,69 @@
+import os
+import time
+
+from fastapi.testclient import TestClient
+
+import storage
+from main import app
+
+
+client = TestClient(app)
+
+
+def test_unchanged_messages_and_threads_revalidate_with_304(monkeypatch, data_dir):
+    uid = f"anon_etag{int(time.time() * 1000)}"
+    r = client.post("/message", json={"user_id": uid, "thread_id": "t1", "role": "user", "content": "hello there"})
+    assert r.status_code == 200
+
+    for path in (f"/messages/{uid}/t1", f"/threads/{uid}"):
+        first = client.get(path)
+        assert first.status_code == 200
+        etag = first.headers["etag"]
+        assert etag.startswith('W/"')
+        assert "last-modified" in first.headers
+
+        # a matching tag is answered without reading the thread file
+        with monkeypatch.context() as m:
+            m.setattr(storage, "read_thread_file", lambda p: (_ for _ in ()).throw(AssertionError("read")))
+            m.setattr(storage.serialization, "load_file", lambda p: (_ for _ in ()).throw(AssertionError("read")))
+            again = client.get(path, headers={"If-None-Match": etag})
+        assert again.status_code == 304
+        assert again.content == b""
+        assert again.headers["etag"] == etag
+
+    etag = client.get(f"/messages/{uid}/t1").headers["etag"]
+    client.post("/message", json={"user_id": uid, "thread_id": "t1", "role": "assistant", "content": "hi!"})
+    changed = client.get(f"/messages/{uid}/t1", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.json()["count"] == 2
+    assert changed.headers["etag"] != etag
+
+
+def test_large_responses_are_gzipped(data_dir):
+    uid = f"anon_gzip{int(time.time() * 1000)}"
+    client.post("/message", json={"user_id": uid, "thread_id": "t1", "role": "user", "content": "x" * 4000})
+    r = client.get(f"/messages/{uid}/t1", headers={"Accept-Encoding": "gzip"})
+    assert r.headers.get("content-encoding") == "gzip"
+    assert r.json()["messages"][0]["content"] == "x" * 4000
+
+    small = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+
+
+def test_deleting_a_thread_moves_threads_last_modified(data_dir):
+    uid = "anon_etagdel"
+    for tid in ("t1", "t2"):
+        client.post("/message", json={"user_id": uid, "thread_id": tid, "role": "user", "content": "hello there"})
+    # age everything so the delete lands in a later second than the listing
+    old = time.time() - 100
+    for path in [*storage.user_dir(uid).iterdir(), storage.user_dir(uid)]:
+        os.utime(path, (old, old))
+
+    first = client.get(f"/threads/{uid}")
+    since = first.headers["last-modified"]
+    assert client.get(f"/threads/{uid}", headers={"If-Modified-Since": since}).status_code == 304
+
+    client.delete(f"/messages/{uid}/t2")
+    r = client.get(f"/threads/{uid}", headers={"If-Modified-Since": since})
+    assert r.status_code == 200
+    assert "t2" not in str(r.json())
@@ -0,0 +1,72 @@
+import shutil
+
+import joblib
+from fastapi.testclient import TestClient
+
+import gateway
+import main
+
+
+client = TestClient(main.app)
+
+
+def test_repeated_messages_hit_the_cache_until_the_model_is_reloaded(monkeypatch):
+    calls = []
+    real = gateway.ml_is_allowed_for_assistant
+
+    def counting(text, threshold=0.7, model=None):
+        calls.append(text)
+        return real(text, threshold=threshold, model=model)
+
+    monkeypatch.setattr(gateway, "ml_is_allowed_for_assistant", counting)
+    gateway._cache.clear()
+
+    first = gateway.decide("How to make me feel better", threshold=0.5)
+    second = gateway.decide("  how to make   me feel BETTER ", threshold=0.5)
+    assert first[4] is False and second[4] is True
+    assert first[:4] == second[:4]
+    assert len(calls) == 1
+
+    # a different threshold is a different decision
+    gateway.decide("how to make me feel better", threshold=0.9)
+    assert len(calls) == 2
+
+    gateway.load_model()
+    third = gateway.decide("how to make me feel better", threshold=0.5)
+    assert third[4] is False
+    assert len(calls) == 3
+
+
+def test_reload_validates_and_swaps_versioned_artifacts(monkeypatch, tmp_path):
+    monkeypatch.setattr(gateway, "MODEL_DIR", tmp_path)
+    shutil.copy(gateway._MODEL_PATH, gateway.artifact_path("v2"))
+    joblib.dump({"not": "a model"}, gateway.artifact_path("broken"))
+    try:
+        before = gateway.model_version()
+        report = gateway.reload_model("broken")
+        assert report["outcome"] == "invalid"
+        assert gateway.model_version() == before
+
+        report = gateway.reload_model("v2")
+        assert report["outcome"] == "ok"
+        assert gateway.model_version() == "v2"
+        assert (tmp_path / "CURRENT").read_text().strip() == "v2"
+        assert gateway.decide("hi there").model_version == "v2"
+        # nothing changed on disk since the swap
+        assert gateway.check_for_new_model() is None
+    finally:
+        monkeypatch.undo()
+        gateway.load_model()
+
+
+def test_admin_model_routes_require_token(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "")
+    assert client.get("/admin/model").status_code == 404
+
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "s3cret")
+    assert client.get("/admin/model", headers={"X-Admin-Token": "nope"}).status_code == 403
+    r = client.get("/admin/model", headers={"X-Admin-Token": "s3cret"})
+    assert r.status_code == 200
+    assert r.json()["version"] == gateway.model_version()
+    r = client.post("/admin/model/reload", json={"version": "../etc"}, headers={"X-Admin-Token": "s3cret"})
+    assert r.status_code == 404
@@ -0,0 +1,45 @@
+import time
+
+from fastapi.testclient import TestClient
+
+import main
+from main import app
+
+
+client = TestClient(app)
+
+
+def test_batch_appends_each_thread_with_one_save(monkeypatch, data_dir):
+    uid = f"anon_batch{int(time.time() * 1000)}"
+    client.post("/message", json={"user_id": uid, "thread_id": "t1", "role": "user", "content": "first"})
+
+    saves = []
+    real_save = main.save_messages
+    monkeypatch.setattr(main, "save_messages", lambda u, t, m: (saves.append((u, t)), real_save(u, t, m)))
+    r = client.post("/messages/batch", json={"messages": [
+        {"user_id": uid, "thread_id": "t1", "role": "user", "content": "how do I negotiate salary"},
+        {"user_id": uid, "thread_id": "t2", "role": "user", "content": "other thread"},
+        {"user_id": uid, "thread_id": "t1", "role": "assistant", "content": "Start by naming your range."},
+        {"user_id": uid, "thread_id": "t1", "role": "user", "content": "   "},
+    ]})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["ok"] is False
+    assert [x["ok"] for x in body["results"]] == [True, True, True, False]
+    assert [x.get("count") for x in body["results"][:3]] == [2, 1, 3]
+    assert body["results"][3]["status"] == 400
+    assert sorted(saves) == [(uid, "t1"), (uid, "t2")]
+
+    msgs = client.get(f"/messages/{uid}/t1").json()["messages"]
+    assert [m["content"] for m in msgs] == ["first", "how do I negotiate salary", "Start by naming your range."]
+    hits = client.get(f"/search/{uid}", params={"q": "negotiate salary"}).json()["results"]
+    assert hits and hits[0]["thread_id"] == "t1"
+
+
+def test_batch_rejects_a_token_for_another_user(data_dir):
+    token = main.create_token_for_user("u_batch_owner")
+    r = client.post("/messages/batch", headers={"Authorization": f"Bearer {token}"}, json={"messages": [
+        {"user_id": "u_someone_else", "thread_id": "t1", "role": "user", "content": "hi"},
+    ]})
+    assert r.json()["results"][0]["status"] == 403
+    assert client.post("/messages/batch", json={"messages": []}).status_code == 400
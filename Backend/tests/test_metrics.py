@@ -0,0 +1,46 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import metrics
+from main import app
+
+
+client = TestClient(app)
+
+
+def test_metrics_endpoint_reports_route_latency_and_counts():
+    r = client.get("/")
+    assert r.status_code == 200
+
+    m = client.get("/metrics")
+    assert m.status_code == 200
+    assert m.headers["content-type"].startswith("text/plain")
+    body = m.text
+    assert "# TYPE http_request_duration_seconds histogram" in body
+    assert 'http_requests_total{method="GET",route="/",status="200"}' in body
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/",le="+Inf"}' in body
+
+
+def test_default_dir_is_per_master_start_and_old_ones_are_removed(monkeypatch, tmp_path):
+    start = metrics._process_start(os.getpid())
+    if start is None:
+        pytest.skip("needs /proc")
+    # a process without a parent (PID 1) is its own master
+    monkeypatch.setattr(metrics.os, "getppid", lambda: 0)
+    live = tmp_path / metrics._default_dir().name
+    assert live.name == f"pma_metrics_{os.getpid()}_{start}"
+
+    # same pid, earlier start: a previous master that was restarted
+    stale = tmp_path / f"pma_metrics_{os.getpid()}_{int(start) - 1}"
+    for d in (live, stale):
+        d.mkdir()
+        (d / "metrics_1.json").write_text("{}")
+    monkeypatch.setattr(metrics, "METRICS_DIR", tmp_path / "current")
+    monkeypatch.setattr(metrics, "_default_in_use", True)
+    monkeypatch.setattr(metrics, "_pruned", False)
+    metrics.flush()
+    assert live.exists()
+    assert not stale.exists()
+    assert (tmp_path / "current" / f"metrics_{os.getpid()}.json").exists()
@@ -0,0 +1,31 @@
+from types import SimpleNamespace
+
+import main
+import promptcache
+
+
+def test_summary_prompts_share_the_history_prefix():
+    history = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+    calls = [promptcache.summary_messages(history, p, "old summary") for p in (main.CURRENT_PROMPT, main.UNCOVERED_PROMPT)]
+    assert calls[0][:3] == calls[1][:3]
+    assert calls[0][1:3] == history
+    # the previous summary follows the history so a new summary does not move the prefix
+    assert calls[0][3] == {"role": "system", "content": "Previous summary: old summary"}
+    assert calls[0][-1]["content"] == main.CURRENT_PROMPT
+
+    longer = promptcache.summary_messages(history + [{"role": "user", "content": "more"}], main.CURRENT_PROMPT)
+    assert longer[:3] == promptcache.summary_messages(history, main.CURRENT_PROMPT)[:3]
+
+
+def test_stream_usage_is_recorded_and_discounted():
+    usage = {"prompt_tokens": 2048, "completion_tokens": 10, "prompt_tokens_details": {"cached_tokens": 1536}}
+    chunks = [
+        SimpleNamespace(choices=[SimpleNamespace(delta={"content": "ok"})], usage=None),
+        SimpleNamespace(choices=[], usage=usage),
+    ]
+    before = promptcache.PROMPT_CACHED_TOKENS._values.get(("test",), 0)
+    stream = promptcache.UsageStream(iter(chunks), "test")
+    assert [main.extract_delta_text(c) for c in stream] == ["ok"]
+    assert stream.usage == promptcache.Usage(2048, 1536, 10)
+    assert promptcache.PROMPT_CACHED_TOKENS._values[("test",)] - before == 1536
+    assert promptcache.cached_discount(stream.usage) == int(1536 * (1 - promptcache.PROMPT_CACHED_TOKEN_RATE))
@@ -0,0 +1,94 @@
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+import related
+import storage
+from cache import TTLCache
+from main import app
+
+
+client = TestClient(app)
+
+
+def test_related_threads_ranks_similar_thread_first(data_dir):
+    if not related.available():
+        return
+    uid = f"anon_related{int(time.time() * 1000)}"
+    posts = [
+        ("job_a", "I feel anxious about my job interview"),
+        ("job_b", "my job interview is at work and I feel anxious"),
+        ("python", "write a for loop in python"),
+    ]
+    for tid, text in posts:
+        r = client.post("/message", json={"user_id": uid, "thread_id": tid, "role": "user", "content": text})
+        assert r.status_code == 200
+
+    r = client.get(f"/threads/{uid}/job_a/related")
+    assert r.status_code == 200
+    rel = r.json()["related"]
+    assert rel[0]["thread_id"] == "job_b"
+    assert all(item["thread_id"] != "job_a" for item in rel)
+
+    # incremental and rebuilt indexes agree
+    incremental = related.related_threads(uid, "job_a")
+    related.rebuild_index(uid)
+    assert related.related_threads(uid, "job_a") == incremental
+
+
+def test_cached_indexes_are_bounded(monkeypatch, data_dir):
+    if not related.available():
+        return
+    monkeypatch.setattr(related, "_cache", TTLCache(maxsize=2, ttl=60))
+    uids = [f"anon_relbound{int(time.time() * 1000)}_{n}" for n in range(3)]
+    for uid in uids:
+        client.post("/message", json={"user_id": uid, "thread_id": "a", "role": "user", "content": "job interview nerves"})
+        client.post("/message", json={"user_id": uid, "thread_id": "b", "role": "user", "content": "anxious about the job interview"})
+        assert related.related_threads(uid, "a")[0]["thread_id"] == "b"
+    assert len(related._cache) == 2 and related._cache.get(uids[0]) is None
+    assert related.related_threads(uids[0], "a")[0]["thread_id"] == "b"
+
+
+def test_concurrent_loads_replay_the_log_once(monkeypatch, data_dir):
+    if not related.available():
+        return
+    uid = "anon_relconcurrent"
+    storage.save_messages(uid, "a", [{"role": "user", "content": "job interview nerves"}])
+    storage.save_messages(uid, "b", [{"role": "user", "content": "anxious about the job interview"}])
+    related.rebuild_index(uid)
+    for tid, text in (("a", "job interview nerves"), ("b", "anxious about the job interview")):
+        related._oplog(uid).append({"op": "add", "t": tid, **dict(zip("jv", _vec(text)))})
+
+    # pause the first replay between reading the log and applying it
+    read_done, resume = threading.Event(), threading.Event()
+    read_since = related.OpLog.read_since
+
+    def slow_read_since(self, offset):
+        out = read_since(self, offset)
+        if not read_done.is_set():
+            read_done.set()
+            resume.wait(5)
+        return out
+
+    monkeypatch.setattr(related.OpLog, "read_since", slow_read_since)
+    first = threading.Thread(target=related._load, args=(uid,))
+    first.start()
+    assert read_done.wait(5)
+    second = threading.Thread(target=related._load, args=(uid,))
+    second.start()
+    second.join(0.2)
+    resume.set()
+    first.join()
+    second.join()
+
+    idx = related._cache.get(uid)
+    idx.to_snapshot()  # folds pending adds into the matrix
+    expected = related._build_from_stores(uid)
+    # every logged add counted once: each thread's vector is twice its stored message
+    assert abs(idx.matrix - 2 * expected.matrix).max() < 1e-9
+
+
+def _vec(text):
+    v = related._vectorize([text])
+    return v.indices.tolist(), v.data.tolist()
@@ -0,0 +1,87 @@
+import json
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+import gateway
+import main
+import replycache
+import storage
+from cache import TTLCache
+from main import app
+
+
+client = TestClient(app)
+
+
+def _allow(text, threshold=0.5):
+    return gateway.Decision(True, "personal", 0.9, "test", False, "test")
+
+
+def test_replies_are_served_from_a_full_variant_pool(monkeypatch):
+    monkeypatch.setattr(gateway, "decide", _allow)
+    monkeypatch.setattr(replycache, "_cache", TTLCache(maxsize=8, ttl=60))
+    monkeypatch.setattr(replycache, "REPLY_CACHE_VARIANTS", 2)
+    monkeypatch.setattr(replycache, "REPLY_CACHE_REPLAY_DELAY_MS", 0)
+    calls = []
+
+    def fake_completion(endpoint, **kwargs):
+        calls.append(kwargs)
+        text = f"Try one small step today ({len(calls)})."
+        if kwargs.get("stream"):
+            return iter([SimpleNamespace(choices=[SimpleNamespace(delta={"content": text})])])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=None)
+
+    monkeypatch.setattr(main, "create_chat_completion", fake_completion)
+    saved_before = replycache.REPLY_CACHE_SAVED._values.get(("/chat",), 0)
+
+    first = client.post("/chat", json={"message": "How do I stop procrastinating?"}).json()["reply"]
+    # normalized text shares the key; the pool fills before anything is served from it
+    second = client.post("/chat", json={"message": "  how do I stop   PROCRASTINATING? "}).json()["reply"]
+    assert len(calls) == 2 and first != second
+
+    for _ in range(3):
+        assert client.post("/chat", json={"message": "How do I stop procrastinating?"}).json()["reply"] in (first, second)
+    r = client.post("/chat?stream=true", json={"message": "How do I stop procrastinating?"})
+    deltas = [json.loads(line[len("data: "):])["delta"] for line in r.text.split("\n\n") if line.startswith("data: {")]
+    assert len(deltas) > 1 and "".join(deltas) in (first, second)
+    assert r.text.endswith("data: [DONE]\n\n")
+    assert len(calls) == 2
+    assert replycache.REPLY_CACHE_SAVED._values[("/chat",)] - saved_before == 4
+
+    # a different temperature bucket or system prompt is a different key
+    k = replycache.key(main.CHAT_SYSTEM_PROMPT, "gpt-4o-mini", 0.7, "How do I stop procrastinating?")
+    assert replycache.key(main.CHAT_SYSTEM_PROMPT, "gpt-4o-mini", 0.75, "how do i stop procrastinating?") == k
+    assert replycache.key(main.CHAT_SYSTEM_PROMPT, "gpt-4o-mini", 0.2, "How do I stop procrastinating?") != k
+    assert replycache.key("other prompt", "gpt-4o-mini", 0.7, "How do I stop procrastinating?") != k
+
+
+def test_pool_skips_duplicates_and_is_size_bounded(monkeypatch):
+    monkeypatch.setattr(replycache, "_cache", TTLCache(maxsize=1, ttl=60))
+    monkeypatch.setattr(replycache, "REPLY_CACHE_VARIANTS", 2)
+    a = replycache.key("p", "m", 0.7, "first")
+    b = replycache.key("p", "m", 0.7, "second")
+    for reply in ("one", "one", "  ", "two", "three"):
+        replycache.add(a, reply)
+    assert replycache._cache.get(a) == ("one", "two")
+    replycache.add(b, "x")  # size bound evicts the older key
+    assert replycache._cache.get(a) is None
+    assert replycache.chunks(" You can  do this. ") and "".join(replycache.chunks(" You can  do this. ")) == " You can  do this. "
+
+
+def test_cached_replies_need_a_balance(monkeypatch, data_dir):
+    monkeypatch.setattr(gateway, "decide", _allow)
+    monkeypatch.setattr(replycache, "_cache", TTLCache(maxsize=8, ttl=60))
+    monkeypatch.setattr(replycache, "REPLY_CACHE_VARIANTS", 1)
+    monkeypatch.setattr(main, "create_chat_completion", lambda endpoint, **kw: SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="Start with five minutes."))], usage=None))
+    question = "How do I stop procrastinating?"
+    assert client.post("/chat", json={"message": question}).json()["reply"] == "Start with five minutes."
+
+    storage.save_users({"u_broke": {"tokens_left": 0}})
+    headers = {"Authorization": f"Bearer {main.create_token_for_user('u_broke')}"}
+    for path in ("/chat", "/chat?stream=true"):
+        assert client.post(path, json={"message": question}, headers=headers).status_code == 403
+    with client.websocket_connect("/ws/chat", headers=headers) as ws:
+        ws.send_json({"type": "chat", "thread_id": "t1", "message": question})
+        assert ws.receive_json() == {"type": "error", "status": 403, "detail": "insufficient tokens"}
@@ -0,0 +1,60 @@
+import os
+import time
+
+from fastapi.testclient import TestClient
+
+import retention
+import storage
+from main import app
+
+
+client = TestClient(app)
+
+
+def _age(path, days):
+    ts = time.time() - days * 86400
+    os.utime(path, (ts, ts))
+
+
+def test_sweep_expires_idle_anonymous_threads(monkeypatch, data_dir):
+    old = time.time() - 40 * 86400
+    storage.save_messages("anon_old", "t1", [{"role": "user", "content": "x" * 500}])
+    storage.save_summary("anon_old", "t1", {"current_state": "s"})
+    storage.save_messages("anon_busy", "t1", [{"role": "user", "content": "old"}])
+    storage.save_messages("anon_busy", "t2", [{"role": "user", "content": "new"}])
+    storage.save_messages("u_registered", "t1", [{"role": "user", "content": "kept"}])
+    for p in (storage._thread_path("anon_old", "t1"), storage._summary_path("anon_old", "t1"),
+              storage._thread_path("anon_busy", "t1"), storage._thread_path("u_registered", "t1")):
+        _age(p, 40)
+    log = storage.activity_log()
+    state, _ = retention.load_activity()
+    assert sorted(state) == ["anon_busy", "anon_old"]
+    state["anon_old"]["t1"] = state["anon_busy"]["t1"] = old
+    with log.locked():
+        log.write_snapshot(retention.serialization.dumps(state))
+
+    # a sweep never lists DATA_DIR
+    monkeypatch.setattr(storage, "list_user_ids", lambda: (_ for _ in ()).throw(AssertionError("scan")))
+    report = retention.sweep()
+    assert report["threads"] == 2
+    assert report["users"] == 1
+    assert report["bytes"] > 500
+    assert not storage.user_dir("anon_old").exists()
+    assert storage.load_messages("anon_busy", "t1") == []
+    assert storage.load_messages("anon_busy", "t2") == [{"role": "user", "content": "new"}]
+    assert storage.load_messages("u_registered", "t1") == [{"role": "user", "content": "kept"}]
+    assert retention.load_activity()[0] == {"anon_busy": {"t2": state["anon_busy"]["t2"]}}
+
+
+def test_deleted_thread_file_is_removed_and_summary_expires(data_dir):
+    uid = "anon_del"
+    client.post("/message", json={"user_id": uid, "thread_id": "t1", "role": "user", "content": "hello there"})
+    storage.save_summary(uid, "t1", {"current_state": "s"})
+    assert client.delete(f"/messages/{uid}/t1").status_code == 200
+    assert not storage._thread_path(uid, "t1").exists()
+    assert client.get(f"/threads/{uid}").json()["threads"] == []
+
+    assert retention.sweep()["threads"] == 0
+    report = retention.sweep(now=time.time() + 2 * 3600)
+    assert report["threads"] == 1
+    assert not storage._summary_path(uid, "t1").exists()
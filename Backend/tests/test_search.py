@@ -0,0 +1,90 @@
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+import search
+import storage
+from cache import TTLCache
+from main import app
+
+
+client = TestClient(app)
+
+
+def test_search_finds_messages_across_threads_and_ranks_by_bm25(data_dir):
+    uid = f"anon_search{int(time.time() * 1000)}"
+    posts = [
+        ("t_work", "My manager keeps moving deadlines and I feel anxious"),
+        ("t_work", "I talked to my manager again today about the manager role"),
+        ("t_home", "Planning a weekend trip with my partner"),
+    ]
+    for tid, text in posts:
+        r = client.post("/message", json={"user_id": uid, "thread_id": tid, "role": "user", "content": text})
+        assert r.status_code == 200
+
+    r = client.get(f"/search/{uid}", params={"q": "managers"})
+    assert r.status_code == 200
+    results = r.json()["results"]
+    assert [(h["thread_id"], h["message_index"]) for h in results] == [("t_work", 1), ("t_work", 0)]
+
+    r = client.get(f"/search/{uid}", params={"q": "partner trip"})
+    assert r.json()["results"][0]["thread_id"] == "t_home"
+
+    # deleting a thread removes its postings
+    client.delete(f"/messages/{uid}/t_home")
+    assert client.get(f"/search/{uid}", params={"q": "partner"}).json()["results"] == []
+
+
+def test_rebuild_matches_incremental_index(data_dir):
+    uid = f"anon_rebuild{int(time.time() * 1000)}"
+    client.post("/message", json={"user_id": uid, "thread_id": "a", "role": "user", "content": "career change worries"})
+    client.post("/message", json={"user_id": uid, "thread_id": "b", "role": "user", "content": "a new career goal"})
+    incremental = search.search(uid, "career")
+    search.rebuild_index(uid)
+    assert search.search(uid, "career") == incremental
+
+
+def test_queries_wait_for_a_replay_in_progress(monkeypatch, data_dir):
+    uid = "anon_concurrent"
+    search.rebuild_index(uid)
+    search.index_message(uid, "t1", 0, "user", "work deadline")
+
+    # pause a log replay halfway through its ops
+    in_replay, resume = threading.Event(), threading.Event()
+    apply = search.UserIndex.apply
+
+    def slow_apply(self, op):
+        apply(self, op)
+        if op.get("i") == 1:
+            in_replay.set()
+            resume.wait(5)
+
+    monkeypatch.setattr(search.UserIndex, "apply", slow_apply)
+    search._oplog(uid).extend([
+        {"op": "add", "t": "t1", "i": i, "r": "user", "c": f"work deadline {i}"} for i in range(1, 4)
+    ])
+    replay = threading.Thread(target=search._load, args=(uid,))
+    replay.start()
+    assert in_replay.wait(5)
+
+    results = []
+    query = threading.Thread(target=lambda: results.append(search._cache.get(uid).search("deadline")))
+    query.start()
+    query.join(0.2)
+    # the query does not read the index while the replay is changing it
+    assert query.is_alive() and results == []
+    resume.set()
+    replay.join()
+    query.join()
+    assert len(results[0]) == 4
+
+
+def test_cached_indexes_are_bounded(monkeypatch, data_dir):
+    monkeypatch.setattr(search, "_cache", TTLCache(maxsize=2, ttl=60))
+    for n in range(3):
+        storage.save_messages(f"anon_bounded{n}", "t", [{"role": "user", "content": f"budget plan {n}"}])
+        assert search.search(f"anon_bounded{n}", "budget")
+    assert len(search._cache) == 2 and search._cache.get("anon_bounded0") is None
+    # an evicted index is reloaded from its snapshot
+    assert search.search("anon_bounded0", "budget")[0]["snippet"] == "budget plan 0"
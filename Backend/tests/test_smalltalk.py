@@ -0,0 +1,70 @@
+import random
+import time
+
+from fastapi.testclient import TestClient
+
+import gateway
+import main
+import metrics
+import smalltalk
+from main import app
+
+
+client = TestClient(app)
+
+
+def test_only_short_non_personal_small_talk_is_answered_locally():
+    assert smalltalk.classify("hi") == "greeting"
+    assert smalltalk.classify("Good morning!") == "greeting"
+    assert smalltalk.classify("Thank you so much 🙏") == "thanks"
+    assert smalltalk.classify("hey, how are you?") == "checkin"
+    assert smalltalk.classify("Hi there! How's it going?") == "checkin"
+    # starts like a greeting, but is about something personal
+    assert smalltalk.classify("hi, I feel stuck at work") is None
+    assert smalltalk.classify("hello there, I wanted to ask you about a few things today") is None
+    assert smalltalk.classify("I'm anxious about a big career decision") is None
+    # short, greeting-shaped and not on the personal-topic list, but not small talk
+    for text in ("hey, I want to die", "hey, kill myself tonight", "hello, my mom passed away",
+                 "thank you, I hate myself", "thanks for nothing", "hi. help", "how are you supposed to cope"):
+        assert smalltalk.classify(text) is None, text
+        assert smalltalk.reply(text) is None, text
+
+    rng = random.Random(0)
+    assert smalltalk.reply("good evening", rng).startswith("Good evening!")
+    assert smalltalk.reply("thanks!!", rng) in smalltalk.TEMPLATES["thanks"]["upbeat"]
+
+
+def test_chat_small_talk_skips_upstream_and_tokens(monkeypatch):
+    monkeypatch.setattr(main, "create_chat_completion", lambda *a, **kw: (_ for _ in ()).throw(AssertionError("upstream")))
+    monkeypatch.setattr(main, "save_users", lambda users: (_ for _ in ()).throw(AssertionError("charged")))
+    before = metrics.CHAT_REQUESTS._values.get(("/chat", "local"), 0)
+
+    start = time.perf_counter()
+    r = client.post("/chat?stream=true", json={"message": "hey there"}, headers={"Authorization": f"Bearer {main.create_token_for_user('u_smalltalk')}"})
+    assert time.perf_counter() - start < 0.5
+    assert r.headers["content-type"].startswith("text/event-stream")
+    lines = [line for line in r.text.split("\n\n") if line]
+    assert lines[0].startswith("data: {\"delta\": ") and lines[-1] == "data: [DONE]"
+
+    assert client.post("/chat", json={"message": "thank you"}).json()["reply"] in (
+        smalltalk.TEMPLATES["thanks"]["calm"])
+    assert metrics.CHAT_REQUESTS._values[("/chat", "local")] - before == 2
+
+
+def test_crisis_messages_shaped_like_small_talk_reach_the_gateway(monkeypatch):
+    seen = []
+
+    def refuse(text, threshold=0.5):
+        seen.append(text)
+        return gateway.Decision(False, "other", 0.9, "test", False, "test")
+
+    monkeypatch.setattr(gateway, "decide", refuse)
+    monkeypatch.setattr(main, "create_chat_completion", lambda *a, **kw: (_ for _ in ()).throw(AssertionError("upstream")))
+    r = client.post("/chat", json={"message": "hey, I want to die"})
+    assert seen == ["hey, I want to die"]
+    assert r.json()["reply"] == main.GATEWAY_REFUSAL
+
+
+def test_fast_path_can_be_turned_off(monkeypatch):
+    monkeypatch.setattr(smalltalk, "SMALLTALK_FAST_PATH", False)
+    assert smalltalk.reply("hi") is None
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+import storage
+
+
+@pytest.fixture
+def legacy_data_dir(data_dir, monkeypatch):
+    monkeypatch.setattr(storage, "_legacy_pending", True)
+    return data_dir
+
+
+def test_threads_are_written_to_sharded_user_directory(legacy_data_dir):
+    storage.save_messages("u1", "t1", [{"role": "user", "content": "hi"}])
+    p = storage._thread_path("u1", "t1")
+    assert p.exists()
+    assert p.parent.name == "u1"
+    assert p.parent.parent.parent == legacy_data_dir
+    assert [tid for tid, _ in storage.list_thread_files("u1")] == ["t1"]
+    assert storage.list_thread_files("someone_else") == []
+
+
+def test_flat_layout_is_read_and_migrated(legacy_data_dir):
+    (legacy_data_dir / "u2__a.json").write_text(json.dumps([{"role": "user", "content": "old"}]), encoding="utf-8")
+    (legacy_data_dir / "u2__a__summary.json").write_text(json.dumps({"current_state": "s"}), encoding="utf-8")
+    (legacy_data_dir / "u2__b.json").write_text("[]", encoding="utf-8")
+
+    # compatibility reader adopts the flat file on access
+    assert storage.load_messages("u2", "a")[0]["content"] == "old"
+    assert not (legacy_data_dir / "u2__a.json").exists()
+
+    assert storage.migrate_flat_layout() == 2
+    assert storage.load_saved_summary("u2", "a") == {"current_state": "s"}
+    assert sorted(tid for tid, _ in storage.list_thread_files("u2")) == ["a", "b"]
+    assert storage._legacy_pending is False
+
+
+def test_cold_threads_are_compressed_and_promoted_on_read(legacy_data_dir):
+    msgs = [{"role": "user", "content": "an old conversation " * 20}]
+    storage.save_messages("u3", "old", msgs)
+    hot = storage._thread_path("u3", "old")
+
+    report = storage.compact_cold_files(max_age_days=0, now=hot.stat().st_mtime + 1)
+    assert report["files"] == 1
+    assert report["bytes_after"] < report["bytes_before"]
+    assert not hot.exists()
+    # listing still sees the thread without promoting it
+    [(tid, path)] = storage.list_thread_files("u3")
+    assert tid == "old" and storage.read_thread_file(path) == msgs
+
+    assert storage.load_messages("u3", "old") == msgs
+    assert hot.exists()
+    assert not storage._cold_path(hot).exists()
+
+
+def test_compaction_keeps_a_write_that_lands_before_the_hot_file_is_removed(monkeypatch, legacy_data_dir):
+    storage.save_messages("u4", "t", [{"role": "user", "content": "old"}])
+    hot = storage._thread_path("u4", "t")
+    delete_if_unchanged = storage._delete_if_unchanged
+
+    def racing_delete(path, st):
+        # the cold copy is in place; a user write arrives before the hot file goes
+        storage.save_messages("u4", "t", [{"role": "user", "content": "new"}])
+        return delete_if_unchanged(path, st)
+
+    monkeypatch.setattr(storage, "_delete_if_unchanged", racing_delete)
+    assert storage.compact_cold_files(max_age_days=0, now=hot.stat().st_mtime + 1)["files"] == 0
+    assert storage.load_messages("u4", "t") == [{"role": "user", "content": "new"}]
+    assert not storage._cold_path(hot).exists()
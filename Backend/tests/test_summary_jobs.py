@@ -0,0 +1,138 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import storage
+import summaryjobs
+from main import app
+
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def jobs_data_dir(data_dir, monkeypatch):
+    monkeypatch.setattr(summaryjobs, "SUMMARY_PRECOMPUTE_CONCURRENCY", 2)
+    return data_dir
+
+
+def _post(uid, text):
+    r = client.post("/message", json={"user_id": uid, "thread_id": "t1", "role": "user", "content": text})
+    assert r.status_code == 200
+
+
+def test_writes_queue_one_job_per_thread_after_n_messages(jobs_data_dir):
+    runs = []
+
+    def run(user_id, thread_id):
+        runs.append((user_id, thread_id))
+        n = len(storage.load_messages(user_id, thread_id))
+        storage.save_summary(user_id, thread_id, {"current_state": "s", "message_count": n})
+        return n
+
+    jobs = summaryjobs.JobQueue(run, after_messages=3, idle_minutes=10)
+    for i in range(2):
+        _post("anon_jobs", f"message {i}")
+    assert jobs.tick() == 0  # neither threshold reached yet
+
+    _post("anon_jobs", "message 2")
+    _post("anon_jobs", "message 3")
+    assert jobs.tick() == 1
+    jobs.drain()
+    assert runs == [("anon_jobs", "t1")]
+    jobs.refresh()
+    assert jobs.state == {}  # summary covers every message
+
+    # quiet threads are refreshed once idle, even below the message threshold
+    _post("anon_jobs", "message 4")
+    assert jobs.tick() == 0
+    assert jobs.tick(now=time.time() + 11 * 60) == 1
+    jobs.drain()
+    assert len(runs) == 2
+
+    # the job file survives a restart
+    _post("anon_jobs", "message 5")
+    restarted = summaryjobs.JobQueue(lambda u, t: 0, after_messages=3, idle_minutes=10)
+    assert restarted.state["anon_jobs"]["t1"]["n"] == 6
+
+
+def test_precomputed_summary_is_served_and_errors_are_not_saved(monkeypatch, jobs_data_dir):
+    replies = {main.CURRENT_PROMPT: "You are weighing an offer.", main.UNCOVERED_PROMPT: "- stability",
+               main.SUGGESTED_PROMPT: "1. List priorities"}
+    calls = []
+
+    def fake_completion(endpoint, caller=None, **kwargs):
+        calls.append(caller)
+        if fail:
+            raise RuntimeError("upstream down")
+        text = replies[kwargs["messages"][-1]["content"]]
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=None)
+
+    monkeypatch.setattr(main, "create_chat_completion", fake_completion)
+    jobs = summaryjobs.JobQueue(main._precompute_summary, after_messages=2)
+    _post("anon_pre", "should I switch jobs?")
+    _post("anon_pre", "I value stability")
+
+    fail = True
+    assert jobs.tick() == 1
+    jobs.drain()
+    assert storage.load_saved_summary("anon_pre", "t1") is None
+    assert jobs.tick() == 0  # backing off after the failure
+
+    fail = False
+    jobs._failures.clear()
+    assert jobs.tick() == 1
+    jobs.drain()
+    body = client.get("/summary/saved/anon_pre/t1").json()
+    saved = body["summary"]
+    assert saved["current_state"] == "You are weighing an offer."
+    assert saved["what_we_uncovered"] == ["stability"]
+    assert body["edited"] is False and body["message_count"] == 2
+    assert not set(saved) & set(main.SUMMARY_INTERNAL_KEYS)
+    assert all(c.priority == main.admission.PRIORITY_BACKGROUND for c in calls)
+
+
+def test_edits_are_kept_until_the_thread_grows(monkeypatch, jobs_data_dir):
+    calls = []
+    monkeypatch.setattr(main, "create_chat_completion", lambda endpoint, **kw: (calls.append(kw), SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="You are deciding."))], usage=None))[1])
+    jobs = summaryjobs.JobQueue(main._precompute_summary, after_messages=2)
+    _post("anon_edit", "should I switch jobs?")
+    edited = {"current_state": "My own words", "what_we_uncovered": ["x"], "suggested_next_steps": ["y"]}
+    assert client.post("/summary/save", json={"user_id": "anon_edit", "thread_id": "t1", "summary": edited}).status_code == 200
+    body = client.get("/summary/saved/anon_edit/t1").json()
+    assert body == {"summary": edited, "edited": True, "message_count": 1}
+
+    # the edit covers every message: a run leaves it alone without calling upstream
+    assert main._precompute_summary("anon_edit", "t1") == 1
+    assert calls == [] and storage.load_saved_summary("anon_edit", "t1")["edited"] is True
+
+    # the editor's payload has no message_count; the save records it, so nothing is due yet
+    _post("anon_edit", "I value stability")
+    assert jobs.tick() == 0
+    # once the conversation has moved on, the thread is refreshed again
+    _post("anon_edit", "and growth")
+    assert jobs.tick() == 1
+    jobs.drain()
+    assert len(calls) == len(main.SUMMARY_SECTIONS)
+    body = client.get("/summary/saved/anon_edit/t1").json()
+    assert body["edited"] is False and body["message_count"] == 3
+    assert body["summary"]["current_state"] == "You are deciding."
+
+
+def test_background_summaries_are_not_charged(monkeypatch, jobs_data_dir):
+    monkeypatch.setattr(main, "create_chat_completion", lambda endpoint, **kw: SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="- a point"))], usage=None))
+    storage.save_users({"u_bg": {"tokens_left": 5000}, "u_broke": {"tokens_left": 0}})
+    for uid in ("u_bg", "u_broke"):
+        storage.save_messages(uid, "t1", [{"role": "user", "content": "should I switch jobs?"}])
+
+    assert main._precompute_summary("u_bg", "t1") == 1
+    assert storage.load_saved_summary("u_bg", "t1")["message_count"] == 1
+    assert storage.load_users()["u_bg"]["tokens_left"] == 5000
+    # a user who could not pay for the summary on demand does not get it for free
+    assert main._precompute_summary("u_broke", "t1") == 1
+    assert storage.load_saved_summary("u_broke", "t1") is None
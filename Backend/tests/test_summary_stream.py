@@ -0,0 +1,115 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from main import app
+
+
+client = TestClient(app)
+
+REPLIES = {
+    main.CURRENT_PROMPT: "You are weighing a job offer. You feel torn.",
+    main.UNCOVERED_PROMPT: "- You value stability\n- You fear stagnation",
+    main.SUGGESTED_PROMPT: "1. List your priorities\n2. Talk to a mentor: soon",
+}
+
+
+def _fake_completion(endpoint, **kwargs):
+    text = REPLIES[kwargs["messages"][-1]["content"]]
+    if kwargs.get("stream"):
+        return iter(SimpleNamespace(choices=[SimpleNamespace(delta={"content": w + " "})]) for w in text.split(" "))
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+def _events(body: str):
+    out = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        out.append((lines["event"], json.loads(lines["data"])))
+    return out
+
+
+def test_summary_sections_stream_as_events(monkeypatch):
+    monkeypatch.setattr(main, "create_chat_completion", _fake_completion)
+    uid = f"anon_sumstream{int(time.time() * 1000)}"
+    client.post("/message", json={"user_id": uid, "thread_id": "t1", "role": "user", "content": "should I switch jobs?"})
+
+    plain = client.get(f"/summary/{uid}/t1").json()
+
+    r = client.get(f"/summary/{uid}/t1", headers={"Accept": "text/event-stream"})
+    assert r.headers["content-type"].startswith("text/event-stream")
+    events = _events(r.text)
+    sections = {d["section"]: d["value"] for e, d in events if e == "section"}
+    assert len(sections) == 3
+    for key, value in sections.items():
+        assert value == plain[key]
+    assert events[-1] == ("done", {"message_count": 1, "tokens_charged": 0})
+
+    r = client.get(f"/summary/{uid}/t1?stream=true&tokens=true")
+    events = _events(r.text)
+    deltas = "".join(d["delta"] for e, d in events if e == "delta" and d["section"] == "current_state")
+    assert deltas.strip() == REPLIES[main.CURRENT_PROMPT]
+    # every section's deltas come before that section's final value
+    for key in sections:
+        idx = [i for i, (e, d) in enumerate(events) if d.get("section") == key]
+        assert events[idx[-1]] == ("section", {"section": key, "value": sections[key]})
+    assert events[-1][0] == "done"
+
+
+HISTORY = [{"role": "user", "content": "should I switch jobs?"}]
+CALLER = main.admission.Caller("user:anon_sumcancel")
+
+
+def test_refused_or_abandoned_summaries_stop_their_upstream_calls(monkeypatch):
+    ctl = main.admission.AdmissionController(max_concurrency=8, per_user=8, max_queue=8, timeout=1)
+    acquired = []
+
+    lock = threading.Lock()
+
+    def acquire(caller):
+        # the first section is refused; the others are admitted just after
+        with lock:
+            acquired.append(caller)
+            n = len(acquired)
+        if n == 1:
+            raise main.admission.Rejected("queue_full")
+        time.sleep(0.2)
+        return ctl.acquire(caller)
+
+    calls = []
+    monkeypatch.setattr(main.admission, "acquire", acquire)
+    monkeypatch.setattr(main, "create_chat_completion", lambda endpoint, **kw: calls.append(kw))
+    with pytest.raises(main.admission.Rejected):
+        main._stream_summary_sections("/summary", HISTORY, False, CALLER)
+    time.sleep(0.3)
+    assert len(acquired) == 3 and calls == [] and ctl.in_flight() == 0
+
+    # a client that goes away mid-stream stops the sections still streaming
+    closed = threading.Event()
+
+    def endless(endpoint, **kw):
+        def chunks():
+            try:
+                while True:
+                    time.sleep(0.01)
+                    yield SimpleNamespace(choices=[SimpleNamespace(delta={"content": "x"})])
+            finally:
+                closed.set()
+        return chunks()
+
+    monkeypatch.setattr(main.admission, "acquire", ctl.acquire)
+    monkeypatch.setattr(main, "create_chat_completion", endless)
+    events = main._stream_summary_sections("/summary", HISTORY, True, CALLER)
+    assert next(events).startswith("event: delta")
+    events.close()
+    assert closed.wait(2)
+    for _ in range(100):
+        if ctl.in_flight() == 0:
+            break
+        time.sleep(0.01)
+    assert ctl.in_flight() == 0
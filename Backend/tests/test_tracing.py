@@ -0,0 +1,29 @@
+from fastapi.testclient import TestClient
+
+import tracing
+from main import app
+
+
+client = TestClient(app)
+
+
+def test_server_timing_header_includes_storage_spans():
+    msg = {"user_id": "anon_tracing", "thread_id": "t_trace", "role": "user", "content": "hello"}
+    client.post("/message", json=msg)
+    r = client.post("/message", json=msg)
+    assert r.status_code == 200
+    header = r.headers.get("server-timing", "")
+    assert "storage.load_messages;dur=" in header
+    assert "storage.save_messages;dur=" in header
+    assert "total;dur=" in header
+
+
+def test_spans_nest_under_current_span():
+    root, token = tracing.start_trace("root")
+    with tracing.span("outer"):
+        with tracing.span("inner"):
+            pass
+    tracing.finish_trace(root, token)
+    tree = root.to_dict()
+    assert tree["children"][0]["name"] == "outer"
+    assert tree["children"][0]["children"][0]["name"] == "inner"
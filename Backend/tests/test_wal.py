@@ -0,0 +1,200 @@
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+import storage
+import wal
+
+BACKEND = Path(__file__).resolve().parent.parent
+
+# Writes from 100 threads; primary-file updates are dropped to simulate a power
+# loss before any checkpoint, and the process dies after 40 acknowledgements.
+CRASHING_WRITER = r"""
+import os, sys, threading
+from pathlib import Path
+sys.path.insert(0, sys.argv[1])
+import storage, wal
+
+storage.DATA_DIR = Path(sys.argv[2])
+storage.USERS_FILE = storage.DATA_DIR / "users.json"
+storage._legacy_pending = False
+wal._replace_file = lambda path, data, ts: None
+
+lock = threading.Lock()
+acked = []
+
+def writer(i):
+    storage.save_messages("crash-user", f"t{i}", [{"role": "user", "content": f"m{i}"}])
+    with lock:
+        print(i, flush=True)
+        acked.append(i)
+        if len(acked) == 40:
+            os._exit(1)
+
+threads = [threading.Thread(target=writer, args=(i,)) for i in range(100)]
+for th in threads:
+    th.start()
+for th in threads:
+    th.join()
+"""
+
+# Writes one record to a file through its own log, then dies before any checkpoint.
+OTHER_WORKER = r"""
+import os, sys
+from pathlib import Path
+sys.path.insert(0, sys.argv[1])
+import wal
+
+wal.get(Path(sys.argv[2])).write(Path(sys.argv[3]), b"B")
+os._exit(1)
+"""
+
+
+@pytest.fixture
+def wal_data_dir(data_dir, monkeypatch):
+    monkeypatch.setattr(storage, "WAL_ENABLED", True)
+    return data_dir
+
+
+def test_concurrent_writes_are_group_committed_and_readable(wal_data_dir):
+    threads = [
+        threading.Thread(target=storage.save_messages, args=("u", f"t{i}", [{"role": "user", "content": str(i)}]))
+        for i in range(50)
+    ]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    for i in range(50):
+        assert storage.load_messages("u", f"t{i}") == [{"role": "user", "content": str(i)}]
+
+    log = wal.get(wal_data_dir / storage.WAL_DIR_NAME)
+    assert len(wal.read_segment(log._seg.path)) == 50
+    assert log.checkpoint() == 1
+    assert [p for p in (wal_data_dir / storage.WAL_DIR_NAME).glob("*.wal")] == [log._seg.path]
+
+
+def test_writes_of_one_file_are_applied_in_commit_order(wal_data_dir):
+
+    def writer(i):
+        for j in range(5):
+            storage.save_messages("u", "shared", [{"role": "user", "content": f"{i}-{j}"}])
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(30)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+
+    log = wal.get(wal_data_dir / storage.WAL_DIR_NAME)
+    path = storage._thread_path("u", "shared")
+    last = [data for _, p, op, data in wal.read_segment(log._seg.path) if p == str(path.relative_to(wal_data_dir))][-1]
+    assert path.read_bytes() == last
+    assert not list(path.parent.glob(".*.wal"))
+    assert log._tail == {}
+
+
+def test_acknowledged_writes_survive_a_crash(tmp_path):
+    proc = subprocess.run(
+        [sys.executable, "-c", CRASHING_WRITER, str(BACKEND), str(tmp_path)],
+        capture_output=True, text=True, timeout=60,
+    )
+    assert proc.returncode == 1, proc.stderr
+    acked = [int(x) for x in proc.stdout.split()]
+    assert len(acked) >= 40
+
+    wal_dir = tmp_path / storage.WAL_DIR_NAME
+    segments = list(wal_dir.glob("*.wal"))
+    assert len(segments) == 1
+    # a record torn mid-append must not stop recovery of everything before it
+    with open(segments[0], "ab") as f:
+        f.write(wal.encode(1, str(tmp_path / "torn.json"), wal.OP_WRITE, b"[]")[:-5])
+
+    # the crash lost every primary write
+    user_dir = tmp_path / storage._shard(storage._safe("crash-user")) / "crash-user"
+    assert not any(user_dir.glob("*.json"))
+
+    log = wal.WriteAheadLog(wal_dir)
+    for i in acked:
+        path = user_dir / f"t{i}.json"
+        assert storage.serialization.load_file(path) == [{"role": "user", "content": f"m{i}"}]
+    assert not (tmp_path / "torn.json").exists()
+    assert list(wal_dir.glob("*.wal")) == [log._seg.path]
+
+
+def test_replay_follows_a_moved_data_dir(tmp_path):
+    old, moved = tmp_path / "old", tmp_path / "moved"
+    (moved / storage.WAL_DIR_NAME).mkdir(parents=True)
+    # a dead process's segment, copied along with the data dir
+    with open(moved / storage.WAL_DIR_NAME / "1-1.wal", "wb") as f:
+        f.write(wal.encode(10, "ab/u/t1.json", wal.OP_WRITE, b"[1]"))
+        f.write(wal.encode(11, str(moved / "ab" / "u" / "t2.json"), wal.OP_WRITE, b"[2]"))
+        f.write(wal.encode(12, str(old / "ab" / "u" / "t3.json"), wal.OP_WRITE, b"[3]"))
+
+    wal.WriteAheadLog(moved / storage.WAL_DIR_NAME)
+    assert (moved / "ab" / "u" / "t1.json").read_bytes() == b"[1]"
+    assert (moved / "ab" / "u" / "t2.json").read_bytes() == b"[2]"
+    assert not old.exists() and not (moved / "ab" / "u" / "t3.json").exists()
+
+
+def test_replay_does_not_recreate_deleted_files(monkeypatch, wal_data_dir):
+    wal_dir = wal_data_dir / storage.WAL_DIR_NAME
+    wal_dir.mkdir()
+    now = wal.time.time_ns()
+    # a dead process's writes; t1 was deleted afterwards by another process
+    with open(wal_dir / f"1-{now - 2}.wal", "wb") as f:
+        f.write(wal.encode(now - 2, "ab/u/t1.json", wal.OP_WRITE, b"[1]"))
+        f.write(wal.encode(now - 1, "ab/u/t2.json", wal.OP_WRITE, b"[2]"))
+    (wal_dir / "tombstones.log").write_text(f"{now}\tab/u/t1.json\n")
+
+    log = wal.get(wal_dir)
+    assert not (wal_data_dir / "ab" / "u" / "t1.json").exists()
+    assert (wal_data_dir / "ab" / "u" / "t2.json").read_bytes() == b"[2]"
+
+    # compaction deletes hot files through the log too
+    storage.save_messages("u", "old", [{"role": "user", "content": "x"}])
+    hot = storage._thread_path("u", "old")
+    assert storage.compact_cold_files(max_age_days=0, now=wal.time.time() + 1)["files"] >= 1
+    assert not hot.exists()
+    assert str(hot.relative_to(wal_data_dir)) in [p for _, p in log._read_tombstones()]
+
+    monkeypatch.setattr(wal, "TOMBSTONE_GRACE_NS", 0)
+    log.checkpoint()
+    assert log._read_tombstones() == []
+
+
+def test_a_late_apply_from_another_process_does_not_roll_back(monkeypatch, tmp_path):
+    wal_dir = tmp_path / storage.WAL_DIR_NAME
+    path = tmp_path / "ab" / "u" / "t1.json"
+    log = wal.get(wal_dir)
+    reached, release = threading.Event(), threading.Event()
+    original = wal.WriteAheadLog._apply
+
+    def paused(self, *args):
+        if not reached.is_set():
+            reached.set()
+            release.wait(10)
+        return original(self, *args)
+
+    # this worker commits first but applies last; the other worker writes in between and dies
+    monkeypatch.setattr(wal.WriteAheadLog, "_apply", paused)
+    th = threading.Thread(target=log.write, args=(path, b"A"))
+    th.start()
+    assert reached.wait(10)
+    proc = subprocess.run(
+        [sys.executable, "-c", OTHER_WORKER, str(BACKEND), str(wal_dir), str(path)],
+        capture_output=True, text=True, timeout=60,
+    )
+    assert proc.returncode == 1, proc.stderr
+    release.set()
+    th.join()
+
+    # both writes are acknowledged; the later commit wins and recovery must not change that
+    assert path.read_bytes() == b"B"
+    assert len(list(wal_dir.glob("*.wal"))) == 2
+    log.recover()
+    assert path.read_bytes() == b"B"
+    assert list(wal_dir.glob("*.wal")) == [log._seg.path]
@@ -0,0 +1,86 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import gateway
+import main
+from main import app
+
+
+def _allow(text, threshold=0.5):
+    return gateway.Decision(True, "personal", 0.9, "test", False, "test")
+
+
+def _fake_completion(endpoint, **kwargs):
+    words = ["You", " can", " do", " this."]
+    return iter(SimpleNamespace(choices=[SimpleNamespace(delta={"content": w})]) for w in words)
+
+
+def test_ws_chat_streams_and_saves_both_sides(monkeypatch):
+    monkeypatch.setattr(gateway, "decide", _allow)
+    calls = []
+    monkeypatch.setattr(main, "create_chat_completion", lambda e, **kw: (calls.append(kw), _fake_completion(e, **kw))[1])
+    uid = f"anon_ws{int(time.time() * 1000)}"
+
+    with TestClient(app).websocket_connect("/ws/chat") as ws:
+        for turn in (1, 2):
+            ws.send_json({"type": "chat", "user_id": uid, "thread_id": "t1", "message": f"I feel stuck ({turn})"})
+            deltas = []
+            while True:
+                msg = ws.receive_json()
+                if msg["type"] != "delta":
+                    break
+                deltas.append(msg["delta"])
+            assert msg == {"type": "done", "reply": "You can do this.", "count": 2 * turn}
+            assert "".join(deltas) == "You can do this."
+        ws.send_json({"type": "chat", "user_id": uid, "thread_id": "t1", "message": "  "})
+        assert ws.receive_json()["status"] == 400
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json() == {"type": "pong"}
+
+    assert calls[0]["stream"] is True and calls[0]["caller"].key == f"user:{uid}"
+    msgs = TestClient(app).get(f"/messages/{uid}/t1").json()["messages"]
+    assert [(m["role"], m["content"]) for m in msgs] == [
+        ("user", "I feel stuck (1)"), ("assistant", "You can do this."),
+        ("user", "I feel stuck (2)"), ("assistant", "You can do this."),
+    ]
+
+
+def test_ws_chat_authenticates_once_and_reserves_tokens(monkeypatch):
+    monkeypatch.setattr(gateway, "decide", _allow)
+    monkeypatch.setattr(main, "create_chat_completion", _fake_completion)
+    email = f"ws{int(time.time() * 1000)}@example.com"
+    created = TestClient(app).post("/users/create", json={"name": "WS", "email": email, "password": "pw"}).json()
+    uid = created["user"]["user_id"]
+    token = main.create_token_for_user(uid)
+
+    with TestClient(app).websocket_connect("/ws/chat") as ws:
+        ws.send_json({"type": "auth", "token": token})
+        assert ws.receive_json() == {"type": "auth", "subject": uid, "tokens_left": 500}
+        ws.send_json({"type": "chat", "user_id": "someone_else", "thread_id": "t1", "message": "hi"})
+        assert ws.receive_json()["status"] == 403
+        # the user id defaults to the authenticated subject
+        ws.send_json({"type": "chat", "thread_id": "t1", "message": "how do I pick a career path?"})
+        while (msg := ws.receive_json())["type"] == "delta":
+            pass
+        reserved = main.estimate_tokens_for_text("how do I pick a career path?") + 100
+        assert msg["tokens_left"] == 500 - reserved
+    assert main.load_users()[uid]["tokens_left"] == 500 - reserved
+
+
+def test_ws_chat_closes_idle_connections(monkeypatch):
+    monkeypatch.setattr(main, "WS_IDLE_TIMEOUT_SECONDS", 0.05)
+    with TestClient(app).websocket_connect("/ws/chat") as ws:
+        with pytest.raises(WebSocketDisconnect) as exc:
+            ws.receive_json()
+    assert exc.value.code == main.WS_CLOSE_IDLE
+
+
+def test_ws_chat_rejects_foreign_origins():
+    with pytest.raises(WebSocketDisconnect) as exc:
+        with TestClient(app).websocket_connect("/ws/chat", headers={"Origin": "https://evil.example"}):
+            pass
+    assert exc.value.code == main.WS_CLOSE_POLICY
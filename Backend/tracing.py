@@ -0,0 +1,196 @@
+"""Lightweight per-request tracing.
+
+A root span is opened per HTTP request by the middleware in `main.py`; code
+paths wrap interesting work in `tracing.span("storage.load_messages")` and the
+spans nest automatically through a context variable (this also works inside
+FastAPI's threadpool, which copies the context into the worker thread).
+
+Every traced response gets a `Server-Timing` header summarising the spans.
+A sampled fraction of requests (`TRACE_SAMPLE_RATE`, default 0.01) is
+appended as a span tree to `TRACE_FILE` (JSON lines).
+
+Print the slowest recorded traces:
+  python tracing.py --top 10
+  python tracing.py --top 5 --route "/summary/{user_id}/{thread_id}"
+"""
+import argparse
+import contextvars
+import json
+import os
+import random
+import re
+import threading
+import time
+import typing as t
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+TRACING_ENABLED = str(os.getenv("TRACING_ENABLED", "true")).lower() in ("1", "true", "yes")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE") or "0.01")
+TRACE_FILE = Path(os.getenv("TRACE_FILE") or (Path(__file__).resolve().parent / "traces.jsonl"))
+
+_current: contextvars.ContextVar = contextvars.ContextVar("trace_span", default=None)
+_file_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ("name", "start", "end", "children", "attrs", "_lock")
+
+    def __init__(self, name: str, attrs: t.Optional[dict] = None):
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: t.Optional[float] = None
+        self.children: t.List["Span"] = []
+        self.attrs = attrs or {}
+        self._lock = threading.Lock()
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000.0
+
+    def add_child(self, child: "Span"):
+        # children may be added from several threadpool threads at once
+        with self._lock:
+            self.children.append(child)
+
+    def to_dict(self, origin: t.Optional[float] = None) -> dict:
+        origin = self.start if origin is None else origin
+        out = {
+            "name": self.name,
+            "offset_ms": round((self.start - origin) * 1000.0, 3),
+            "duration_ms": round(self.duration_ms, 3),
+        }
+        if self.attrs:
+            out["attrs"] = self.attrs
+        if self.children:
+            out["children"] = [c.to_dict(origin) for c in self.children]
+        return out
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a block as a child of the current span. No-op outside a traced request."""
+    parent = _current.get()
+    if parent is None or not TRACING_ENABLED:
+        yield None
+        return
+    s = Span(name, attrs)
+    parent.add_child(s)
+    token = _current.set(s)
+    try:
+        yield s
+    finally:
+        s.end = time.perf_counter()
+        _current.reset(token)
+
+
+def start_trace(name: str) -> t.Tuple[t.Optional[Span], t.Any]:
+    if not TRACING_ENABLED:
+        return None, None
+    root = Span(name)
+    return root, _current.set(root)
+
+
+def finish_trace(root: t.Optional[Span], token) -> None:
+    if root is None:
+        return
+    root.end = time.perf_counter()
+    try:
+        _current.reset(token)
+    except Exception:
+        pass
+
+
+_TOKEN_RE = re.compile(r"[^A-Za-z0-9_.\-]")
+
+
+def server_timing_header(root: t.Optional[Span]) -> str:
+    """Aggregate all spans by name into a `Server-Timing` value (durations summed)."""
+    if root is None:
+        return ""
+    totals: t.Dict[str, float] = {}
+    counts: t.Dict[str, int] = {}
+    order: t.List[str] = []
+    stack = list(root.children)
+    while stack:
+        s = stack.pop(0)
+        key = _TOKEN_RE.sub("_", s.name)
+        if key not in totals:
+            order.append(key)
+        totals[key] = totals.get(key, 0.0) + s.duration_ms
+        counts[key] = counts.get(key, 0) + 1
+        stack.extend(s.children)
+    parts = []
+    for key in order:
+        entry = f"{key};dur={totals[key]:.1f}"
+        if counts[key] > 1:
+            entry += f';desc="x{counts[key]}"'
+        parts.append(entry)
+    parts.append(f"total;dur={root.duration_ms:.1f}")
+    return ", ".join(parts)
+
+
+def maybe_record(root: t.Optional[Span], route: str, method: str, status: int) -> None:
+    """Append the span tree to TRACE_FILE for a sampled fraction of requests."""
+    if root is None or TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+        return
+    entry = {
+        "ts": datetime.utcnow().isoformat(),
+        "route": route,
+        "method": method,
+        "status": status,
+        "duration_ms": round(root.duration_ms, 3),
+        "root": root.to_dict(),
+    }
+    try:
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with _file_lock:
+            with TRACE_FILE.open("a", encoding="utf-8") as f:
+                f.write(line)
+    except Exception:
+        pass
+
+
+# --- CLI ---
+
+def _print_tree(node: dict, depth: int = 0):
+    print(f"{'  ' * depth}{node['name']:<{40 - 2 * depth}} +{node['offset_ms']:>9.1f}ms {node['duration_ms']:>9.1f}ms")
+    for c in node.get("children", []):
+        _print_tree(c, depth + 1)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Print the slowest sampled request traces")
+    ap.add_argument("--file", default=str(TRACE_FILE))
+    ap.add_argument("--top", type=int, default=10)
+    ap.add_argument("--route", default=None, help="only traces for this route template")
+    args = ap.parse_args(argv)
+
+    path = Path(args.file)
+    if not path.exists():
+        print("no trace file at", path)
+        return
+    traces = []
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                tr = json.loads(line)
+            except Exception:
+                continue
+            if args.route and tr.get("route") != args.route:
+                continue
+            traces.append(tr)
+    traces.sort(key=lambda tr: tr.get("duration_ms", 0.0), reverse=True)
+    for tr in traces[: args.top]:
+        print(f"== {tr.get('method')} {tr.get('route')} status={tr.get('status')} {tr.get('duration_ms'):.1f}ms at {tr.get('ts')}")
+        _print_tree(tr["root"])
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,557 @@
+"""Write-ahead log with group commit for the file store.
+
+Every storage write (thread, summary, users.json) becomes a record appended
+to this process's segment in `DATA_DIR/_wal/`. A committer thread takes all
+records queued by concurrent writers (records that arrive during an fsync
+wait for the next one; WAL_GROUP_COMMIT_MS can hold a batch open longer, up
+to WAL_GROUP_COMMIT_BYTES) and appends them with one `write` and one `fsync`.
+Each writer then replaces its primary file (temp file + rename, no fsync)
+before its save returns, so readers in any worker see a write as soon as it
+is acknowledged. Records for the same file are applied in commit order: a
+writer waits for the previous record of its path before applying its own.
+When one batch holds several writes of the same file, only the last is
+applied, and the earlier writers return once it is.
+
+Versions: each record is stamped with a sequence number from `_wal/clock`,
+taken under an flock, so sequence order is commit order across all worker
+processes (the clock follows wall-clock nanoseconds and only falls back to
++1 when several stamps land in the same nanosecond). A primary's mtime is
+set to the sequence of the record that produced it, and a record is applied
+only while the file's sequence is older, under an flock striped by path
+(`_wal/apply-<n>.lock`). A write that lands after a newer one from another
+process is therefore dropped instead of rolling the file back.
+
+Primary files are made durable in the background: the checkpointer rotates
+the segment, fsyncs every file the old segment touched and deletes it.
+
+Recovery: each live process holds an flock on its own segment. Segments
+whose lock can be taken belong to processes that died; their records are
+re-applied in sequence order through the same guarded apply, so files
+already at or past a record's sequence are left alone, and the segment is
+removed. This runs when a process opens its log and during every
+checkpoint, so a worker that crashed is recovered by its siblings.
+
+Deletes also append a tombstone (<seq>\t<path>) to `_wal/tombstones.log`,
+fsynced before the delete is applied. A missing file is not recreated by a
+write older than its newest tombstone, even when the delete was logged by
+another process whose segment is long gone. Tombstones are dropped once
+every segment on disk is newer than them.
+
+Record paths are relative to the log directory's parent (DATA_DIR), so a data
+directory that is copied, restored or remounted elsewhere replays into
+itself. Absolute paths from older segments are replayed only when they point
+inside DATA_DIR.
+
+Record layout: <len u32><crc32 u32><seq i64><path_len u16><op u8><path><data>.
+A torn tail (short read or bad CRC) ends replay; it was never acknowledged.
+"""
+import collections
+import contextlib
+import fcntl
+import os
+import struct
+import threading
+import time
+import typing as t
+import zlib
+from pathlib import Path
+
+import metrics
+
+WAL_GROUP_COMMIT_MS = float(os.getenv("WAL_GROUP_COMMIT_MS") or "0")
+WAL_GROUP_COMMIT_BYTES = int(os.getenv("WAL_GROUP_COMMIT_BYTES") or str(4 << 20))
+WAL_CHECKPOINT_SECONDS = float(os.getenv("WAL_CHECKPOINT_SECONDS") or "10")
+WAL_CHECKPOINT_BYTES = int(os.getenv("WAL_CHECKPOINT_BYTES") or str(64 << 20))
+
+WAL_RECORDS = metrics.Counter("wal_records_total", "Records committed to the write-ahead log", ())
+WAL_BATCH_RECORDS = metrics.Histogram(
+    "wal_batch_records", "Records per group commit (one fsync each)", (),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+WAL_FSYNC_LATENCY = metrics.Histogram(
+    "wal_fsync_duration_seconds", "Write-ahead log fsync latency", (),
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+TOMBSTONE_GRACE_NS = 60 * 10**9
+
+WAL_REPLAYED = metrics.Counter("wal_replayed_records_total", "Records re-applied from dead processes' segments", ())
+
+_HEADER = struct.Struct("<IIqHB")
+OP_WRITE = 1
+OP_DELETE = 2
+# delete only if the file still has the (mtime_ns, size) in the record's data
+OP_DELETE_IF = 3
+_EXPECT = struct.Struct("<qQ")
+_CLOCK = struct.Struct("<q")
+APPLY_LOCK_STRIPES = 64
+
+
+def encode(ts: int, path: str, op: int, data: bytes = b"") -> bytes:
+    p = path.encode("utf8")
+    body = struct.pack("<qHB", ts, len(p), op) + p + data
+    return _HEADER.pack(len(data), zlib.crc32(body), ts, len(p), op) + p + data
+
+
+def read_segment(path: Path) -> t.List[t.Tuple[int, str, int, bytes]]:
+    """Return the complete records of a segment as (ts, path, op, data)."""
+    with open(path, "rb") as f:
+        buf = f.read()
+    out = []
+    pos = 0
+    while pos + _HEADER.size <= len(buf):
+        length, crc, ts, plen, op = _HEADER.unpack_from(buf, pos)
+        start = pos + _HEADER.size
+        end = start + plen + length
+        if end > len(buf):
+            break
+        body = struct.pack("<qHB", ts, plen, op) + buf[start:end]
+        if zlib.crc32(body) != crc:
+            break
+        out.append((ts, buf[start:start + plen].decode("utf8"), op, buf[start + plen:end]))
+        pos = end
+    return out
+
+
+def _replace_file(path: Path, data: bytes, ts: int) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # unique per writing thread: recovery and writers of other paths run concurrently
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.wal")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    # stamp the version before the rename so the file never shows up without it
+    os.utime(tmp, ns=(ts, ts))
+    os.replace(tmp, path)
+
+
+def _apply(path: Path, op: int, data: bytes, ts: int, deleted_at: t.Callable[[Path], int]) -> bool:
+    """Apply one record unless the file is already at a newer sequence; returns whether it was applied.
+
+    Caller holds the path's apply lock. `deleted_at(path)` is the sequence of
+    the newest tombstone for a missing file (-1 if none).
+    """
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        st = None
+    if op == OP_DELETE_IF:
+        if st is None or (st.st_mtime_ns, st.st_size) != _EXPECT.unpack(data):
+            return False
+    elif st is not None and st.st_mtime_ns >= ts:
+        if op == OP_WRITE or st.st_mtime_ns > ts:
+            return False  # already applied, or rewritten by a newer record
+    if op in (OP_DELETE, OP_DELETE_IF):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            return False
+        return True
+    if st is None and deleted_at(path) >= ts:
+        return False  # deleted by a newer record
+    _replace_file(path, data, ts)
+    return True
+
+
+def _fsync_paths(paths: t.Iterable[str]) -> None:
+    dirs = set()
+    for p in paths:
+        dirs.add(os.path.dirname(p))
+        try:
+            fd = os.open(p, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    # make the renames themselves durable
+    for d in dirs:
+        try:
+            fd = os.open(d, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class _Pending:
+    __slots__ = ("relpath", "size", "path", "op", "data", "ts", "done", "applied", "error", "segment",
+                 "prev", "next", "superseded", "result")
+
+    def __init__(self, relpath: str, path: Path, op: int, data: bytes):
+        self.relpath, self.path, self.op, self.data = relpath, path, op, data
+        self.size = _HEADER.size + len(relpath.encode("utf8")) + len(data)
+        # sequence number, stamped at commit
+        self.ts = 0
+        self.done = threading.Event()
+        self.applied = threading.Event()
+        self.error: t.Optional[BaseException] = None
+        self.segment: t.Optional["_Segment"] = None
+        # the previous and next committed records of the same path, while in flight
+        self.prev: t.Optional["_Pending"] = None
+        self.next: t.Optional["_Pending"] = None
+        self.superseded = False
+        self.result = True
+
+
+class _Segment:
+    def __init__(self, path: Path, f):
+        self.path = path
+        self.file = f
+        self.bytes = 0
+        self.dirty: t.Set[str] = set()
+        # committed records whose primary file has not been replaced yet
+        self.applying = 0
+
+
+class WriteAheadLog:
+    def __init__(self, directory: Path):
+        self.dir = Path(directory).absolute()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        # record paths are stored relative to this (DATA_DIR)
+        self.root = self.dir.parent
+        self.tombstones = self.dir / "tombstones.log"
+        self._tombstones_lock = self.dir / "tombstones.lock"
+        self._tombstone_cache: t.Tuple[t.Optional[t.Tuple[int, int]], t.Dict[Path, int]] = (None, {})
+        self._clock_fd = os.open(self.dir / "clock", os.O_RDWR | os.O_CREAT, 0o644)
+        self._clock_mutex = threading.Lock()
+        # flock is per open file, so each stripe also needs an in-process lock
+        self._stripes = [threading.Lock() for _ in range(APPLY_LOCK_STRIPES)]
+        self._stripe_fds: t.List[t.Optional[int]] = [None] * APPLY_LOCK_STRIPES
+        self._cond = threading.Condition()
+        self._queue: t.Deque[_Pending] = collections.deque()
+        self._seg_lock = threading.Lock()
+        self._applied = threading.Condition()
+        # newest committed record per path whose primary is not replaced yet (guarded by _applied)
+        self._tail: t.Dict[Path, _Pending] = {}
+        self._seg: t.Optional[_Segment] = None
+        self._sealed: t.List[_Segment] = []
+        self.recover()
+        self._seg = self._open_segment()
+        threading.Thread(target=self._commit_loop, name="wal-commit", daemon=True).start()
+        if WAL_CHECKPOINT_SECONDS > 0:
+            threading.Thread(target=self._checkpoint_loop, name="wal-checkpoint", daemon=True).start()
+
+    # --- segments ---
+
+    def _open_segment(self) -> _Segment:
+        path = self.dir / f"{os.getpid()}-{time.time_ns()}.wal"
+        f = open(path, "ab")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        _fsync_paths([str(path)])
+        return _Segment(path, f)
+
+    def _rotate(self):
+        """Seal the current segment and start a new one. Caller holds _seg_lock."""
+        if not self._seg.bytes:
+            return
+        old = self._seg
+        self._seg = self._open_segment()
+        self._sealed.append(old)
+        old.file.close()
+
+    # --- writes ---
+
+    def write(self, path: Path, data: bytes) -> None:
+        self._submit(path, OP_WRITE, data)
+
+    def delete(self, path: Path) -> None:
+        self._submit(path, OP_DELETE, b"")
+
+    def delete_if_unchanged(self, path: Path, mtime_ns: int, size: int) -> bool:
+        """Delete `path` unless it was rewritten since it had this mtime and size.
+
+        The check runs when the record is applied, after every earlier write of
+        the path, so a write acknowledged before the delete is never lost.
+        Returns whether the file was deleted.
+        """
+        return self._submit(path, OP_DELETE_IF, _EXPECT.pack(mtime_ns, size))
+
+    def _submit(self, path: Path, op: int, data: bytes) -> bool:
+        path = Path(path).absolute()
+        item = _Pending(os.path.relpath(path, self.root), path, op, data)
+        with self._cond:
+            self._queue.append(item)
+            self._cond.notify()
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        # the record is durable; replace the primary in this thread so applies of
+        # different paths run in parallel, and those of one path in commit order
+        try:
+            if item.prev is not None:
+                item.prev.applied.wait()
+                item.prev = None
+            if not item.superseded:
+                item.result = self._apply(item.path, item.op, item.data, item.ts)
+        finally:
+            item.applied.set()
+            with self._applied:
+                if self._tail.get(item.path) is item:
+                    del self._tail[item.path]
+                item.segment.applying -= 1
+                self._applied.notify_all()
+        if item.superseded:
+            # return once the write that replaced ours is visible
+            item.next.applied.wait()
+            item.next = None
+        return item.result
+
+    def _take_batch(self) -> t.List[_Pending]:
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            # give concurrent writers up to WAL_GROUP_COMMIT_MS to join this fsync
+            deadline = time.monotonic() + WAL_GROUP_COMMIT_MS / 1000.0
+            while sum(i.size for i in self._queue) < WAL_GROUP_COMMIT_BYTES:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, size = [], 0
+            while self._queue and (not batch or size + self._queue[0].size <= WAL_GROUP_COMMIT_BYTES):
+                item = self._queue.popleft()
+                batch.append(item)
+                size += item.size
+            return batch
+
+    def _commit_loop(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                with self._seg_lock:
+                    seg = self._seg
+                    first = self._stamp(len(batch))
+                    records = []
+                    for i, item in enumerate(batch):
+                        item.ts = first + i
+                        records.append(encode(item.ts, item.relpath, item.op, item.data))
+                    seg.file.write(b"".join(records))
+                    seg.file.flush()
+                    start = time.perf_counter()
+                    os.fsync(seg.file.fileno())
+                    WAL_FSYNC_LATENCY.observe(time.perf_counter() - start)
+                    seg.bytes += sum(len(r) for r in records)
+                    deletes = [item for item in batch if item.op != OP_WRITE]
+                    if deletes:
+                        self._add_tombstones(deletes)
+                    in_batch = {id(item) for item in batch}
+                    with self._applied:
+                        for item in batch:
+                            prev = self._tail.get(item.path)
+                            if prev is not None:
+                                item.prev = prev
+                                if id(prev) in in_batch and item.op != OP_DELETE_IF:
+                                    # only the last write of each file in the batch needs applying
+                                    # (a conditional delete must see the writes before it)
+                                    prev.superseded = True
+                                    prev.next = item
+                            self._tail[item.path] = item
+                            item.segment = seg
+                            seg.dirty.add(str(item.path))
+                        seg.applying += len(batch)
+                    if seg.bytes >= WAL_CHECKPOINT_BYTES:
+                        self._rotate()
+                WAL_RECORDS.inc(len(batch))
+                WAL_BATCH_RECORDS.observe(len(batch))
+            except BaseException as e:
+                for item in batch:
+                    item.error = e
+            for item in batch:
+                item.done.set()
+
+    # --- versions ---
+
+    def _stamp(self, n: int, at_least: int = 0) -> int:
+        """Reserve `n` consecutive sequence numbers (shared by all processes); returns the first."""
+        with self._clock_mutex:
+            fcntl.flock(self._clock_fd, fcntl.LOCK_EX)
+            try:
+                raw = os.pread(self._clock_fd, _CLOCK.size, 0)
+                last = _CLOCK.unpack(raw)[0] if len(raw) == _CLOCK.size else 0
+                first = max(time.time_ns(), last + 1, at_least)
+                os.pwrite(self._clock_fd, _CLOCK.pack(first + n - 1), 0)
+            finally:
+                fcntl.flock(self._clock_fd, fcntl.LOCK_UN)
+        return first
+
+    @contextlib.contextmanager
+    def _locked_path(self, path: Path):
+        i = zlib.crc32(str(path).encode("utf8")) % APPLY_LOCK_STRIPES
+        with self._stripes[i]:
+            fd = self._stripe_fds[i]
+            if fd is None:
+                fd = self._stripe_fds[i] = os.open(self.dir / f"apply-{i}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _apply(self, path: Path, op: int, data: bytes, ts: int) -> bool:
+        with self._locked_path(path):
+            return _apply(path, op, data, ts, self._deleted_at)
+
+    # --- tombstones ---
+
+    @contextlib.contextmanager
+    def _locked_tombstones(self):
+        with open(self._tombstones_lock, "a") as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lf, fcntl.LOCK_UN)
+
+    def _add_tombstones(self, items: t.Sequence[_Pending]) -> None:
+        lines = "".join(f"{item.ts}\t{os.path.relpath(item.path, self.root)}\n" for item in items)
+        with self._locked_tombstones(), open(self.tombstones, "ab") as f:
+            f.write(lines.encode("utf8"))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read_tombstones(self) -> t.List[t.Tuple[int, str]]:
+        try:
+            with open(self.tombstones, "rb") as f:
+                text = f.read().decode("utf8", errors="replace")
+        except FileNotFoundError:
+            return []
+        out = []
+        for line in text.split("\n"):
+            ts, _, path = line.partition("\t")
+            if path and ts.isdigit():
+                out.append((int(ts), path))
+        return out
+
+    def _deleted_at(self, path: Path) -> int:
+        """Sequence of the newest tombstone for `path`, or -1 (reread only when the log changed)."""
+        try:
+            st = self.tombstones.stat()
+        except FileNotFoundError:
+            return -1
+        sig, deleted = self._tombstone_cache
+        if sig != (st.st_ino, st.st_size):
+            deleted = {}
+            for ts, stored in self._read_tombstones():
+                p = self._resolve(stored)
+                if p is not None and ts > deleted.get(p, -1):
+                    deleted[p] = ts
+            self._tombstone_cache = ((st.st_ino, st.st_size), deleted)
+        return deleted.get(path, -1)
+
+    def _prune_tombstones(self) -> None:
+        """Drop tombstones older than every segment on disk (nothing left for them to mask)."""
+        starts = [time.time_ns()]
+        for seg in self.dir.glob("*.wal"):
+            try:
+                starts.append(int(seg.stem.rsplit("-", 1)[1]))
+            except (IndexError, ValueError):
+                continue
+        cutoff = min(starts) - TOMBSTONE_GRACE_NS
+        with self._locked_tombstones():
+            entries = self._read_tombstones()
+            keep = [(ts, path) for ts, path in entries if ts >= cutoff]
+            if len(keep) == len(entries):
+                return
+            tmp = self.tombstones.with_name(f".{self.tombstones.name}.{os.getpid()}.tmp")
+            tmp.write_bytes("".join(f"{ts}\t{path}\n" for ts, path in keep).encode("utf8"))
+            os.replace(tmp, self.tombstones)
+
+    # --- checkpoint / recovery ---
+
+    def _resolve(self, stored: str) -> t.Optional[Path]:
+        """The file a record refers to, or None if it lies outside this data directory."""
+        p = Path(stored)
+        if not p.is_absolute():
+            return self.root / p
+        try:
+            # written before paths were stored relative
+            return self.root / p.relative_to(self.root)
+        except ValueError:
+            print(f"[wal] skipping record for {stored}: outside {self.root}")
+            return None
+
+    def checkpoint(self) -> int:
+        """Make primaries touched by sealed segments durable and delete those segments."""
+        with self._seg_lock:
+            self._rotate()
+            sealed, self._sealed = self._sealed, []
+        for seg in sealed:
+            with self._applied:
+                self._applied.wait_for(lambda: seg.applying == 0)
+            _fsync_paths(seg.dirty)
+            try:
+                seg.path.unlink()
+            except FileNotFoundError:
+                pass
+        self.recover()
+        self._prune_tombstones()
+        return len(sealed)
+
+    def recover(self) -> int:
+        """Re-apply records from segments of processes that are no longer running."""
+        replayed = 0
+        for seg in sorted(self.dir.glob("*.wal")):
+            if (self._seg is not None and seg == self._seg.path) or any(seg == s.path for s in self._sealed):
+                continue
+            try:
+                f = open(seg, "rb")
+            except FileNotFoundError:
+                continue
+            with f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue  # owner is alive
+                records = read_segment(seg)
+                if records:
+                    # a clock file lost with the crash must not hand out sequences already used
+                    self._stamp(1, max(rec[0] for rec in records) + 1)
+                latest: t.Dict[str, t.Tuple[int, str, int, bytes]] = {}
+                for rec in records:
+                    if rec[1] not in latest or rec[0] >= latest[rec[1]][0]:
+                        latest[rec[1]] = rec
+                touched = []
+                for ts, path, op, data in sorted(latest.values()):
+                    p = self._resolve(path)
+                    if p is None or not self._apply(p, op, data, ts):
+                        continue
+                    touched.append(str(p))
+                    replayed += 1
+                _fsync_paths(touched)
+                try:
+                    seg.unlink()
+                except FileNotFoundError:
+                    pass
+        if replayed:
+            WAL_REPLAYED.inc(replayed)
+        return replayed
+
+    def _checkpoint_loop(self):
+        while True:
+            time.sleep(WAL_CHECKPOINT_SECONDS)
+            try:
+                self.checkpoint()
+            except Exception as e:
+                print("[wal] checkpoint failed:", e)
+
+
+_logs: t.Dict[str, WriteAheadLog] = {}
+_logs_lock = threading.Lock()
+_owner_pid = os.getpid()
+
+
+def get(directory: Path) -> WriteAheadLog:
+    """The log for `directory` in this process (opened, and recovered, on first use)."""
+    global _owner_pid
+    key = str(Path(directory).absolute())
+    with _logs_lock:
+        if os.getpid() != _owner_pid:
+            # threads and segment locks do not survive fork (gunicorn --preload)
+            _logs.clear()
+            _owner_pid = os.getpid()
+        log = _logs.get(key)
+        if log is None:
+            log = _logs[key] = WriteAheadLog(Path(key))
+        return log
@@ -242,22 +242,29 @@ export default function ChatPanel({ activeThread, session, preferences, onOpenRi
     const userId = localStorage.getItem("user_id") || "u1";
     const threadId = activeThread?.thread_id ?? "t1";
 
-    try {
-      const userPayload = { user_id: userId, thread_id: threadId, role: "user", content: text };
-      if (DEBUG) console.debug("POST /message (user):", userPayload);
-      pushDebug(`POST /message (user) -> ${API_BASE}/message`);
-                        try {
-                          const headers: any = { "Content-Type": "application/json", ...(getAuthHeader()) };
-                          void fetch(`${API_BASE}/message`, {
-                            method: "POST",
-                            headers,
-                            credentials: 'include',
-                            body: JSON.stringify(userPayload),
-                          });
-                        } catch (e) {}
-    } catch (e) {
-      pushDebug(`POST /message (user) failed: ${String(e)}`);
-    }
+    // the user turn is saved together with the assistant reply in one /messages/batch request
+    const userPayload = { user_id: userId, thread_id: threadId, role: "user", content: text, ts: userMsg.created_at };
+    let userSaved = false;
+    const saveTurn = (payloads: any[], keepalive = false) => {
+      if (payloads.includes(userPayload)) userSaved = true;
+      if (DEBUG) console.debug("POST /messages/batch:", payloads);
+      pushDebug(`POST /messages/batch -> ${API_BASE}/messages/batch (${payloads.length} messages)`);
+      try {
+        const headers: any = { "Content-Type": "application/json", ...(getAuthHeader()) };
+        void fetch(`${API_BASE}/messages/batch`, {
+          method: "POST",
+          headers,
+          credentials: 'include',
+          body: JSON.stringify({ messages: payloads }),
+          keepalive,
+        });
+      } catch (e) {
+        pushDebug(`POST /messages/batch failed: ${String(e)}`);
+      }
+    };
+    // reload, tab close or navigation while the reply streams: send the user's message on the way out
+    const saveOnExit = () => { if (!userSaved) saveTurn([userPayload], true); };
+    window.addEventListener("pagehide", saveOnExit);
 
       // increment anonymous user message count and persist
       try {
@@ -375,20 +382,9 @@ export default function ChatPanel({ activeThread, session, preferences, onOpenRi
         pushDebug(`/chat non-stream reply length ${String(finalAssistantContent).length}`);
       }
 
-      try {
-        const assistantPayload = { user_id: userId, thread_id: threadId, role: "assistant", content: finalAssistantContent ?? messages.find((m) => m.id === assistantId)?.content ?? "" };
-        pushDebug(`POST /message (assistant) -> ${API_BASE}/message (content len ${String(assistantPayload.content).length})`);
-      try {
-        const headers: any = { "Content-Type": "application/json", ...(getAuthHeader()) };
-        void fetch(`${API_BASE}/message`, {
-          method: "POST",
-          headers,
-          credentials: 'include',
-          body: JSON.stringify(assistantPayload),
-        });
-      } catch (e) {}
-      } catch (e) {
-        pushDebug(`POST /message (assistant) failed: ${String(e)}`);
+      const assistantPayload = { user_id: userId, thread_id: threadId, role: "assistant", content: finalAssistantContent ?? messages.find((m) => m.id === assistantId)?.content ?? "" };
+      if (assistantPayload.content) {
+        saveTurn(userSaved ? [assistantPayload] : [userPayload, assistantPayload]);
       }
     } catch (err: any) {
       if (err?.name === "AbortError") {
@@ -402,6 +398,9 @@ export default function ChatPanel({ activeThread, session, preferences, onOpenRi
         pushDebug(`handleSend error: ${String(err)}`);
       }
     } finally {
+      window.removeEventListener("pagehide", saveOnExit);
+      // no assistant reply to store (error or abort): still keep the user's message
+      if (!userSaved) saveTurn([userPayload]);
       setSending(false);
       abortRef.current = null;
     }
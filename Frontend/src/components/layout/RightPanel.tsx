@@ -362,7 +362,8 @@ export default function RightPanel({
           const savedRes = await fetch(`${API_BASE}/summary/saved/${encodeURIComponent(USER_ID)}/${encodeURIComponent(threadId)}`, { credentials: 'include', headers: { ...(getAuthHeader()) } });
           if (savedRes.ok) {
             const sv = await savedRes.json();
-            const serverSummary = sv?.summary || {};
+            // only the user's own edits override; a precomputed summary is older than this one
+            const serverSummary = sv?.edited ? (sv.summary || {}) : {};
             // normalize server-saved fields as well (they might be arrays)
             const serverNorm: any = {};
             if (serverSummary.current_state !== undefined) serverNorm.current_state = normalizeField(serverSummary.current_state);
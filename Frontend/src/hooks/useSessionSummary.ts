@@ -51,7 +51,20 @@ export function useSessionSummary(sessionId?: string) {
     const handleUserChanged = () => { void fetchSummary(); };
     if (typeof window !== 'undefined') window.addEventListener('ai_user_changed', handleUserChanged as EventListener);
 
-    return () => { mounted = false; if (typeof window !== 'undefined') window.removeEventListener('ai_user_changed', handleUserChanged as EventListener); };
+    // re-fetch when the change feed reports a new or deleted summary for this session
+    const handleThreadChanged = (e: Event) => {
+      const d = (e as CustomEvent).detail || {};
+      if (d.thread_id === sessionId && String(d.event || '').startsWith('summary')) void fetchSummary();
+    };
+    if (typeof window !== 'undefined') window.addEventListener('ai_thread_changed', handleThreadChanged as EventListener);
+
+    return () => {
+      mounted = false;
+      if (typeof window !== 'undefined') {
+        window.removeEventListener('ai_user_changed', handleUserChanged as EventListener);
+        window.removeEventListener('ai_thread_changed', handleThreadChanged as EventListener);
+      }
+    };
   }, [sessionId]);
 
   return { summary };
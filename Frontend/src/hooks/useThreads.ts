@@ -111,6 +111,49 @@ export function useThreads() {
   // eslint-disable-next-line react-hooks/exhaustive-deps
   }, []);
 
+  // Long-poll the per-user change feed instead of re-fetching lists to discover
+  // writes from other tabs/devices. Refetch the list when something changed and
+  // announce each change as `ai_thread_changed` ({ thread_id, event }).
+  useEffect(() => {
+    if (typeof window === 'undefined') return;
+    const ctrl = new AbortController();
+    let feedUser: string | null = null;
+    let since: number | null = null;
+    const sleep = (ms: number) => new Promise((r) => setTimeout(r, ms));
+
+    void (async () => {
+      let backoff = 1000;
+      while (!ctrl.signal.aborted) {
+        const uid = localStorage.getItem('user_id');
+        if (!uid || uid.startsWith('anon_')) { feedUser = null; await sleep(5000); continue; }
+        if (uid !== feedUser) { feedUser = uid; since = null; }
+        try {
+          const q = since === null ? '' : `?since=${since}`;
+          const resp = await fetch(`${API_BASE}/changes/${encodeURIComponent(uid)}${q}`, { credentials: 'include', headers: { ...(getAuthHeader()) }, signal: ctrl.signal });
+          if (!resp.ok) throw new Error(`status ${resp.status}`);
+          const data = await resp.json();
+          if (localStorage.getItem('user_id') !== uid) continue;
+          const changes = Array.isArray(data.changes) ? data.changes : [];
+          if (since !== null && (data.reset || changes.length > 0)) {
+            await fetchServerThreadsForUser(uid);
+            for (const c of changes) {
+              window.dispatchEvent(new CustomEvent('ai_thread_changed', { detail: { thread_id: c.thread_id, event: c.event } }));
+            }
+          }
+          since = typeof data.seq === 'number' ? data.seq : since;
+          backoff = 1000;
+        } catch (e) {
+          if (ctrl.signal.aborted) return;
+          await sleep(backoff);
+          backoff = Math.min(backoff * 2, 30000);
+        }
+      }
+    })();
+
+    return () => ctrl.abort();
+  // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, []);
+
   function addThread(title: string, description = "") {
     const id = `t${Date.now()}`;
     const now = new Date().toISOString();
@@ -0,0 +1,129 @@
+"""Compare the batch and streaming topic-classifier trainers on a synthetic corpus.
+
+Usage:
+  python tools/bench_topic_training.py [--n 1000000] [--chunk-size 10000] [--keep CORPUS.jsonl]
+
+Generates N labelled examples (templated from the four gateway classes),
+runs `train_topic_classifier.py` and `train_topic_classifier_streaming.py` on
+it in separate subprocesses and reports wall time and peak RSS of each
+(from wait4 rusage). Artifacts go to a temporary MODEL_DIR.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+
+TEMPLATES = {
+    "personal": [
+        "i feel {feel} about my {life}",
+        "my {rel} and i keep {conflict}",
+        "i'm {feel} because my {work} keeps {conflict}",
+        "how do i stop feeling {feel} at {work}",
+        "should i {decide} my {work}",
+    ],
+    "smalltalk": [
+        "{greet}",
+        "{greet}, how are you",
+        "{thanks} for {help}",
+        "{greet} there, what's up",
+    ],
+    "factoid": [
+        "where is the {place}",
+        "what is the population of {city}",
+        "when was the {event} signed",
+        "who invented the {thing}",
+    ],
+    "non_personal": [
+        "how do i {code} in {lang}",
+        "write a {lang} function to {code}",
+        "why does my {lang} {thing} throw an error",
+        "show me {lang} code to {code}",
+    ],
+}
+SLOTS = {
+    "feel": ["anxious", "stuck", "overwhelmed", "burned out", "lonely", "stressed", "unmotivated"],
+    "life": ["career", "relationship", "future", "promotion", "habits", "routine", "goals"],
+    "rel": ["partner", "manager", "friend", "sister", "roommate", "boss"],
+    "conflict": ["arguing", "fighting", "ignoring me", "moving the goalposts", "criticizing me"],
+    "work": ["job", "manager", "team", "workload", "project"],
+    "decide": ["quit", "change", "talk to", "leave", "stay at"],
+    "greet": ["hi", "hello", "hey", "good morning", "yo", "howdy"],
+    "thanks": ["thanks", "thank you", "cheers", "many thanks"],
+    "help": ["the help", "listening", "that", "your time"],
+    "place": ["eiffel tower", "grand canyon", "louvre", "great wall", "statue of liberty"],
+    "city": ["tokyo", "paris", "lagos", "lima", "delhi", "cairo"],
+    "event": ["declaration of independence", "magna carta", "treaty of versailles"],
+    "thing": ["telephone", "light bulb", "compiler", "script", "loop", "class"],
+    "code": ["reverse a list", "sort a dict", "parse json", "center a div", "read a file"],
+    "lang": ["python", "javascript", "rust", "go", "css", "java"],
+}
+
+
+def write_corpus(path: Path, n: int, seed: int = 7):
+    rng = random.Random(seed)
+    labels = list(TEMPLATES)
+    with open(path, "w", encoding="utf8") as f:
+        for _ in range(n):
+            label = rng.choice(labels)
+            text = rng.choice(TEMPLATES[label]).format(**{k: rng.choice(v) for k, v in SLOTS.items()})
+            # a little noise so not every example is a clean template
+            if rng.random() < 0.3:
+                text += " " + rng.choice(SLOTS[rng.choice(list(SLOTS))])
+            f.write(json.dumps({"text": text, "label": label}) + "\n")
+
+
+def run(cmd):
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    out = proc.stdout.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - t0
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        print(out)
+        raise SystemExit(f"{cmd[1]} failed with exit code {proc.returncode}")
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return elapsed, rss_mb, out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark batch vs streaming topic-classifier training")
+    ap.add_argument("--n", type=int, default=1_000_000)
+    ap.add_argument("--chunk-size", type=int, default=10000)
+    ap.add_argument("--epochs", type=int, default=1, help="streaming passes over the corpus")
+    ap.add_argument("--keep", help="write the corpus here instead of a temp file")
+    args = ap.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as d:
+        corpus = Path(args.keep) if args.keep else Path(d) / "corpus.jsonl"
+        t0 = time.perf_counter()
+        write_corpus(corpus, args.n)
+        print(f"corpus: {args.n} examples, {corpus.stat().st_size / 1e6:.1f} MB ({time.perf_counter() - t0:.1f}s to generate)")
+
+        runs = {
+            "batch (TF-IDF + LogisticRegression)": [
+                sys.executable, str(HERE / "train_topic_classifier.py"),
+                "--data", str(corpus), "--model-dir", str(Path(d) / "batch"), "--no-activate",
+            ],
+            f"streaming (Hashing + SGD, chunk {args.chunk_size})": [
+                sys.executable, str(HERE / "train_topic_classifier_streaming.py"),
+                "--data", str(corpus), "--model-dir", str(Path(d) / "stream"), "--no-activate",
+                "--chunk-size", str(args.chunk_size), "--epochs", str(args.epochs),
+            ],
+        }
+        print(f"\n{'trainer':45} {'wall s':>8} {'peak RSS MB':>12}")
+        for name, cmd in runs.items():
+            elapsed, rss, _ = run(cmd)
+            print(f"{name:45} {elapsed:>8.1f} {rss:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
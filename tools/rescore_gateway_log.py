@@ -0,0 +1,183 @@
+"""Re-score gateway_log.jsonl offline and sweep the classifier threshold.
+
+Usage:
+  python tools/rescore_gateway_log.py [LOG ...] [--model PATH|VERSION] [--workers N]
+        [--chunk-size 20000] [--thresholds 0.3:0.8:0.05] [--json report.json]
+
+LOG defaults to Backend/gateway_log.jsonl plus its rotated siblings
+(gateway_log.jsonl.1, gateway_log.jsonl.2.gz, ...); `.gz` files are read
+transparently. Lines are streamed in chunks; each chunk is scored in a worker
+process with one vectorized `predict_proba` call and with the heuristic
+`is_allowed_for_assistant`, and only per-threshold confusion counts are kept,
+so memory is bounded by workers x chunk size whatever the log size.
+
+For each threshold the report shows how often the classifier would allow a
+message and how its allow/deny decision compares with the heuristics
+(heuristic = reference: TP both allow, FP only ML allows, FN only heuristic
+allows, TN both deny).
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
+
+BACKEND = Path(__file__).resolve().parent.parent / "Backend"
+DEFAULT_LOG = BACKEND / "gateway_log.jsonl"
+
+_gateway = None
+_pipe = None
+
+
+def find_logs(paths):
+    if paths:
+        return [Path(p) for p in paths]
+    logs = [p for p in DEFAULT_LOG.parent.glob(DEFAULT_LOG.name + "*") if p.is_file()]
+    # oldest rotation first: gateway_log.jsonl.3.gz, ..., .1, then the live file
+    def rank(p):
+        suffix = p.name[len(DEFAULT_LOG.name):].lstrip(".").replace(".gz", "")
+        return -int(suffix) if suffix.isdigit() else 0
+    return sorted(logs, key=rank)
+
+
+def _open(path: Path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def iter_texts(paths, chunk_size):
+    buf = []
+    for path in paths:
+        with _open(path) as f:
+            for line in f:
+                try:
+                    text = json.loads(line).get("text")
+                except (ValueError, AttributeError):
+                    continue
+                if text:
+                    buf.append(str(text))
+                    if len(buf) >= chunk_size:
+                        yield buf
+                        buf = []
+    if buf:
+        yield buf
+
+
+def parse_thresholds(spec: str):
+    if ":" in spec:
+        lo, hi, step = (float(x) for x in spec.split(":"))
+        n = int(round((hi - lo) / step)) + 1
+        return [round(lo + i * step, 6) for i in range(n)]
+    return [float(x) for x in spec.split(",") if x.strip()]
+
+
+def _init_worker(model: str):
+    global _gateway, _pipe
+    sys.path.insert(0, str(BACKEND))
+    os.environ.setdefault("MODEL_WATCH_INTERVAL_SECONDS", "0")
+    import gateway
+    if model:
+        path = Path(model) if Path(model).exists() else gateway.artifact_path(model)
+        gateway.load_model(path)
+    _gateway, _pipe = gateway, gateway.current_pipeline()
+    if _pipe is None:
+        raise RuntimeError("no topic classifier could be loaded")
+
+
+def score_chunk(texts):
+    """Return (personal+smalltalk probability per text, heuristic decision per text)."""
+    probs = _pipe.predict_proba(texts)
+    labels = list(_pipe.classes_)
+    cols = [labels.index(c) for c in ("personal", "smalltalk") if c in labels]
+    personal = probs[:, cols].sum(axis=1) if cols else np.zeros(len(texts))
+    heur = np.fromiter((_gateway.is_allowed_for_assistant(x) for x in texts), dtype=bool, count=len(texts))
+    return personal.astype(np.float32), heur
+
+
+class Sweep:
+    def __init__(self, thresholds):
+        self.thresholds = np.asarray(thresholds, dtype=np.float32)
+        # rows: thresholds; cols: tp, fp, fn, tn
+        self.counts = np.zeros((len(thresholds), 4), dtype=np.int64)
+        self.rows = 0
+        self.heuristic_allowed = 0
+
+    def add(self, personal, heur):
+        allow = personal[None, :] >= self.thresholds[:, None]
+        h = heur[None, :]
+        self.counts[:, 0] += (allow & h).sum(axis=1)
+        self.counts[:, 1] += (allow & ~h).sum(axis=1)
+        self.counts[:, 2] += (~allow & h).sum(axis=1)
+        self.counts[:, 3] += (~allow & ~h).sum(axis=1)
+        self.rows += len(personal)
+        self.heuristic_allowed += int(heur.sum())
+
+    def report(self):
+        out = []
+        for thr, (tp, fp, fn, tn) in zip(self.thresholds, self.counts.tolist()):
+            n = tp + fp + fn + tn or 1
+            out.append({
+                "threshold": round(float(thr), 4),
+                "ml_allow_rate": round((tp + fp) / n, 4),
+                "agreement": round((tp + tn) / n, 4),
+                "tp": tp, "fp": fp, "fn": fn, "tn": tn,
+                "precision_vs_heuristic": round(tp / (tp + fp), 4) if tp + fp else None,
+                "recall_vs_heuristic": round(tp / (tp + fn), 4) if tp + fn else None,
+            })
+        return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Re-score gateway logs and sweep the gateway threshold")
+    ap.add_argument("logs", nargs="*")
+    ap.add_argument("--model", default="", help="artifact path or MODEL_DIR version (default: the active model)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--chunk-size", type=int, default=20000)
+    ap.add_argument("--thresholds", default="0.3:0.8:0.05", help="lo:hi:step or a comma list")
+    ap.add_argument("--json", help="also write the report as JSON here")
+    args = ap.parse_args(argv)
+
+    logs = find_logs(args.logs)
+    if not logs:
+        raise SystemExit("no gateway logs found")
+    sweep = Sweep(parse_thresholds(args.thresholds))
+    print("logs:", ", ".join(str(p) for p in logs))
+
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(args.model,)) as pool:
+        pending = set()
+        for chunk in iter_texts(logs, args.chunk_size):
+            # keep at most two chunks per worker in flight so memory stays bounded
+            if len(pending) >= 2 * args.workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    sweep.add(*fut.result())
+            pending.add(pool.submit(score_chunk, chunk))
+        for fut in pending:
+            sweep.add(*fut.result())
+    elapsed = time.perf_counter() - t0
+
+    rows = sweep.report()
+    print(f"\nrows: {sweep.rows}  heuristic allow rate: {sweep.heuristic_allowed / max(sweep.rows, 1):.4f}")
+    print(f"{'thr':>5} {'ml allow':>9} {'agree':>7} {'tp':>9} {'fp':>9} {'fn':>9} {'tn':>9} {'prec':>6} {'recall':>6}")
+    for r in rows:
+        prec = "-" if r["precision_vs_heuristic"] is None else f"{r['precision_vs_heuristic']:.3f}"
+        rec = "-" if r["recall_vs_heuristic"] is None else f"{r['recall_vs_heuristic']:.3f}"
+        print(f"{r['threshold']:>5.2f} {r['ml_allow_rate']:>9.3f} {r['agreement']:>7.3f} "
+              f"{r['tp']:>9} {r['fp']:>9} {r['fn']:>9} {r['tn']:>9} {prec:>6} {rec:>6}")
+    rate = sweep.rows / elapsed if elapsed > 0 else 0.0
+    print(f"\n{sweep.rows} rows in {elapsed:.1f}s ({rate:,.0f} rows/s, {args.workers} workers)")
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as f:
+            json.dump({"rows": sweep.rows, "seconds": round(elapsed, 3), "rows_per_second": round(rate, 1),
+                       "heuristic_allowed": sweep.heuristic_allowed, "sweep": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
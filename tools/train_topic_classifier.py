@@ -1,4 +1,9 @@
+import argparse
+import hashlib
+import io
 import json
+import os
+from datetime import datetime
 from pathlib import Path
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.linear_model import LogisticRegression
@@ -9,6 +14,8 @@ import joblib
 
 DATA = Path(__file__).resolve().parent / "topic_examples.jsonl"
 OUT_MODEL = Path(__file__).resolve().parent.parent / "Backend" / "topic_classifier.pkl"
+# versioned artifacts picked up by running servers (see Backend/gateway.py)
+MODEL_DIR = Path(os.getenv("MODEL_DIR") or (Path(__file__).resolve().parent.parent / "Backend" / "models"))
 
 def load_data(path):
     xs, ys = [], []
@@ -22,8 +29,34 @@ def load_data(path):
             ys.append(js["label"])
     return xs, ys
 
-def main():
-    X, y = load_data(DATA)
+def save_versioned(pipe, model_dir: Path, activate: bool = True) -> str:
+    """Write topic_classifier-<utc timestamp>-<hash>.pkl and optionally point CURRENT at it."""
+    buf = io.BytesIO()
+    joblib.dump(pipe, buf)
+    data = buf.getvalue()
+    version = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ") + "-" + hashlib.sha1(data).hexdigest()[:8]
+    model_dir.mkdir(parents=True, exist_ok=True)
+    path = model_dir / f"topic_classifier-{version}.pkl"
+    tmp = model_dir / f".{path.name}.tmp"
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+    print("Saved model version", version, "to", path)
+    if activate:
+        cur_tmp = model_dir / ".CURRENT.tmp"
+        cur_tmp.write_text(version + "\n", encoding="utf8")
+        os.replace(cur_tmp, model_dir / "CURRENT")
+        print("Activated", version, "(running servers reload it within MODEL_WATCH_INTERVAL_SECONDS)")
+    return version
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Train the topic classifier used by the chat gateway")
+    ap.add_argument("--data", default=str(DATA))
+    ap.add_argument("--model-dir", default=str(MODEL_DIR))
+    ap.add_argument("--no-activate", action="store_true",
+                    help="write the versioned artifact without updating CURRENT (activate later via /admin/model/reload)")
+    ap.add_argument("--legacy", action="store_true", help=f"write the single unversioned file {OUT_MODEL} instead")
+    args = ap.parse_args(argv)
+    X, y = load_data(args.data)
     if len(X) < 4:
         print("Not enough data to train")
         return
@@ -42,8 +75,11 @@ def main():
     preds = pipe.predict(X_test)
     print("Evaluation:")
     print(classification_report(y_test, preds))
-    joblib.dump(pipe, OUT_MODEL)
-    print("Saved model to", OUT_MODEL)
+    if args.legacy:
+        joblib.dump(pipe, OUT_MODEL)
+        print("Saved model to", OUT_MODEL)
+    else:
+        save_versioned(pipe, Path(args.model_dir), activate=not args.no_activate)
 
 if __name__ == "__main__":
     main()
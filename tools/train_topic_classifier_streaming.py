@@ -0,0 +1,207 @@
+"""Streaming (out-of-core) trainer for the topic classifier.
+
+Unlike `train_topic_classifier.py`, which loads every example into memory and
+refits TF-IDF + LogisticRegression, this reads JSONL in fixed-size chunks and
+updates a HashingVectorizer + SGDClassifier(log_loss) pipeline with
+`partial_fit`. The vectorizer is stateless, so memory stays bounded by the
+chunk size and the (n_classes x n_features) weight matrix regardless of corpus
+size, and an existing model can keep learning from new data.
+
+Usage:
+  # train from scratch
+  python tools/train_topic_classifier_streaming.py --data tools/topic_examples.jsonl
+
+  # continue training the active streaming model on newly labelled gateway-log entries
+  python tools/train_topic_classifier_streaming.py --init-from current --gateway-log Backend/gateway_log.jsonl
+
+Gateway-log entries are used only once a reviewer has added a `gold_label`
+field; the byte offset consumed per log file is kept in
+MODEL_DIR/streaming_state.json so each run only reads lines appended since
+the previous one. The result is written as a versioned artifact (see
+`save_versioned`) that running servers pick up like any other.
+"""
+import argparse
+import json
+import random
+import time
+import zlib
+from pathlib import Path
+
+import joblib
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from sklearn.pipeline import Pipeline
+
+from train_topic_classifier import DATA, MODEL_DIR, save_versioned
+
+CLASSES = ["factoid", "non_personal", "personal", "smalltalk"]
+STATE_FILE = "streaming_state.json"
+
+
+def make_pipeline(n_features: int = 2 ** 18) -> Pipeline:
+    return Pipeline([
+        # alternate_sign=False keeps features non-negative, like TF-IDF, so thread similarity still works
+        ("hash", HashingVectorizer(ngram_range=(1, 2), n_features=n_features, alternate_sign=False, norm="l2")),
+        ("clf", SGDClassifier(loss="log_loss", alpha=1e-5, random_state=42)),
+    ])
+
+
+def iter_examples(path, label_key="label", start=0, stats=None):
+    """Yield (text, label) from a JSONL file, skipping malformed or unlabelled lines.
+    `stats["offset"]` tracks the end of the last complete line consumed."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break  # partial line still being written
+            offset += len(raw)
+            if stats is not None:
+                stats["offset"] = offset
+            try:
+                js = json.loads(raw)
+            except ValueError:
+                continue
+            text, label = js.get("text"), js.get(label_key)
+            if text and label in CLASSES:
+                yield str(text), label
+
+
+def chunks(examples, size):
+    buf = []
+    for ex in examples:
+        buf.append(ex)
+        if len(buf) >= size:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+
+def _is_holdout(text: str, pct: int) -> bool:
+    # stable split without keeping an index of examples in memory
+    return pct > 0 and zlib.crc32(text.encode("utf8")) % 100 < pct
+
+
+class Trainer:
+    def __init__(self, pipe: Pipeline, holdout_pct: int = 10, seed: int = 42):
+        self.pipe = pipe
+        self.vec = pipe.named_steps["hash"]
+        self.clf = pipe.named_steps["clf"]
+        self.holdout_pct = holdout_pct
+        self.rng = random.Random(seed)
+        self.seen = 0
+        self.correct = 0
+        self.evaluated = 0
+
+    def fit_chunk(self, chunk, evaluate=False):
+        train = [ex for ex in chunk if not _is_holdout(ex[0], self.holdout_pct)]
+        test = [ex for ex in chunk if _is_holdout(ex[0], self.holdout_pct)]
+        if train:
+            self.rng.shuffle(train)
+            X = self.vec.transform([x for x, _ in train])
+            self.clf.partial_fit(X, [y for _, y in train], classes=CLASSES)
+            self.seen += len(train)
+        if evaluate and test and hasattr(self.clf, "coef_"):
+            preds = self.clf.predict(self.vec.transform([x for x, _ in test]))
+            self.correct += int(np.sum(preds == np.asarray([y for _, y in test])))
+            self.evaluated += len(test)
+
+    def accuracy(self):
+        return self.correct / self.evaluated if self.evaluated else None
+
+
+def _load_init(init_from: str, model_dir: Path) -> Pipeline:
+    if init_from == "current":
+        version = (model_dir / "CURRENT").read_text(encoding="utf8").strip()
+        path = model_dir / f"topic_classifier-{version}.pkl"
+    elif Path(init_from).exists():
+        path = Path(init_from)
+    else:
+        path = model_dir / f"topic_classifier-{init_from}.pkl"
+    pipe = joblib.load(path)
+    if "hash" not in getattr(pipe, "named_steps", {}) or not hasattr(pipe.named_steps.get("clf"), "partial_fit"):
+        raise SystemExit(f"{path} is not a streaming (HashingVectorizer + SGD) model; retrain from scratch instead")
+    print("Continuing from", path)
+    return pipe
+
+
+def _load_state(model_dir: Path) -> dict:
+    try:
+        return json.loads((model_dir / STATE_FILE).read_text(encoding="utf8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(model_dir: Path, state: dict):
+    model_dir.mkdir(parents=True, exist_ok=True)
+    tmp = model_dir / f".{STATE_FILE}.tmp"
+    tmp.write_text(json.dumps(state, indent=2), encoding="utf8")
+    tmp.replace(model_dir / STATE_FILE)
+
+
+def _log_start(state: dict, path: Path) -> int:
+    entry = state.get(str(path.resolve()))
+    st = path.stat()
+    # start over if the log was rotated/truncated since the last run
+    if not entry or entry.get("inode") != st.st_ino or entry.get("offset", 0) > st.st_size:
+        return 0
+    return int(entry["offset"])
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Out-of-core training for the gateway topic classifier")
+    ap.add_argument("--data", action="append", default=[], help="JSONL with text/label (repeatable)")
+    ap.add_argument("--gateway-log", action="append", default=[], help="gateway_log.jsonl to mine for gold_label entries")
+    ap.add_argument("--init-from", help="'current', a version, or a path to continue training from")
+    ap.add_argument("--model-dir", default=str(MODEL_DIR))
+    ap.add_argument("--chunk-size", type=int, default=10000)
+    ap.add_argument("--epochs", type=int, default=5, help="passes over --data files (gateway logs are read once)")
+    ap.add_argument("--n-features", type=int, default=2 ** 18)
+    ap.add_argument("--holdout-pct", type=int, default=10)
+    ap.add_argument("--no-activate", action="store_true")
+    ap.add_argument("--dry-run", action="store_true", help="train and evaluate without writing an artifact or state")
+    args = ap.parse_args(argv)
+
+    model_dir = Path(args.model_dir)
+    data_files = args.data or ([] if args.gateway_log else [str(DATA)])
+    pipe = _load_init(args.init_from, model_dir) if args.init_from else make_pipeline(args.n_features)
+    trainer = Trainer(pipe, holdout_pct=args.holdout_pct)
+
+    t0 = time.perf_counter()
+    for epoch in range(args.epochs if data_files else 0):
+        last = epoch == args.epochs - 1
+        for path in data_files:
+            for chunk in chunks(iter_examples(path), args.chunk_size):
+                trainer.fit_chunk(chunk, evaluate=last)
+        print(f"epoch {epoch + 1}/{args.epochs}: {trainer.seen} examples seen")
+
+    state = _load_state(model_dir)
+    for log in args.gateway_log:
+        path = Path(log)
+        start = _log_start(state, path)
+        stats = {"offset": start}
+        before = trainer.seen
+        for chunk in chunks(iter_examples(path, label_key="gold_label", start=start, stats=stats), args.chunk_size):
+            trainer.fit_chunk(chunk, evaluate=True)
+        state[str(path.resolve())] = {"inode": path.stat().st_ino, "offset": stats["offset"]}
+        print(f"{path}: {trainer.seen - before} new labelled entries (bytes {start}..{stats['offset']})")
+
+    elapsed = time.perf_counter() - t0
+    acc = trainer.accuracy()
+    print(f"trained on {trainer.seen} examples in {elapsed:.1f}s"
+          + (f", holdout accuracy {acc:.3f} on {trainer.evaluated}" if acc is not None else ""))
+    if not trainer.seen:
+        print("No new labelled examples; nothing written")
+        return None
+    if args.dry_run:
+        return None
+    version = save_versioned(pipe, model_dir, activate=not args.no_activate)
+    if args.gateway_log:
+        _save_state(model_dir, state)
+    return version
+
+
+if __name__ == "__main__":
+    main()